@@ -0,0 +1,135 @@
+'''
+Lookup tables for the 8 bit arithmetic and logic instructions.
+
+ADD_TABLE and SUB_TABLE are indexed by alu_index(carry, a, operand) and hold
+(flags << 8) | result, where flags is a complete F byte worked out exactly as
+Component.addition_with_flags / subtraction_with_flags followed by
+set_potential_flags would: sign, zero, half carry, overflow in the P/V bit,
+add/subtract and carry. The flag template of an instruction is compiled once into
+masks by compile_flag_template, so the new F is
+(F & keep) | (flags & from_result) | set.
+'''
+from base import (
+    SIGN_FLAG, ZERO_FLAG, HALF_CARRY_FLAG, PARITY_OVERFLOW_FLAG, ADD_SUBTRACT_FLAG, CARRY_FLAG,
+    FLAG_MASKS, SIGN_TABLE, ZERO_TABLE, PARITY_TABLE,
+)
+from instructions import INSTRUCTION_FLAG_POSITIONS
+
+FLAG_REGISTER_MASK = 0xFF
+
+# Template actions that take the flag from the result
+FROM_RESULT_ACTIONS = ["+", "V", "P"]
+KEEP_ACTIONS = ["-", " "]
+
+
+def alu_index(carry, a, operand):
+    return (carry << 16) | (a << 8) | operand
+
+
+def negative(value):
+    '''
+    Mirrors Component.sign, which counts 128 and above (including 256) as negative
+    '''
+    return value > 127
+
+
+def sign_zero_flags(result):
+    flags = 0
+    if SIGN_TABLE[result]:
+        flags |= FLAG_MASKS[SIGN_FLAG]
+    if ZERO_TABLE[result]:
+        flags |= FLAG_MASKS[ZERO_FLAG]
+    return flags
+
+
+def addition_entry(a, value):
+    '''
+    value is the operand plus the carry in, so it can be 256
+    '''
+    result = a + value
+    overflow_result = result % 256
+    left_nibble = a % 16
+    result_nibble = (left_nibble + value % 16) % 16
+
+    flags = sign_zero_flags(overflow_result)
+    if overflow_result != result:
+        flags |= FLAG_MASKS[CARRY_FLAG]
+    if left_nibble > result_nibble:
+        flags |= FLAG_MASKS[HALF_CARRY_FLAG]
+    if negative(a) == negative(value) and negative(a) != negative(overflow_result):
+        flags |= FLAG_MASKS[PARITY_OVERFLOW_FLAG]
+    return (flags << 8) | overflow_result
+
+
+def subtraction_entry(a, value):
+    result = a - value
+    overflow_result = result % 256
+
+    flags = sign_zero_flags(overflow_result) | FLAG_MASKS[ADD_SUBTRACT_FLAG]
+    if overflow_result != result:
+        flags |= FLAG_MASKS[CARRY_FLAG]
+    if a % 16 - value % 16 < 0:
+        flags |= FLAG_MASKS[HALF_CARRY_FLAG]
+    if negative(a) != negative(value) and negative(a) != negative(overflow_result):
+        flags |= FLAG_MASKS[PARITY_OVERFLOW_FLAG]
+    return (flags << 8) | overflow_result
+
+
+def build_table(entry):
+    return [
+        entry(a, operand + carry)
+        for carry in range(2)
+        for a in range(256)
+        for operand in range(256)
+    ]
+
+
+def decrement_entry(a):
+    '''
+    dec sets P/V when the result is 127 rather than from the subtraction overflow
+    '''
+    entry = subtraction_entry(a, 1)
+    overflow_mask = FLAG_MASKS[PARITY_OVERFLOW_FLAG] << 8
+    if entry & 0xFF == 127:
+        return entry | overflow_mask
+    return entry & ~overflow_mask
+
+
+def logic_flags(result):
+    '''
+    Sign, zero and parity (in the P/V bit) of the result of and, or and xor
+    '''
+    flags = sign_zero_flags(result)
+    if PARITY_TABLE[result]:
+        flags |= FLAG_MASKS[PARITY_OVERFLOW_FLAG]
+    return flags
+
+
+def compile_flag_template(flags):
+    '''
+    Returns (keep, from_result, set) masks for an instruction flag template such as
+    "++V+++", or None if the template has actions that depend on more than the result
+    ("*"). Flags the template does not mention (bits 5 and 3) are kept.
+    '''
+    keep = FLAG_REGISTER_MASK
+    from_result = 0
+    set_mask = 0
+    for i, action in enumerate(flags):
+        mask = FLAG_MASKS[INSTRUCTION_FLAG_POSITIONS[i]]
+        if action in KEEP_ACTIONS:
+            continue
+        keep &= ~mask
+        if action in FROM_RESULT_ACTIONS:
+            from_result |= mask
+        elif action == "1":
+            set_mask |= mask
+        elif action != "0":
+            return None
+    return keep, from_result, set_mask
+
+
+ADD_TABLE = build_table(addition_entry)
+SUB_TABLE = build_table(subtraction_entry)
+INC_TABLE = [addition_entry(a, 1) for a in range(256)]
+DEC_TABLE = [decrement_entry(a) for a in range(256)]
+LOGIC_FLAGS_TABLE = [logic_flags(result) for result in range(256)]
@@ -1,3 +1,5 @@
+import re
+
 SIGN_FLAG = "S"
 ZERO_FLAG = "Z"
 HALF_CARRY_FLAG = "H"
@@ -16,6 +18,24 @@ FLAG_POSITIONS = {
     CARRY_FLAG: 0,
 }
 
+FLAG_MASKS = {flag: 1 << position for flag, position in FLAG_POSITIONS.items()}
+
+ADDRESS_SPACE_SIZE = 256 * 256
+
+# Memory.track_dirty_pages records writes in pages of 256 bytes
+DIRTY_PAGE_SHIFT = 8
+DIRTY_PAGE_SIZE = 1 << DIRTY_PAGE_SHIFT
+DIRTY_RUN_PATTERN = re.compile(b"\x01+")
+
+# Bits 5 and 3 of the flag register, which copy bits of a result or operand
+UNDOCUMENTED_BITS_MASK = 0x28
+
+# Flag lookups for a byte value, indexed by the value
+SIGN_TABLE = [value >= 128 for value in range(256)]
+ZERO_TABLE = [value == 0 for value in range(256)]
+PARITY_TABLE = [bin(value).count("1") % 2 == 0 for value in range(256)]
+XY_TABLE = [value & UNDOCUMENTED_BITS_MASK for value in range(256)]
+
 
 class Component:
 
@@ -43,28 +63,20 @@ class Component:
         self.contents = self.contents % self.HALF_MAX_VALUE
 
     def set_potential_flags(self, instruction=False):
-        if self.get_contents() >= self.MAX_VALUE / 2:
-            self.potential_flags[SIGN_FLAG] = True
-        else:
-            self.potential_flags[SIGN_FLAG] = False
-
-        if self.get_contents() == 0:
-            self.potential_flags[ZERO_FLAG] = True
+        contents = self.get_contents()
+        if self.SIZE == 1:
+            self.potential_flags[SIGN_FLAG] = SIGN_TABLE[contents]
+            self.potential_flags[ZERO_FLAG] = ZERO_TABLE[contents]
         else:
-            self.potential_flags[ZERO_FLAG] = False
+            self.potential_flags[SIGN_FLAG] = contents >= self.MAX_VALUE / 2
+            self.potential_flags[ZERO_FLAG] = contents == 0
 
         if instruction:
             if instruction.instruction_base == "dec":
-                if self.get_contents() == 127:
-                    self.potential_flags[PARITY_OVERFLOW_FLAG] = True
-                else:
-                    self.potential_flags[PARITY_OVERFLOW_FLAG] = False
+                self.potential_flags[PARITY_OVERFLOW_FLAG] = contents == 127
 
         if self.SIZE == 1:
-            if self.parity():
-                self.potential_flags[PARITY] = True
-            else:
-                self.potential_flags[PARITY] = False
+            self.potential_flags[PARITY] = PARITY_TABLE[contents]
 
     def addition_with_flags(self, value):
         result = self.get_contents() + value
@@ -152,13 +164,13 @@ class Component:
             self.contents = (self.contents << 1) | bit
 
     def get_bit_position(self, bit_pos):
-        bit_list = self.convert_contents_to_bit_list()
-        return bit_list[7 - bit_pos]
+        return (self.contents >> bit_pos) & 1
 
-    def set_bit_position(self, bit_pos, bit)    :
-        bit_list = self.convert_contents_to_bit_list()
-        bit_list[7 - bit_pos] = bit
-        self.convert_bit_list_to_contents(bit_list)
+    def set_bit_position(self, bit_pos, bit):
+        if bit:
+            self.contents = self.contents | (1 << bit_pos)
+        else:
+            self.contents = self.contents & ~(1 << bit_pos)
 
     def split_bit_list_at_bit_pos(self, bit_pos):
         bit_list = self.convert_contents_to_bit_list()
@@ -168,24 +180,22 @@ class Component:
         return self.split_bit_list_at_bit_pos(3)
 
     def get_flag(self, flag):
-        flag_position = 7 - FLAG_POSITIONS[flag]
-        bit_list = self.convert_contents_to_bit_list()
-        return bit_list[flag_position]
-        
+        return (self.contents >> FLAG_POSITIONS[flag]) & 1
+
     def set_flag(self, flag):
-        flag_position = 7 - FLAG_POSITIONS[flag]
-        bit_list = self.convert_contents_to_bit_list()
-        bit_list[flag_position] = 1
-        self.convert_bit_list_to_contents(bit_list)
+        self.contents = self.contents | FLAG_MASKS[flag]
 
     def reset_flag(self, flag):
-        flag_position = 7 - FLAG_POSITIONS[flag]
-        bit_list = self.convert_contents_to_bit_list()
-        bit_list[flag_position] = 0
-        self.convert_bit_list_to_contents(bit_list)
+        self.contents = self.contents & ~FLAG_MASKS[flag]
+
+    def set_undocumented_bits(self, value):
+        '''
+        Copies bits 5 and 3 of value into bits 5 and 3 of this (flag) register
+        '''
+        self.contents = (self.contents & ~UNDOCUMENTED_BITS_MASK) | XY_TABLE[value]
 
     def parity(self):
-        return sum(self.convert_contents_to_bit_list()) % 2 == 0
+        return PARITY_TABLE[self.contents]
 
 class DoubleComponent(Component):
 
@@ -247,29 +257,294 @@ class DoubleComponent(Component):
         self.potential_flags = self.high.potential_flags
 
 
+class MemoryCell(Component):
+    '''
+    A Component view onto one address of a Memory, for instructions that operate on
+    (hl), (ix+*) etc. Its name is the address, as it was when memory was a list of
+    Components.
+    '''
+
+    def __init__(self, memory, address):
+        self.memory = memory
+        self.name = address
+        self.potential_flags = {}
+
+    @property
+    def contents(self):
+        return self.memory.get_contents_value(self.name)
+
+    @contents.setter
+    def contents(self, value):
+        self.memory.set_contents_value(self.name, value)
+
+    def get_contents(self):
+        return self.memory.get_contents_value(self.name)
+
+    def set_contents(self, value):
+        self.memory.set_contents_value(self.name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryCell) and other.memory is self.memory and other.name == self.name
+
+    def __hash__(self):
+        return hash((id(self.memory), self.name))
+
+
+def ignore_write(address, value):
+    return
+
+
 class Memory:
+    '''
+    Byte addressed RAM. Regions can be mapped to change what reads and writes of some
+    addresses do (ROM, mirrors, memory mapped devices). Until the first region is
+    mapped, get_contents_value and set_contents_value index the bytearray directly;
+    after that they look the address up in region_map, and addresses with no region
+    still go straight to the bytearray without a further call. load, dump and
+    read_block see the RAM underneath any regions.
+
+    storage is the bytearray holding the memory (contents here) and dirty pages are
+    numbered by their offset in it.
+    '''
 
     def __init__(self, size):
-        #self.contents = [Component("address: {}".format(e)) for e in range(size)]
-        self.contents = [Component(e) for e in range(size)]
+        self.size = size
+        self.contents = bytearray(size)
+        self.storage = self.contents
+        self.write_listeners = []
+        self.region_map = None
+        self.dirty_pages = None
+
+    def add_write_listener(self, listener):
+        '''
+        listener(start, length) is called after every write to memory
+        '''
+        self.write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        self.write_listeners.remove(listener)
 
     def get_contents(self, address):
-        if address >= len(self.contents):
-             raise Exception("Memory address out of range!!! address: {}, memory size: {}".format(address, self.contents))
-        return self.contents[address]
+        if address >= self.size:
+             raise Exception("Memory address out of range!!! address: {}, memory size: {}".format(address, self.size))
+        if address < 0:
+            address += self.size
+        return MemoryCell(self, address)
 
     def get_contents_value(self, address):
-        return self.contents[address].get_contents()
+        return self.contents[address]
 
     def set_contents_value(self, address, value):
-        self.contents[address].set_contents(value)
+        self.contents[address] = value
+        if self.write_listeners:
+            for listener in self.write_listeners:
+                listener(address, 1)
+
+    def map_region(self, start, end, read=None, write=None):
+        '''
+        Routes accesses to start..end - 1 through read(address), which returns the
+        byte, and write(address, value). A read or write of None leaves that kind of
+        access on RAM.
+        '''
+        if not self.in_range(start, end):
+            raise Exception("Region out of range!!! start: {}, end: {}, memory size: {}".format(start, end, self.size))
+        if self.region_map is None:
+            self.region_map = [None] * self.size
+            self.get_contents_value = self.mapped_get_contents_value
+            self.set_contents_value = self.mapped_set_contents_value
+        region = (read, write)
+        for address in range(start, end):
+            self.region_map[address] = region
+
+    def unmap_region(self, start, end):
+        if self.region_map is None:
+            return
+        for address in range(start, end):
+            self.region_map[address] = None
+
+    def map_rom(self, start, end):
+        '''
+        Writes to start..end - 1 are ignored. Use load to put the ROM image in place.
+        '''
+        self.map_region(start, end, write=ignore_write)
+
+    def map_mirror(self, start, end, target, length=None):
+        '''
+        Makes start..end - 1 repeat the length bytes from target (by default the same
+        length as the region), so reads and writes go to the target address
+        '''
+        length = length or end - start
+
+        def read(address):
+            return self.get_contents_value(target + (address - start) % length)
+
+        def write(address, value):
+            self.set_contents_value(target + (address - start) % length, value)
+
+        self.map_region(start, end, read, write)
+
+    def track_dirty_pages(self):
+        '''
+        Starts recording which pages of storage are written, in the dirty_pages
+        bytearray. Writes then go through a method that also marks the page, so memory
+        that is not tracked pays nothing.
+        '''
+        if self.dirty_pages is not None:
+            return
+        self.dirty_pages = bytearray((self.storage_size() + DIRTY_PAGE_SIZE - 1) >> DIRTY_PAGE_SHIFT)
+        if self.region_map is None:
+            self.set_contents_value = self.tracked_set_contents_value
+
+    def mark_dirty(self, start, length):
+        '''
+        Marks the pages of storage offsets start..start + length - 1 as written
+        '''
+        if self.dirty_pages is None or length <= 0:
+            return
+        first = start >> DIRTY_PAGE_SHIFT
+        last = (start + length - 1) >> DIRTY_PAGE_SHIFT
+        self.dirty_pages[first:last + 1] = b"\x01" * (last - first + 1)
+
+    def dirty_ranges(self):
+        '''
+        (start, end) storage offsets of each run of dirty pages
+        '''
+        return [
+            (match.start() << DIRTY_PAGE_SHIFT, min(match.end() << DIRTY_PAGE_SHIFT, self.storage_size()))
+            for match in DIRTY_RUN_PATTERN.finditer(self.dirty_pages)
+        ]
+
+    def clear_dirty_pages(self):
+        if self.dirty_pages is not None:
+            self.dirty_pages[:] = bytes(len(self.dirty_pages))
+
+    def storage_size(self):
+        return len(self.storage)
+
+    def read_storage(self, start, end):
+        return bytes(self.storage[start:end])
+
+    def write_storage(self, start, data):
+        '''
+        Replaces storage from offset start with data. Call written afterwards.
+        '''
+        self.storage[start:start + len(data)] = data
+
+    def clone(self):
+        '''
+        A copy of the memory. Regions, write listeners and dirty page tracking are not
+        copied.
+        '''
+        memory = Memory(self.size)
+        memory.contents[:] = self.contents
+        return memory
+
+    def tracked_set_contents_value(self, address, value):
+        self.contents[address] = value
+        self.dirty_pages[address >> DIRTY_PAGE_SHIFT] = 1
+        if self.write_listeners:
+            for listener in self.write_listeners:
+                listener(address, 1)
+
+    def mapped_get_contents_value(self, address):
+        region = self.region_map[address]
+        if region is None or region[0] is None:
+            return self.contents[address]
+        return region[0](address)
+
+    def mapped_set_contents_value(self, address, value):
+        region = self.region_map[address]
+        if region is None or region[1] is None:
+            self.contents[address] = value
+            if self.dirty_pages is not None:
+                self.dirty_pages[address >> DIRTY_PAGE_SHIFT] = 1
+        else:
+            region[1](address, value)
+        if self.write_listeners:
+            for listener in self.write_listeners:
+                listener(address, 1)
+
+    def read_block(self, start, length):
+        return bytes(self.contents[start:start + length])
+
+    def in_range(self, start, end):
+        return 0 <= start <= end <= self.size
+
+    def copy_block(self, source, destination, length):
+        '''
+        Copies length bytes from source to destination as one slice. Returns False
+        without copying if the ranges overlap or leave memory, or write listeners need
+        to see each byte or regions are mapped.
+        '''
+        if self.write_listeners or self.region_map is not None:
+            return False
+        if not self.in_range(source, source + length) or not self.in_range(destination, destination + length):
+            return False
+        if source < destination + length and destination < source + length:
+            return False
+        self.contents[destination:destination + length] = self.contents[source:source + length]
+        self.mark_dirty(destination, length)
+        return True
+
+    def find(self, value, start, end):
+        '''
+        Address of the first value in start..end - 1, -1 if there isn't one, or None if
+        the range leaves memory or regions are mapped
+        '''
+        if not self.in_range(start, end) or self.region_map is not None:
+            return None
+        return self.contents.find(value, start, end)
+
+    def rfind(self, value, start, end):
+        '''
+        As find, but the address of the last value in the range
+        '''
+        if not self.in_range(start, end) or self.region_map is not None:
+            return None
+        return self.contents.rfind(value, start, end)
 
     def dump(self):
-        return [e.get_contents() for e in self.contents]
+        return list(self.contents)
 
-    def load(self, data):
-        for address,value in enumerate(data):
-            self.contents[address].set_contents(value)
+    def load(self, data, start=0):
+        if start + len(data) > self.size:
+            raise Exception("Data does not fit in memory!!! start: {}, length: {}, memory size: {}".format(start, len(data), self.size))
+        self.contents[start:start + len(data)] = bytes(data)
+        self.written(start, len(data))
+
+    def load_file(self, file, start, length):
+        '''
+        Reads length bytes from an open binary file straight into memory at start,
+        returning the number of bytes read
+        '''
+        if start + length > self.size:
+            raise Exception("Data does not fit in memory!!! start: {}, length: {}, memory size: {}".format(start, length, self.size))
+        count = file.readinto(self.block_view(start, length))
+        self.written(start, length)
+        return count
+
+    def block_view(self, start, length):
+        '''
+        A writable memoryview of length bytes from start, for filling memory without
+        copying, or None if those bytes are not contiguous. Call written(start, length)
+        after changing it.
+        '''
+        return memoryview(self.contents)[start:start + length]
+
+    def layout(self):
+        '''
+        Bytes describing how storage is mapped into the address space, saved in
+        checkpoints alongside storage. Flat memory has nothing to record.
+        '''
+        return b""
+
+    def set_layout(self, layout):
+        return
+
+    def written(self, start, length):
+        self.mark_dirty(start, length)
+        for listener in self.write_listeners:
+            listener(start, length)
 
 
 
@@ -291,3 +566,56 @@ class InstructionBase:
 
     def run(self):
         pass
+
+
+class IOBus:
+    '''
+    Port I/O. in and out pass the full 16 bit port address: B (or A for in a,(*) and
+    out (*),a) on the high byte. Handlers are registered for a port and a mask and
+    match an address when address & mask == port & mask; the first match handles the
+    access. With no handlers registered, or no match, the 256 byte ports Memory is read
+    or written at the low byte of the address.
+    '''
+
+    def __init__(self, ports):
+        self.ports = ports
+        self.read_handlers = []
+        self.write_handlers = []
+        # The last byte read or written
+        self.data = 0
+
+    def add_read_handler(self, port, handler, mask=0xFF):
+        '''
+        handler(address) returns the byte read
+        '''
+        self.read_handlers.append((mask, port & mask, handler))
+
+    def add_write_handler(self, port, handler, mask=0xFF):
+        '''
+        handler(address, value) is called instead of writing to ports
+        '''
+        self.write_handlers.append((mask, port & mask, handler))
+
+    def remove_read_handler(self, handler):
+        self.read_handlers = [e for e in self.read_handlers if e[2] != handler]
+
+    def remove_write_handler(self, handler):
+        self.write_handlers = [e for e in self.write_handlers if e[2] != handler]
+
+    def read(self, address):
+        if self.read_handlers:
+            for mask, port, handler in self.read_handlers:
+                if address & mask == port:
+                    self.data = handler(address) & 0xFF
+                    return self.data
+        self.data = self.ports.get_contents_value(address & 0xFF)
+        return self.data
+
+    def write(self, address, value):
+        self.data = value
+        if self.write_handlers:
+            for mask, port, handler in self.write_handlers:
+                if address & mask == port:
+                    handler(address, value)
+                    return
+        self.ports.set_contents_value(address & 0xFF, value)
@@ -0,0 +1,194 @@
+'''
+Timing scripts for the emulator core, run from this directory:
+
+    python benchmarks.py            # all benchmarks
+    python benchmarks.py dispatch   # just one
+'''
+import os
+import sys
+import time
+
+from z80 import Z80, INTERPRETER_ENGINE, BLOCK_ENGINE
+from instructions import instructions, DDCB, FDCB
+from instrumentation import InstrumentedZ80
+
+
+def time_ns(function, repeat, rounds=5):
+    '''
+    Best of several rounds of the mean cost of calling function, in nanoseconds
+    '''
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        cost = (time.perf_counter() - start) * 1e9 / repeat
+        if best is None or cost < best:
+            best = cost
+    return best
+
+
+def benchmark_dispatch(repeat=500):
+    '''
+    Average cost of Z80.execute_instruction for the first instruction of each mnemonic,
+    in nanoseconds. Registers are reset before each call so block instructions do a
+    single iteration.
+    '''
+    z80 = Z80()
+    seen = set()
+    results = []
+    for instruction in instructions:
+        base = instruction.instruction_base
+        if base in seen or base in [DDCB, FDCB]:
+            continue
+        seen.add(base)
+
+        def execute():
+            z80.program_counter.set_contents_value(0x8000)
+            z80.stack_pointer.set_contents_value(0xFF00)
+            z80.BC.set_contents_value(1)
+            z80.HL.set_contents_value(0x9000)
+            z80.DE.set_contents_value(0xA000)
+            z80.execute_instruction(instruction)
+
+        def setup_only():
+            z80.program_counter.set_contents_value(0x8000)
+            z80.stack_pointer.set_contents_value(0xFF00)
+            z80.BC.set_contents_value(1)
+            z80.HL.set_contents_value(0x9000)
+            z80.DE.set_contents_value(0xA000)
+
+        cost = time_ns(execute, repeat) - time_ns(setup_only, repeat)
+        results.append((base, instruction.text, cost))
+
+    print("{:<6} {:<14} {:>10}".format("base", "instruction", "ns/execute"))
+    for base, text, cost in results:
+        print("{:<6} {:<14} {:>10.0f}".format(base, text, cost))
+    print("mean {:.0f} ns".format(sum(e[2] for e in results) / len(results)))
+    return results
+
+
+# Adds 1..255 into hl 40 times, about 30000 instructions
+ENGINE_PROGRAM = [
+    0x0E, 0x28,        # ld c,40
+    0x21, 0x00, 0x00,  # ld hl,0
+    0x06, 0xFF,        # outer: ld b,255
+    0x16, 0x00,        # ld d,0
+    0x58,              # inner: ld e,b
+    0x19,              # add hl,de
+    0x10, 0xFC,        # djnz inner
+    0x0D,              # dec c
+    0x20, 0xF5,        # jr nz,outer
+]
+
+
+def benchmark_engines(repeat=1):
+    '''
+    Time to run ENGINE_PROGRAM on each execution engine, in milliseconds
+    '''
+    results = []
+    for engine in [INTERPRETER_ENGINE, BLOCK_ENGINE]:
+        z80 = Z80()
+        z80.memory.load(ENGINE_PROGRAM)
+
+        def run():
+            z80.program_counter.set_contents_value(0)
+            z80.run(code_end=len(ENGINE_PROGRAM), engine=engine)
+
+        cost = time_ns(run, repeat, rounds=3) / 1e6
+        results.append((engine, cost))
+        print("{:<12} {:>8.1f} ms".format(engine, cost))
+    return results
+
+
+def benchmark_checkpoint(repeat=200):
+    '''
+    Cost of a full checkpoint and restore round trip, and of an incremental one after
+    writing one byte, in microseconds
+    '''
+    z80 = Z80()
+    z80.memory.load(ENGINE_PROGRAM)
+    z80.memory.track_dirty_pages()
+
+    def full():
+        z80.restore(z80.checkpoint())
+
+    def incremental():
+        z80.memory.set_contents_value(0x8000, 1)
+        z80.restore(z80.checkpoint(incremental=True))
+
+    results = []
+    for name, function in [("full", full), ("incremental", incremental)]:
+        cost = time_ns(function, repeat) / 1e3
+        results.append((name, cost))
+        print("{:<12} {:>8.1f} us".format(name, cost))
+    return results
+
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "zx_image", "testData", "testSnapshot.sna")
+
+
+# Screen bytes written between frames by benchmark_screen, as a game might
+SCREEN_WRITES_PER_FRAME = 16
+
+
+def benchmark_screen(repeat=200):
+    '''
+    Time to render a frame of the test snapshot in full and incrementally after
+    SCREEN_WRITES_PER_FRAME writes to the screen, in milliseconds (needs numpy)
+    '''
+    from screen import render_memory, ScreenRenderer, SCREEN_START, SCREEN_LENGTH
+
+    z80 = Z80.from_sna(SNAPSHOT_PATH)
+    frame = render_memory(z80.memory)
+    renderer = ScreenRenderer(z80.memory)
+    renderer.render()
+    addresses = [SCREEN_START + (i * 431) % SCREEN_LENGTH for i in range(SCREEN_WRITES_PER_FRAME)]
+
+    def write_screen():
+        for address in addresses:
+            z80.memory.set_contents_value(address, z80.memory.get_contents_value(address) ^ 0xFF)
+
+    def full():
+        write_screen()
+        render_memory(z80.memory, out=frame)
+
+    def incremental():
+        write_screen()
+        renderer.render()
+
+    writes = time_ns(write_screen, repeat)
+    results = []
+    for name, function in [("full", full), ("incremental", incremental)]:
+        cost = (time_ns(function, repeat) - writes) / 1e6
+        results.append((name, cost))
+        print("{:<12} {:>8.3f} ms".format(name, cost))
+    return results
+
+
+def benchmark_phases():
+    '''
+    Host time in each interpreter phase while running ENGINE_PROGRAM (see
+    instrumentation.py)
+    '''
+    z80 = InstrumentedZ80()
+    z80.memory.load(ENGINE_PROGRAM)
+    z80.run(code_end=len(ENGINE_PROGRAM))
+    print(z80.instrumentation_report())
+    return z80.phases()
+
+
+BENCHMARKS = {
+    "dispatch": benchmark_dispatch,
+    "engines": benchmark_engines,
+    "checkpoint": benchmark_checkpoint,
+    "screen": benchmark_screen,
+    "phases": benchmark_phases,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print("== {} ==".format(name))
+        BENCHMARKS[name]()
@@ -0,0 +1,235 @@
+'''
+Basic block translation, used by Z80.run(engine="block").
+
+The first time execution reaches an address, the straight-line code from there up to
+and including the next jump, call, return, restart, halt or repeating block
+instruction is decoded once and turned into a single Python function (built from
+generated source with compile()). The function runs the body of
+Z80.execute_instruction for each instruction with the decisions made at translation
+time: DDCB/FDCB opcodes are looked up, the execute and undocumented methods are taken
+from the Z80's handler table, and operands that are registers or constants are passed
+directly, while the others are read by their resolvers (see operands.py) when the
+instruction runs, as in the interpreter. The program counter is only set before
+instructions that read operands, before the last instruction and on an early return.
+Functions are cached by start address. A Z80 subclass that overrides
+execute_instruction (such as instrumentation.InstrumentedZ80) gets blocks that call
+it for each instruction instead. T-states are counted per instruction as in the
+interpreter, and a block returns early once Z80.tstates_limit is reached or an
+interrupt may need accepting, so interrupts are taken on the same instruction
+boundary as in the interpreter.
+
+Writes into the bytes of a cached block (self-modifying code, Memory.load) drop the
+block. If the write comes from the block that is running, the block returns after the
+writing instruction and execution carries on from the new code.
+'''
+from instructions import (
+    JUMP_INSTRUCTIONS, REPEAT_INSTRUCTIONS, RETURN, RETURN_NMI, RETURN_INTERRUPT, RESTART, HALT, DDCB, FDCB
+)
+
+# Block instructions end a block as they move the PC back when run per iteration
+BLOCK_END_INSTRUCTIONS = JUMP_INSTRUCTIONS + REPEAT_INSTRUCTIONS + [
+    RETURN, RETURN_NMI, RETURN_INTERRUPT, RESTART, HALT
+]
+
+MAX_BLOCK_INSTRUCTIONS = 64
+
+# DDCB/FDCB decode to a pseudo instruction; the displacement and opcode follow
+PREFIXED_BIT_OPERAND_LENGTH = 2
+
+
+def operand_length(instruction):
+    '''
+    Number of bytes after the opcode that the instruction's operands read
+    '''
+    if instruction.instruction_base in [DDCB, FDCB]:
+        return PREFIXED_BIT_OPERAND_LENGTH
+    opcode_length = len(instruction.opcode.rstrip("0123456789")) // 2 + 1
+    return instruction.size - opcode_length
+
+
+class Block:
+
+    def __init__(self, start, end, instructions, function):
+        self.start = start
+        self.end = end
+        self.instructions = instructions
+        self.function = function
+
+
+class BlockCache:
+
+    def __init__(self, z80, inline=True):
+        '''
+        With inline False, blocks call z80.execute_instruction for each instruction,
+        for Z80 subclasses that override it
+        '''
+        self.z80 = z80
+        self.inline = inline
+        self.blocks = {}
+        self.code_map = [0] * z80.memory.size
+        self.code_end = -1
+        self.invalidated = False
+        z80.memory.add_write_listener(self.memory_written)
+
+    def memory_written(self, start, length):
+        if length == 1:
+            if not self.code_map[start]:
+                return
+        elif not any(self.code_map[start:start + length]):
+            return
+        self.invalidate(start, start + length)
+
+    def invalidate(self, start, end):
+        for block in [b for b in self.blocks.values() if b.start < end and start < b.end]:
+            self.remove(block)
+        self.invalidated = True
+
+    def remove(self, block):
+        del self.blocks[block.start]
+        for address in range(block.start, block.end):
+            self.code_map[address] -= 1
+
+    def clear(self):
+        for block in list(self.blocks.values()):
+            self.remove(block)
+
+    def get_block(self, address):
+        block = self.blocks.get(address)
+        if block is None:
+            block = self.translate(address)
+            if block is not None:
+                self.blocks[address] = block
+                for address in range(block.start, block.end):
+                    self.code_map[address] += 1
+        return block
+
+    def decode(self, address):
+        '''
+        Decodes the instruction at address, returning (instruction, address after the
+        opcode, address of the next instruction, T-states for ignored prefixes), or None
+        if the interpreter should handle it (unrecognised opcode or the end of memory)
+        '''
+        z80 = self.z80
+        pc = z80.program_counter.get_contents()
+        tstates = z80.tstates
+        z80.program_counter.set_contents_value(address)
+        try:
+            instruction, end_of_memory_reached = z80.decode_instruction()
+        except Exception:
+            return None
+        finally:
+            opcode_end = z80.program_counter.get_contents()
+            prefix_tstates = z80.tstates - tstates
+            z80.program_counter.set_contents_value(pc)
+            z80.tstates = tstates
+        next_address = opcode_end + operand_length(instruction)
+        if end_of_memory_reached or next_address >= len(self.code_map):
+            return None
+        return instruction, opcode_end, next_address, prefix_tstates
+
+    def translate(self, start):
+        decoded = []
+        address = start
+        while len(decoded) < MAX_BLOCK_INSTRUCTIONS:
+            result = self.decode(address)
+            if result is None:
+                break
+            decoded.append(result)
+            instruction, _, address, _ = result
+            if instruction.instruction_base in BLOCK_END_INSTRUCTIONS:
+                break
+            if self.code_end > -1 and address >= self.code_end:
+                break
+        if not decoded:
+            return None
+        return Block(start, address, [e[0] for e in decoded], self.build_function(start, decoded))
+
+    def build_function(self, start, decoded):
+        lines = [
+            "def block(z80, cache):",
+            "    set_pc = z80.program_counter.set_contents_value",
+            "    cache.invalidated = False",
+        ]
+        namespace = {}
+        last = len(decoded) - 1
+        for i, (instruction, opcode_end, next_address, prefix_tstates) in enumerate(decoded):
+            # Only operand resolvers and the block's last instruction read the program
+            # counter, so inlined instructions without operands leave it to the next
+            # set_pc or early return
+            sets_pc = not self.inline or operand_length(instruction) or i == last
+            if sets_pc:
+                lines.append("    set_pc({})".format(opcode_end))
+            if prefix_tstates:
+                lines.append("    z80.tstates += {}".format(prefix_tstates))
+            if self.inline:
+                lines.extend(self.instruction_lines(i, instruction, opcode_end, namespace))
+            else:
+                namespace["instruction_{}".format(i)] = instruction
+                lines.append("    z80.execute_instruction(instruction_{})".format(i))
+            if i < last:
+                lines.append(
+                    "    if cache.invalidated or z80.interrupt_check or z80.tstates >= z80.tstates_limit"
+                    " or z80.tstates >= z80.next_interrupt_tstates:"
+                )
+                if not sets_pc:
+                    lines.append("        set_pc({})".format(next_address))
+                lines.append("        return")
+        exec(compile("\n".join(lines), "<block {}>".format(start), "exec"), namespace)
+        return namespace["block"]
+
+    def instruction_lines(self, i, instruction, opcode_end, namespace):
+        '''
+        The body of Z80.execute_instruction for one instruction, with the DDCB/FDCB
+        lookup done, its methods taken from the Z80's handler table and its operand
+        resolvers bound, or their results when they are fixed (see operands.py)
+        '''
+        z80 = self.z80
+        if instruction.instruction_base in [DDCB, FDCB]:
+            table = z80.ddcb_instructions if instruction.instruction_base == DDCB else z80.fdcb_instructions
+            instruction = table[z80.memory.get_contents_value(opcode_end + 1)]
+            resolvers = [instruction.substitute_left_prefixed, instruction.substitute_right_prefixed]
+        else:
+            resolvers = [instruction.substitute_left, instruction.substitute_right]
+        names = {"instruction": instruction, "handler": z80.handlers[instruction.execute_index]}
+        if instruction.undocumented_index is not None:
+            names["undocumented"] = z80.handlers[instruction.undocumented_index]
+        lines = []
+        args = []
+        for side, resolver in zip(["left", "right"], resolvers):
+            name = "{}_{}".format(side, i)
+            args.append(name)
+            if getattr(resolver, "fixed", False):
+                namespace[name] = resolver(z80)
+            else:
+                namespace["resolve_" + name] = resolver
+                lines.append("    {0} = resolve_{0}(z80)".format(name))
+        for key, value in names.items():
+            namespace["{}_{}".format(key, i)] = value
+        call = "(instruction_{}, {}, {})".format(i, args[0], args[1])
+        lines.append("    handler_{}{}".format(i, call))
+        lines.append("    z80.tstates += {}".format(instruction.tstates_not_taken))
+        if "undocumented" in names:
+            lines.append("    undocumented_{}{}".format(i, call))
+        return lines
+
+    def run(self, code_end=-1):
+        z80 = self.z80
+        if code_end != self.code_end:
+            self.clear()
+            self.code_end = code_end
+        end_of_memory_reached = False
+        while not end_of_memory_reached:
+            if z80.interrupt_check or z80.tstates >= z80.next_interrupt_tstates:
+                if not z80.service_interrupts():
+                    return
+            block = self.get_block(z80.program_counter.get_contents())
+            if block is None:
+                instruction, end_of_memory_reached = z80.decode_instruction()
+                z80.execute_instruction(instruction)
+            else:
+                block.function(z80, self)
+            if code_end > -1:
+                if z80.program_counter.get_contents() >= code_end:
+                    return
+            if z80.tstates >= z80.tstates_limit:
+                return
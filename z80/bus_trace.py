@@ -0,0 +1,185 @@
+'''
+Bus event tracing, used by Z80.start_bus_trace and Z80.stop_bus_trace.
+
+Events are the ones FUSE lists in tests.expected (see README): memory reads and writes
+and port reads and writes, each recorded as (T-states, kind, address, data). The core
+has no contention model, so MC and PC events are never recorded, and T-states are
+those at the start of the instruction making the access.
+
+A BusTrace keeps the newest capacity events in a ring buffer of two preallocated
+arrays: T-states, and kind, address and data packed into 32 bits. Starting a trace
+replaces the memory's get_contents_value and set_contents_value and the IOBus's read
+and write with recording versions, as Memory does for regions and dirty pages, so an
+untraced Z80 pays nothing. While tracing, the ldir/lddr/cpir/cpdr fast paths are
+turned off so every access is seen. Start the trace after mapping regions or tracking
+dirty pages, as those replace the same methods. With the block engine opcode fetches
+are read when a block is translated, not each time it runs, so use the interpreter for
+complete traces.
+
+dump writes the events to a binary log in chunks and read_bus_log streams them back.
+'''
+import struct
+from array import array
+
+MEMORY_READ_EVENT = 0
+MEMORY_WRITE_EVENT = 1
+MEMORY_CONTEND_EVENT = 2
+PORT_READ_EVENT = 3
+PORT_WRITE_EVENT = 4
+PORT_CONTEND_EVENT = 5
+# FUSE names of the event kinds, as in fuse_corpus.EVENT_KINDS
+EVENT_NAMES = ["MR", "MW", "MC", "PR", "PW", "PC"]
+
+DEFAULT_CAPACITY = 1 << 20
+KIND_SHIFT = 24
+ADDRESS_SHIFT = 8
+
+BUS_LOG_MAGIC = b"Z80B"
+BUS_LOG_VERSION = 1
+# magic, version, events overwritten before the dump
+BUS_LOG_HEADER = struct.Struct("<4sHQ")
+# events in the chunk; the T-states then packed events follow as arrays
+BUS_LOG_CHUNK_HEADER = struct.Struct("<I")
+BUS_LOG_CHUNK_EVENTS = 1 << 16
+
+
+def refuse_copy(source, destination, length):
+    return False
+
+
+def refuse_find(value, start, end):
+    return None
+
+
+class BusTrace:
+
+    def __init__(self, z80, capacity=DEFAULT_CAPACITY):
+        self.z80 = z80
+        # A power of 2 so the ring index is a mask
+        self.capacity = 1 << max(0, capacity - 1).bit_length()
+        self.mask = self.capacity - 1
+        self.times = array("Q", bytes(8 * self.capacity))
+        self.events = array("I", bytes(4 * self.capacity))
+        self.count = 0
+        self.replaced = []
+
+    def record(self, kind, address, value):
+        i = self.count & self.mask
+        self.times[i] = self.z80.tstates
+        self.events[i] = (kind << KIND_SHIFT) | (address << ADDRESS_SHIFT) | value
+        self.count += 1
+
+    def replace(self, target, name, method):
+        self.replaced.append((target, name, target.__dict__.get(name)))
+        setattr(target, name, method)
+
+    def start(self):
+        if self.replaced:
+            return
+        memory = self.z80.memory
+        io = self.z80.io
+        record = self.record
+        read = memory.get_contents_value
+        write = memory.set_contents_value
+        port_read = io.read
+        port_write = io.write
+
+        def traced_read(address):
+            value = read(address)
+            record(MEMORY_READ_EVENT, address, value)
+            return value
+
+        def traced_write(address, value):
+            record(MEMORY_WRITE_EVENT, address, value)
+            write(address, value)
+
+        def traced_port_read(address):
+            value = port_read(address)
+            record(PORT_READ_EVENT, address, value)
+            return value
+
+        def traced_port_write(address, value):
+            record(PORT_WRITE_EVENT, address, value)
+            port_write(address, value)
+
+        self.replace(memory, "get_contents_value", traced_read)
+        self.replace(memory, "set_contents_value", traced_write)
+        self.replace(memory, "copy_block", refuse_copy)
+        self.replace(memory, "find", refuse_find)
+        self.replace(memory, "rfind", refuse_find)
+        self.replace(io, "read", traced_port_read)
+        self.replace(io, "write", traced_port_write)
+
+    def stop(self):
+        for target, name, previous in reversed(self.replaced):
+            if previous is None:
+                delattr(target, name)
+            else:
+                setattr(target, name, previous)
+        self.replaced = []
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def dropped(self):
+        '''
+        Number of events overwritten by newer ones
+        '''
+        return self.count - len(self)
+
+    def clear(self):
+        self.count = 0
+
+    def chunks(self, size=BUS_LOG_CHUNK_EVENTS):
+        '''
+        (times, packed events) array slices of the events, oldest first
+        '''
+        first = self.count - len(self)
+        position = first
+        while position < self.count:
+            i = position & self.mask
+            length = min(size, self.count - position, self.capacity - i)
+            yield self.times[i:i + length], self.events[i:i + length]
+            position += length
+
+    def __iter__(self):
+        '''
+        (T-states, kind, address, data) of each event, oldest first
+        '''
+        for times, events in self.chunks():
+            yield from unpack_events(times, events)
+
+    def dump(self, path):
+        with open(path, "wb") as f:
+            f.write(BUS_LOG_HEADER.pack(BUS_LOG_MAGIC, BUS_LOG_VERSION, self.dropped))
+            for times, events in self.chunks():
+                f.write(BUS_LOG_CHUNK_HEADER.pack(len(times)))
+                times.tofile(f)
+                events.tofile(f)
+
+
+def unpack_events(times, events):
+    for tstates, packed in zip(times, events):
+        yield tstates, packed >> KIND_SHIFT, (packed >> ADDRESS_SHIFT) & 0xFFFF, packed & 0xFF
+
+
+def read_bus_log(path):
+    '''
+    (T-states, kind, address, data) of each event in a log written by BusTrace.dump,
+    read a chunk at a time
+    '''
+    with open(path, "rb") as f:
+        magic, version, _ = BUS_LOG_HEADER.unpack(f.read(BUS_LOG_HEADER.size))
+        if magic != BUS_LOG_MAGIC or version != BUS_LOG_VERSION:
+            raise Exception("Not a bus log!!! path: {}".format(path))
+        while True:
+            header = f.read(BUS_LOG_CHUNK_HEADER.size)
+            if not header:
+                return
+            length, = BUS_LOG_CHUNK_HEADER.unpack(header)
+            times = array("Q")
+            times.fromfile(f, length)
+            events = array("I")
+            events.fromfile(f, length)
+            yield from unpack_events(times, events)
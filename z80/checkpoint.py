@@ -0,0 +1,144 @@
+'''
+Checkpoints of the complete state of a Z80 as bytes, used by Z80.checkpoint and
+Z80.restore.
+
+A checkpoint is a fixed size header (registers, interrupt state, T-states), the
+interrupts scheduled with Z80.schedule_interrupt, the memory layout (see
+Memory.layout) and then either all of memory storage or, for an
+incremental checkpoint, only the pages written since the previous checkpoint as
+(start, length, bytes) records. Incremental checkpoints need the memory to track dirty
+pages (Memory.track_dirty_pages). Restoring an incremental checkpoint writes its pages
+over the current memory, so a state is rebuilt by restoring the full checkpoint it
+follows and then each incremental one in order.
+'''
+import struct
+
+CHECKPOINT_MAGIC = b"Z80C"
+FULL_CHECKPOINT = 0
+INCREMENTAL_CHECKPOINT = 1
+
+CHECKPOINT_REGISTERS = ["PC", "SP", "AF", "BC", "DE", "HL", "IX", "IY", "AF'", "BC'", "DE'", "HL'"]
+# magic, kind, 16 bit registers, I, R, IFF1, IFF2, IM, state bits, interrupt data bus,
+# T-states, scheduled interrupt count, layout length, storage length
+CHECKPOINT_HEADER = struct.Struct("<4sB{}H7BQIHI".format(len(CHECKPOINT_REGISTERS)))
+# T-states, data bus of each scheduled interrupt
+SCHEDULED_INTERRUPT = struct.Struct("<QB")
+# start, length of a run of dirty pages in an incremental checkpoint
+DIRTY_RANGE_HEADER = struct.Struct("<II")
+
+HALTED_BIT = 0x01
+INTERRUPT_PENDING_BIT = 0x02
+NMI_PENDING_BIT = 0x04
+INTERRUPT_DELAY_BIT = 0x08
+
+
+def state_bits(z80):
+    bits = 0
+    if z80.halted:
+        bits |= HALTED_BIT
+    if z80.interrupt_pending:
+        bits |= INTERRUPT_PENDING_BIT
+    if z80.nmi_pending:
+        bits |= NMI_PENDING_BIT
+    if z80.interrupt_delay:
+        bits |= INTERRUPT_DELAY_BIT
+    return bits
+
+
+def cpu_state(z80):
+    '''
+    Registers, interrupt state and T-states, as packed in the checkpoint header
+    '''
+    return (
+        *[z80.registers_by_name[name].get_contents() for name in CHECKPOINT_REGISTERS],
+        z80.I.get_contents(),
+        z80.R.get_contents(),
+        z80.IFF1,
+        z80.IFF2,
+        z80.interrupt_mode,
+        state_bits(z80),
+        z80.interrupt_data_bus,
+        z80.tstates,
+    )
+
+
+def set_cpu_state(z80, state):
+    registers = state[:len(CHECKPOINT_REGISTERS)]
+    i, r, iff1, iff2, interrupt_mode, bits, data_bus, tstates = state[len(CHECKPOINT_REGISTERS):]
+    for name, value in zip(CHECKPOINT_REGISTERS, registers):
+        z80.registers_by_name[name].set_contents_value(value)
+    z80.I.set_contents(i)
+    z80.R.set_contents(r)
+    z80.IFF1 = iff1
+    z80.IFF2 = iff2
+    z80.interrupt_mode = interrupt_mode
+    z80.halted = bool(bits & HALTED_BIT)
+    z80.interrupt_pending = bool(bits & INTERRUPT_PENDING_BIT)
+    z80.nmi_pending = bool(bits & NMI_PENDING_BIT)
+    z80.interrupt_delay = bool(bits & INTERRUPT_DELAY_BIT)
+    z80.interrupt_check = True
+    z80.interrupt_data_bus = data_bus
+    z80.tstates = tstates
+
+
+def checkpoint(z80, incremental=False):
+    memory = z80.memory
+    if incremental and memory.dirty_pages is None:
+        raise Exception("Incremental checkpoints need dirty pages tracked, see Memory.track_dirty_pages!!!")
+    layout = memory.layout()
+    storage_size = memory.storage_size()
+    header = CHECKPOINT_HEADER.pack(
+        CHECKPOINT_MAGIC,
+        INCREMENTAL_CHECKPOINT if incremental else FULL_CHECKPOINT,
+        *cpu_state(z80),
+        len(z80.scheduled_interrupts),
+        len(layout),
+        storage_size,
+    )
+    parts = [header]
+    for tstates, data_bus in z80.scheduled_interrupts:
+        parts.append(SCHEDULED_INTERRUPT.pack(tstates, data_bus))
+    parts.append(layout)
+    if incremental:
+        for start, end in memory.dirty_ranges():
+            parts.append(DIRTY_RANGE_HEADER.pack(start, end - start))
+            parts.append(memory.read_storage(start, end))
+    else:
+        parts.append(memory.read_storage(0, storage_size))
+    memory.clear_dirty_pages()
+    return b"".join(parts)
+
+
+def restore(z80, data):
+    memory = z80.memory
+    fields = CHECKPOINT_HEADER.unpack_from(data)
+    magic, kind = fields[:2]
+    scheduled_count, layout_length, storage_length = fields[-3:]
+    if magic != CHECKPOINT_MAGIC:
+        raise Exception("Not a checkpoint!!!")
+    if storage_length != memory.storage_size():
+        raise Exception("Checkpoint memory size does not match!!! checkpoint: {}, memory: {}".format(storage_length, memory.storage_size()))
+    set_cpu_state(z80, fields[2:-3])
+
+    position = CHECKPOINT_HEADER.size
+    z80.scheduled_interrupts = []
+    for _ in range(scheduled_count):
+        z80.scheduled_interrupts.append(SCHEDULED_INTERRUPT.unpack_from(data, position))
+        position += SCHEDULED_INTERRUPT.size
+    if z80.scheduled_interrupts:
+        z80.next_interrupt_tstates = z80.scheduled_interrupts[0][0]
+    else:
+        z80.next_interrupt_tstates = float("inf")
+    memory.set_layout(data[position:position + layout_length])
+    position += layout_length
+    view = memoryview(data)
+    if kind == FULL_CHECKPOINT:
+        memory.write_storage(0, view[position:position + storage_length])
+    else:
+        while position < len(data):
+            start, length = DIRTY_RANGE_HEADER.unpack_from(data, position)
+            position += DIRTY_RANGE_HEADER.size
+            memory.write_storage(start, view[position:position + length])
+            position += length
+    memory.written(0, memory.size)
+    memory.clear_dirty_pages()
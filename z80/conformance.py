@@ -0,0 +1,269 @@
+'''
+FUSE conformance runner, run from this directory:
+
+    python conformance.py [--engine block] [--events] [--workers N] [--report report.json]
+                          [--cache-directory DIR] [TEST ...]
+
+tests.in and tests.expected (see README) are loaded from the corpus cache (see
+fuse_corpus.py) as FuseState objects, one for the state before and one for the state
+after each test. Tests are split into shards that run in a process pool. Each worker
+builds a single Z80 and resets it between tests: memory is zeroed only where the
+previous test loaded or wrote it (see Memory.track_dirty_pages).
+
+A test runs for its T-state budget, as FUSE does, and is compared on registers,
+interrupt state, T-states, memory and port events. Memory is compared wherever the
+test wrote, so stray writes are caught too. Port reads return the data of the next
+PR event and port reads and writes are compared with the PR and PW events by port
+address and data, as the core has no cycle timing. R is not compared as the core does
+not model the refresh counter; it is set to its expected value before running, as
+helper.Z80TestHandler does.
+
+With --events the memory and port accesses of each test are recorded with a bus trace
+(see bus_trace.py) and compared in order with the MR, MW, PR and PW events, ignoring
+their times. The core reads some operands more than once, so this is a debugging aid
+rather than a gate.
+
+The report is JSON: a summary, then each test's status ("pass", "fail" or "error")
+and the differences found. Tests in EXPECTED_FAILURES are known not to pass; the exit
+status is 1 if any other test did not pass, so the runner can gate CI.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from z80 import Z80, INTERPRETER_ENGINE, BLOCK_ENGINE
+from bus_trace import EVENT_NAMES
+from fuse_corpus import (
+    load_corpus, parse_tests, FUSE_REGISTERS, MEMORY_READ, MEMORY_WRITE, PORT_READ, PORT_WRITE, TESTS_IN_PATH,
+    TESTS_EXPECTED_PATH, CACHE_DIRECTORY
+)
+
+PORT_EVENTS = [PORT_READ, PORT_WRITE]
+TRACED_EVENTS = [MEMORY_READ, MEMORY_WRITE, PORT_READ, PORT_WRITE]
+BUS_TRACE_CAPACITY = 1 << 16
+
+# Tests fuse_tests.py skips
+SKIPPED_TESTS = ["27", "edba", "edb2"]
+# Tests with undocumented flags the core does not model, so only A of AF is compared
+FLAGS_IGNORED_PREFIXES = ("db", "eda2", "eda3", "edaa", "edab")
+FLAGS_IGNORED_TESTS = ["edb0", "edb1", "edb3", "edb8", "edb9", "edbb"]
+
+# The core runs a DD prefix and the instruction after it as one instruction, FUSE as two
+EXPECTED_FAILURES = ["dd00", "ddfd00"]
+
+SHARDS_PER_WORKER = 4
+
+PASS = "pass"
+FAIL = "fail"
+ERROR = "error"
+
+
+def load_tests(tests_in_path=TESTS_IN_PATH, tests_expected_path=TESTS_EXPECTED_PATH, cache_directory=CACHE_DIRECTORY):
+    '''
+    [(before, after)] FuseState pairs for every test, in tests.in order, read from the
+    corpus cache (see fuse_corpus.py) unless cache_directory is None
+    '''
+    if cache_directory is None:
+        return parse_tests(tests_in_path, tests_expected_path)
+    return load_corpus(tests_in_path, tests_expected_path, cache_directory).tests()
+
+
+def flags_ignored(name):
+    return name.startswith(FLAGS_IGNORED_PREFIXES) or name in FLAGS_IGNORED_TESTS
+
+
+class ConformanceRunner:
+    '''
+    Runs tests one after another on a single Z80
+    '''
+
+    def __init__(self, engine=INTERPRETER_ENGINE, events=False):
+        self.engine = engine
+        self.events = events
+        self.z80 = Z80()
+        self.z80.memory.track_dirty_pages()
+        self.z80.io.add_read_handler(0, self.port_read, mask=0)
+        self.z80.io.add_write_handler(0, self.port_write, mask=0)
+        self.port_reads = []
+        self.port_events = []
+        # Memory to zero before the next test
+        self.used_ranges = []
+
+    def port_read(self, address):
+        value = self.port_reads.pop(0) if self.port_reads else address >> 8
+        self.port_events.append((PORT_READ, address, value))
+        return value
+
+    def port_write(self, address, value):
+        self.port_events.append((PORT_WRITE, address, value))
+
+    def reset(self):
+        memory = self.z80.memory
+        for start, end in self.used_ranges + memory.dirty_ranges():
+            memory.load(bytes(end - start), start)
+        memory.clear_dirty_pages()
+        self.port_events = []
+
+    def setup(self, before, after):
+        z80 = self.z80
+        for name, value in zip(FUSE_REGISTERS, before.registers):
+            z80.registers_by_name[name].set_contents_value(value)
+        z80.I.set_contents(before.i)
+        z80.R.set_contents(after.r)
+        z80.IFF1 = before.iff1
+        z80.IFF2 = before.iff2
+        z80.interrupt_mode = before.interrupt_mode
+        z80.halted = bool(before.halted)
+        z80.interrupt_pending = False
+        z80.nmi_pending = False
+        z80.interrupt_delay = False
+        z80.interrupt_check = True
+        z80.tstates = 0
+        for start, data in before.memory:
+            z80.memory.load(data, start)
+        self.used_ranges = [(start, start + len(data)) for start, data in before.memory]
+        z80.memory.clear_dirty_pages()
+        self.port_reads = [data for _, kind, _, data in after.events if kind == PORT_READ]
+
+    def run_test(self, before, after):
+        '''
+        Result of running one test: {"name", "status", "tstates": [actual, expected],
+        "differences": [{"kind", "name", "expected", "actual"}]}
+        '''
+        self.reset()
+        self.setup(before, after)
+        result = {"name": before.name, "status": PASS, "tstates": [0, after.tstates], "differences": []}
+        trace = self.z80.start_bus_trace(BUS_TRACE_CAPACITY) if self.events else None
+        try:
+            self.z80.run(engine=self.engine, tstates=before.tstates)
+        except Exception as e:
+            result["status"] = ERROR
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+            return result
+        finally:
+            self.z80.stop_bus_trace()
+        result["tstates"][0] = self.z80.tstates
+        result["differences"] = self.compare(before, after, trace)
+        if result["differences"]:
+            result["status"] = FAIL
+        return result
+
+    def compare(self, before, after, trace=None):
+        z80 = self.z80
+        differences = []
+
+        def check(kind, name, expected, actual):
+            if expected != actual:
+                differences.append({"kind": kind, "name": name, "expected": expected, "actual": actual})
+
+        for name, expected in zip(FUSE_REGISTERS, after.registers):
+            actual = z80.registers_by_name[name].get_contents()
+            if name == "AF" and flags_ignored(before.name):
+                name, expected, actual = "A", expected >> 8, actual >> 8
+            check("register", name, expected, actual)
+        check("register", "I", after.i, z80.I.get_contents())
+        check("state", "IFF1", after.iff1, z80.IFF1)
+        check("state", "IFF2", after.iff2, z80.IFF2)
+        check("state", "IM", after.interrupt_mode, z80.interrupt_mode)
+        check("state", "halted", after.halted, int(z80.halted))
+        check("state", "tstates", after.tstates, z80.tstates)
+
+        expected_memory = before.memory_values()
+        expected_memory.update(after.memory_values())
+        addresses = set(expected_memory)
+        for start, end in z80.memory.dirty_ranges():
+            addresses.update(range(start, end))
+        for address in sorted(addresses):
+            check("memory", address, expected_memory.get(address, 0), z80.memory.get_contents_value(address))
+
+        expected_ports = [(kind, address, data) for _, kind, address, data in after.events if kind in PORT_EVENTS]
+        if expected_ports != self.port_events:
+            check("ports", "events", expected_ports, self.port_events)
+
+        if trace is not None:
+            expected_events = [(kind, address, data) for _, kind, address, data in after.events if kind in TRACED_EVENTS]
+            actual_events = [(EVENT_NAMES[kind], address, data) for _, kind, address, data in trace]
+            check("bus", "events", expected_events, actual_events)
+        return differences
+
+
+def run_shard(shard, engine=INTERPRETER_ENGINE, events=False):
+    '''
+    Results of a list of (before, after) tests, run on one ConformanceRunner
+    '''
+    runner = ConformanceRunner(engine, events)
+    return [runner.run_test(before, after) for before, after in shard]
+
+
+def run_shard_job(job):
+    return run_shard(*job)
+
+
+def run_tests(tests, engine=INTERPRETER_ENGINE, workers=None, events=False):
+    '''
+    Runs (before, after) tests across a process pool, returning the report
+    '''
+    start = time.perf_counter()
+    tests = [(before, after) for before, after in tests if before.name not in SKIPPED_TESTS]
+    workers = workers or os.cpu_count() or 1
+    shard_count = max(1, min(len(tests), workers * SHARDS_PER_WORKER))
+    # Interleaved so each shard gets a mix of slow and fast tests
+    shards = [tests[i::shard_count] for i in range(shard_count)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_results in executor.map(run_shard_job, [(shard, engine, events) for shard in shards]):
+            results += shard_results
+    order = {before.name: i for i, (before, _) in enumerate(tests)}
+    results.sort(key=lambda result: order[result["name"]])
+    summary = {
+        "engine": engine,
+        "events": events,
+        "total": len(results),
+        PASS: sum(1 for result in results if result["status"] == PASS),
+        FAIL: sum(1 for result in results if result["status"] == FAIL),
+        ERROR: sum(1 for result in results if result["status"] == ERROR),
+        "skipped": SKIPPED_TESTS,
+        "expected_failures": [
+            result["name"] for result in results if result["status"] != PASS and result["name"] in EXPECTED_FAILURES
+        ],
+        "unexpected_failures": [
+            result["name"] for result in results if result["status"] != PASS and result["name"] not in EXPECTED_FAILURES
+        ],
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    return {"summary": summary, "tests": results}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Run the FUSE conformance tests")
+    parser.add_argument("tests", nargs="*", help="names of the tests to run, by default all of them")
+    parser.add_argument("--engine", default=INTERPRETER_ENGINE, choices=[INTERPRETER_ENGINE, BLOCK_ENGINE])
+    parser.add_argument("--events", action="store_true", help="also compare memory and port accesses in order")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use, by default one per CPU")
+    parser.add_argument("--report", help="file to write the JSON report to")
+    parser.add_argument("--cache-directory", default=CACHE_DIRECTORY, help="directory for the parsed corpus cache")
+    args = parser.parse_args(args)
+
+    tests = load_tests(cache_directory=args.cache_directory)
+    if args.tests:
+        tests = [(before, after) for before, after in tests if before.name in args.tests]
+    report = run_tests(tests, args.engine, args.workers, args.events)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=1)
+    summary = report["summary"]
+    for result in report["tests"]:
+        if result["name"] in summary["unexpected_failures"]:
+            print("{} {}: {}".format(result["status"], result["name"], result.get("error") or result["differences"]))
+    print("{} tests, {} passed, {} failed, {} errors ({} expected) in {} s".format(
+        summary["total"], summary[PASS], summary[FAIL], summary[ERROR], len(summary["expected_failures"]),
+        summary["seconds"]
+    ))
+    return 1 if summary["unexpected_failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+'''
+Copy-on-write memory, for running many clones of the same program.
+
+CowMemory keeps the address space as a list of pages of DIRTY_PAGE_SIZE bytes, each its
+own bytearray. clone() gives a new CowMemory holding the same page objects and marks
+every page shared in both: the first write to a shared page copies it, so each clone
+only owns the pages it has written. Two clones can be diffed by comparing page objects,
+as a page that is still shared cannot differ.
+
+Every write checks whether its page is shared, so writes are slower than with Memory.
+Dirty pages (see Memory.track_dirty_pages) are numbered by address.
+'''
+from base import Memory, ADDRESS_SPACE_SIZE, DIRTY_PAGE_SHIFT, DIRTY_PAGE_SIZE
+
+COW_PAGE_MASK = DIRTY_PAGE_SIZE - 1
+
+
+class CowMemory(Memory):
+
+    def __init__(self, size=ADDRESS_SPACE_SIZE):
+        if size % DIRTY_PAGE_SIZE:
+            raise Exception("Copy-on-write memory size must be a multiple of {}!!! size: {}".format(DIRTY_PAGE_SIZE, size))
+        self.size = size
+        self.write_listeners = []
+        self.region_map = None
+        self.dirty_pages = None
+        self.pages = [bytearray(DIRTY_PAGE_SIZE) for _ in range(size >> DIRTY_PAGE_SHIFT)]
+        # 1 for each page that may be held by another clone
+        self.shared = bytearray(len(self.pages))
+
+    def clone(self):
+        '''
+        A copy of the memory sharing every page with this one until either writes it.
+        Regions, write listeners and dirty page tracking are not copied.
+        '''
+        memory = CowMemory.__new__(CowMemory)
+        memory.size = self.size
+        memory.write_listeners = []
+        memory.region_map = None
+        memory.dirty_pages = None
+        memory.pages = list(self.pages)
+        self.shared[:] = b"\x01" * len(self.shared)
+        memory.shared = bytearray(self.shared)
+        return memory
+
+    def unshare(self, page):
+        self.pages[page] = bytearray(self.pages[page])
+        self.shared[page] = 0
+
+    def owned_page_count(self):
+        '''
+        Number of pages not shared with a clone
+        '''
+        return self.shared.count(0)
+
+    def changed_ranges(self, other):
+        '''
+        (start, end) addresses of each run of pages whose bytes differ from other, a
+        clone of this memory. Pages that are still shared are not compared.
+        '''
+        ranges = []
+        for page, (mine, theirs) in enumerate(zip(self.pages, other.pages)):
+            if mine is theirs or mine == theirs:
+                continue
+            start = page << DIRTY_PAGE_SHIFT
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], start + DIRTY_PAGE_SIZE)
+            else:
+                ranges.append((start, start + DIRTY_PAGE_SIZE))
+        return ranges
+
+    def get_contents_value(self, address):
+        return self.pages[address >> DIRTY_PAGE_SHIFT][address & COW_PAGE_MASK]
+
+    def set_contents_value(self, address, value):
+        page = address >> DIRTY_PAGE_SHIFT
+        if self.shared[page]:
+            self.unshare(page)
+        self.pages[page][address & COW_PAGE_MASK] = value
+        if self.dirty_pages is not None:
+            self.dirty_pages[page] = 1
+        if self.write_listeners:
+            for listener in self.write_listeners:
+                listener(address, 1)
+
+    # Writes already mark dirty pages when they are tracked
+    tracked_set_contents_value = set_contents_value
+
+    def mapped_get_contents_value(self, address):
+        region = self.region_map[address]
+        if region is None or region[0] is None:
+            return self.pages[address >> DIRTY_PAGE_SHIFT][address & COW_PAGE_MASK]
+        return region[0](address)
+
+    def mapped_set_contents_value(self, address, value):
+        region = self.region_map[address]
+        if region is None or region[1] is None:
+            CowMemory.set_contents_value(self, address, value)
+            return
+        region[1](address, value)
+        if self.write_listeners:
+            for listener in self.write_listeners:
+                listener(address, 1)
+
+    def storage_size(self):
+        return self.size
+
+    def read_storage(self, start, end):
+        return self.read_block(start, end - start)
+
+    def write_storage(self, start, data):
+        data = memoryview(data)
+        position = 0
+        while position < len(data):
+            address = start + position
+            page = address >> DIRTY_PAGE_SHIFT
+            offset = address & COW_PAGE_MASK
+            piece = min(DIRTY_PAGE_SIZE - offset, len(data) - position)
+            if self.shared[page]:
+                if piece == DIRTY_PAGE_SIZE:
+                    self.pages[page] = bytearray(piece)
+                    self.shared[page] = 0
+                else:
+                    self.unshare(page)
+            self.pages[page][offset:offset + piece] = data[position:position + piece]
+            position += piece
+
+    def read_block(self, start, length):
+        first = start >> DIRTY_PAGE_SHIFT
+        last = (start + length - 1) >> DIRTY_PAGE_SHIFT
+        data = b"".join(self.pages[first:last + 1])
+        offset = start & COW_PAGE_MASK
+        return data[offset:offset + length]
+
+    def copy_block(self, source, destination, length):
+        return False
+
+    def find(self, value, start, end):
+        return None
+
+    def rfind(self, value, start, end):
+        return None
+
+    def dump(self):
+        return list(self.read_block(0, self.size))
+
+    def load(self, data, start=0):
+        if start + len(data) > self.size:
+            raise Exception("Data does not fit in memory!!! start: {}, length: {}, memory size: {}".format(start, len(data), self.size))
+        self.write_storage(start, bytes(data))
+        self.written(start, len(data))
+
+    def load_file(self, file, start, length):
+        if start + length > self.size:
+            raise Exception("Data does not fit in memory!!! start: {}, length: {}, memory size: {}".format(start, length, self.size))
+        data = file.read(length)
+        self.load(data, start)
+        return len(data)
+
+    def block_view(self, start, length):
+        return None
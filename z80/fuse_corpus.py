@@ -0,0 +1,297 @@
+'''
+The FUSE test corpus (tests.in and tests.expected, see README) parsed into FuseState
+objects, and a binary cache of it so the text files are only parsed once.
+
+The cache is columnar: for all tests together it holds the 12 FUSE register values
+as one array of 16 bit words, the 8 bit state fields (I, R, IFF1, IFF2, IM, halted)
+as one array of bytes, the T-states as 32 bit words, and memory runs as their start
+addresses, offsets into one blob of run bytes, and per-test offsets into the runs.
+Bus events are stored the same way. Every column starts on an 8 byte boundary and is
+a memoryview cast of the file, so a cached corpus is memory-mapped and read without
+parsing. Columns use the host's byte order.
+
+load_corpus keys the cache file by a hash of the two text files, so editing either
+rebuilds it, and removes the cache files of older versions when it writes a new one.
+Paths default to this module's directory, whatever the working directory.
+FuseCorpus.tests gives FuseState objects; fuzzers and benchmarks can read the columns
+directly.
+'''
+import hashlib
+import mmap
+import os
+import struct
+from array import array
+
+MODULE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TESTS_IN_PATH = os.path.join(MODULE_DIRECTORY, "tests.in")
+TESTS_EXPECTED_PATH = os.path.join(MODULE_DIRECTORY, "tests.expected")
+CACHE_DIRECTORY = os.path.join(MODULE_DIRECTORY, "__pycache__")
+CACHE_PREFIX = "fuse_corpus-"
+CACHE_SUFFIX = ".bin"
+
+FUSE_REGISTERS = ["AF", "BC", "DE", "HL", "AF'", "BC'", "DE'", "HL'", "IX", "IY", "SP", "PC"]
+MEMORY_READ = "MR"
+MEMORY_WRITE = "MW"
+MEMORY_CONTEND = "MC"
+PORT_READ = "PR"
+PORT_WRITE = "PW"
+PORT_CONTEND = "PC"
+EVENT_KINDS = [MEMORY_READ, MEMORY_WRITE, MEMORY_CONTEND, PORT_READ, PORT_WRITE, PORT_CONTEND]
+NO_EVENT_DATA = -1
+
+CORPUS_MAGIC = b"Z80F"
+CORPUS_VERSION = 1
+# magic, version, test count, column count
+CORPUS_HEADER = struct.Struct("<4sHII")
+# offset and length in bytes of each column
+COLUMN_HEADER = struct.Struct("<QQ")
+COLUMN_ALIGNMENT = 8
+STATE_FIELDS = ["i", "r", "iff1", "iff2", "interrupt_mode", "halted"]
+SIDES = ["before", "after"]
+
+
+def side_columns(side):
+    return [
+        (side + "_registers", "H"),
+        (side + "_states", "B"),
+        (side + "_tstates", "I"),
+        (side + "_run_offsets", "I"),
+        (side + "_run_starts", "H"),
+        (side + "_run_data_offsets", "I"),
+        (side + "_run_data", "B"),
+    ]
+
+
+# (name, array typecode) of each column, in file order
+CORPUS_COLUMNS = [("names", "B"), ("name_offsets", "I")] + side_columns("before") + side_columns("after") + [
+    ("event_offsets", "I"),
+    ("event_times", "I"),
+    ("event_kinds", "B"),
+    ("event_addresses", "H"),
+    ("event_data", "h"),
+]
+
+
+class FuseState:
+    '''
+    Registers, interrupt state, T-states and memory of a test before or after it runs.
+    memory is a list of (start, bytes) runs. events are (time, type, address, data)
+    bus events, data being NO_EVENT_DATA for contentions; tests.in has none.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.registers = []
+        self.i = 0
+        self.r = 0
+        self.iff1 = 0
+        self.iff2 = 0
+        self.interrupt_mode = 0
+        self.halted = 0
+        self.tstates = 0
+        self.memory = []
+        self.events = []
+
+    def memory_values(self):
+        '''
+        {address: value} of the memory runs
+        '''
+        values = {}
+        for start, data in self.memory:
+            for offset, value in enumerate(data):
+                values[start + offset] = value
+        return values
+
+
+def parse_fuse_file(path):
+    '''
+    {name: FuseState} of a tests.in or tests.expected file, in file order
+    '''
+    states = {}
+    state = None
+    section = "name"
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if section == "name":
+                if not line or line == "-1":
+                    continue
+                state = FuseState(line)
+                states[line] = state
+                section = "registers"
+            elif section == "registers":
+                if line.startswith(" "):
+                    time, kind, address, *data = line.split()
+                    state.events.append((int(time), kind, int(address, 16), int(data[0], 16) if data else NO_EVENT_DATA))
+                    continue
+                state.registers = [int(value, 16) for value in line.split()]
+                section = "states"
+            elif section == "states":
+                fields = line.split()
+                state.i, state.r = int(fields[0], 16), int(fields[1], 16)
+                state.iff1, state.iff2, state.interrupt_mode, state.halted, state.tstates = [int(e) for e in fields[2:7]]
+                section = "memory"
+            elif section == "memory":
+                if not line or line == "-1":
+                    section = "name"
+                    continue
+                fields = line.split()
+                start = int(fields[0], 16)
+                data = bytes(int(value, 16) for value in fields[1:fields.index("-1")])
+                state.memory.append((start, data))
+    return states
+
+
+def parse_tests(tests_in_path=TESTS_IN_PATH, tests_expected_path=TESTS_EXPECTED_PATH):
+    '''
+    [(before, after)] FuseState pairs for every test, in tests.in order
+    '''
+    before = parse_fuse_file(tests_in_path)
+    after = parse_fuse_file(tests_expected_path)
+    return [(before[name], after[name]) for name in before if name in after]
+
+
+def build_corpus(tests):
+    '''
+    Cache file bytes of (before, after) tests
+    '''
+    columns = {name: array(typecode) for name, typecode in CORPUS_COLUMNS}
+    columns["name_offsets"].append(0)
+    columns["event_offsets"].append(0)
+    for side in SIDES:
+        columns[side + "_run_offsets"].append(0)
+        columns[side + "_run_data_offsets"].append(0)
+    for test in tests:
+        columns["names"].frombytes(test[0].name.encode())
+        columns["name_offsets"].append(len(columns["names"]))
+        for side, state in zip(SIDES, test):
+            columns[side + "_registers"].extend(state.registers)
+            columns[side + "_states"].extend(getattr(state, field) for field in STATE_FIELDS)
+            columns[side + "_tstates"].append(state.tstates)
+            for start, data in state.memory:
+                columns[side + "_run_starts"].append(start)
+                columns[side + "_run_data"].frombytes(data)
+                columns[side + "_run_data_offsets"].append(len(columns[side + "_run_data"]))
+            columns[side + "_run_offsets"].append(len(columns[side + "_run_starts"]))
+        for time, kind, address, data in test[1].events:
+            columns["event_times"].append(time)
+            columns["event_kinds"].append(EVENT_KINDS.index(kind))
+            columns["event_addresses"].append(address)
+            columns["event_data"].append(data)
+        columns["event_offsets"].append(len(columns["event_times"]))
+
+    header_length = CORPUS_HEADER.size + COLUMN_HEADER.size * len(CORPUS_COLUMNS)
+    parts = []
+    table = []
+    offset = aligned(header_length)
+    for name, _ in CORPUS_COLUMNS:
+        data = columns[name].tobytes()
+        table.append(COLUMN_HEADER.pack(offset, len(data)))
+        parts.append(data + bytes(aligned(len(data)) - len(data)))
+        offset += aligned(len(data))
+    header = CORPUS_HEADER.pack(CORPUS_MAGIC, CORPUS_VERSION, len(tests), len(CORPUS_COLUMNS)) + b"".join(table)
+    return b"".join([header + bytes(aligned(header_length) - header_length)] + parts)
+
+
+def aligned(length):
+    return (length + COLUMN_ALIGNMENT - 1) // COLUMN_ALIGNMENT * COLUMN_ALIGNMENT
+
+
+class FuseCorpus:
+    '''
+    The columns of a cached corpus (see the module docstring), read from data: the
+    bytes of a cache file or an mmap of one
+    '''
+
+    def __init__(self, data):
+        magic, version, self.count, column_count = CORPUS_HEADER.unpack_from(data)
+        if magic != CORPUS_MAGIC or version != CORPUS_VERSION or column_count != len(CORPUS_COLUMNS):
+            raise Exception("Not a FUSE corpus cache!!! magic: {}, version: {}".format(magic, version))
+        self.data = data
+        view = memoryview(data)
+        self.columns = {}
+        for i, (name, typecode) in enumerate(CORPUS_COLUMNS):
+            offset, length = COLUMN_HEADER.unpack_from(data, CORPUS_HEADER.size + i * COLUMN_HEADER.size)
+            self.columns[name] = view[offset:offset + length].cast(typecode)
+        names = self.columns["names"].tobytes().decode()
+        offsets = self.columns["name_offsets"]
+        self.names = [names[offsets[i]:offsets[i + 1]] for i in range(self.count)]
+
+    def state(self, index, side):
+        '''
+        FuseState of test index before or after it runs (side is "before" or "after")
+        '''
+        columns = self.columns
+        state = FuseState(self.names[index])
+        register_count = len(FUSE_REGISTERS)
+        state.registers = columns[side + "_registers"][index * register_count:(index + 1) * register_count].tolist()
+        fields = columns[side + "_states"][index * len(STATE_FIELDS):(index + 1) * len(STATE_FIELDS)]
+        for field, value in zip(STATE_FIELDS, fields):
+            setattr(state, field, value)
+        state.tstates = columns[side + "_tstates"][index]
+        starts = columns[side + "_run_starts"]
+        data_offsets = columns[side + "_run_data_offsets"]
+        data = columns[side + "_run_data"]
+        run_offsets = columns[side + "_run_offsets"]
+        state.memory = [
+            (starts[run], data[data_offsets[run]:data_offsets[run + 1]].tobytes())
+            for run in range(run_offsets[index], run_offsets[index + 1])
+        ]
+        if side == "after":
+            first, last = columns["event_offsets"][index], columns["event_offsets"][index + 1]
+            state.events = list(zip(
+                columns["event_times"][first:last].tolist(),
+                [EVENT_KINDS[kind] for kind in columns["event_kinds"][first:last]],
+                columns["event_addresses"][first:last].tolist(),
+                columns["event_data"][first:last].tolist(),
+            ))
+        return state
+
+    def tests(self):
+        '''
+        [(before, after)] FuseState pairs for every test, in tests.in order
+        '''
+        return [(self.state(index, "before"), self.state(index, "after")) for index in range(self.count)]
+
+
+def cache_path(tests_in_path, tests_expected_path, cache_directory=CACHE_DIRECTORY):
+    digest = hashlib.sha256()
+    for path in [tests_in_path, tests_expected_path]:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest.update(struct.pack("<Q", len(data)))
+        digest.update(data)
+    return os.path.join(cache_directory, CACHE_PREFIX + digest.hexdigest()[:16] + CACHE_SUFFIX)
+
+
+def remove_stale_caches(path):
+    '''
+    Removes the cache files in path's directory other than path
+    '''
+    directory = os.path.dirname(path)
+    for name in os.listdir(directory):
+        if name.startswith(CACHE_PREFIX) and name.endswith(CACHE_SUFFIX) and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                # Another process may still have it open
+                pass
+
+
+def load_corpus(tests_in_path=TESTS_IN_PATH, tests_expected_path=TESTS_EXPECTED_PATH, cache_directory=CACHE_DIRECTORY):
+    '''
+    FuseCorpus of the two files, memory-mapping the cache file if there is one for
+    their contents and writing it, in place of any older one, if not
+    '''
+    path = cache_path(tests_in_path, tests_expected_path, cache_directory)
+    if not os.path.exists(path):
+        data = build_corpus(parse_tests(tests_in_path, tests_expected_path))
+        os.makedirs(cache_directory, exist_ok=True)
+        # Written under another name first so a reader never maps half a file
+        temporary_path = "{}.{}".format(path, os.getpid())
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+        remove_stale_caches(path)
+    with open(path, "rb") as f:
+        return FuseCorpus(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
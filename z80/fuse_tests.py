@@ -1,4 +1,5 @@
 import datetime
+import sys
 from helper import Z80TestHandler
 from instructions import instructions_by_opcode
 from base import FLAG_POSITIONS
@@ -91,6 +92,7 @@ with open('./tests.in', 'r') as f:
             next_row += 1
         elif in_order[next_row] == 'states':
             new_test.states = l
+            new_test.tstates = int(l.split()[-1])
             new_test.registers = new_test.registers + ' ' + l[:5]
             new_test.IFF1 = int(l[6])
             new_test.IFF2 = int(l[8])
@@ -131,6 +133,7 @@ with open('./tests.expected', 'r') as f:
         elif in_order[next_row] == 'states':
             l = str(l).replace('\n', '')
             new_test.states = l
+            new_test.tstates = int(l.split()[-1])
             new_test.registers = new_test.registers + ' ' + l[:5]
             next_row += 1
         elif in_order[next_row] == 'memory':
@@ -199,7 +202,7 @@ with open('./tests.expected', 'r') as f:
         return flags
 
 
-def run_test(before, after, test, ignore_flags=False):
+def run_test(before, after, test, ignore_flags=False, engine="interpreter"):
     b = before[test]
     b.load_test_registers()
     b.load_test_memory()
@@ -235,18 +238,26 @@ def run_test(before, after, test, ignore_flags=False):
 
     print(get_flags(205))
 
-    Z80TestHandler(registers, {}, memory, ports, '', False, True, b.IFF1, b.IFF2, ignore_flags)
+    handler = Z80TestHandler(registers, {}, memory, ports, '', False, True, b.IFF1, b.IFF2, ignore_flags, engine)
+    if handler.z80.tstates != a.tstates:
+        tstates_mismatches.append((test, handler.z80.tstates, a.tstates))
 
 
 #TEST = 'ddcb80'
 TEST = ''
 
+# python fuse_tests.py block runs the tests on the block translation engine
+ENGINE = sys.argv[1] if len(sys.argv) > 1 else "interpreter"
+
 start = datetime.datetime.now()
 
+# (test, counted, expected); dd00 and ddfd00 run a second instruction in FUSE
+tstates_mismatches = []
+
 START = '00'
 start_reached = False
 if TEST:
-    run_test(before, after, TEST)
+    run_test(before, after, TEST, engine=ENGINE)
 else:
     for test in before:
         if test == START:
@@ -269,9 +280,10 @@ else:
         else:
             ignore_flags = False
         print('TEST: {}'.format(test))
-        run_test(before, after, test, ignore_flags)
+        run_test(before, after, test, ignore_flags, ENGINE)
 
 print (datetime.datetime.now() - start)
+print('T-state mismatches: {}'.format(tstates_mismatches))
 '''
     b = before[TEST]
     #print(b.registers)
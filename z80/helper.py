@@ -26,7 +26,7 @@ class DoubleByte:
 
 
 class Z80TestHandler:
-    def __init__(self, registers, flags, memory, ports, instruction_text, run=True, run_fuse=False, iff1=0, iff2=0, ignore_flags=False):
+    def __init__(self, registers, flags, memory, ports, instruction_text, run=True, run_fuse=False, iff1=0, iff2=0, ignore_flags=False, engine="interpreter"):
         self.test_registers = registers
         self.test_flags = flags
         self.test_memory = memory
@@ -37,9 +37,10 @@ class Z80TestHandler:
         self.set_flags()
         self.set_memory()
         self.set_ports()
-        self.z80.iff1 = iff1
-        self.z80.iff2 = iff2
+        self.z80.IFF1 = iff1
+        self.z80.IFF2 = iff2
         self.ignore_flags = ignore_flags
+        self.engine = engine
 
         if run:
             self.run_test()
@@ -66,7 +67,7 @@ class Z80TestHandler:
             last += 1
         if last > self.test_registers["PC"][1] + 2:
             last = self.test_registers["PC"][1]
-        self.z80.run(code_end=last)
+        self.z80.run(code_end=last, engine=self.engine)
         self.assert_registers()
         self.assert_memory()
 
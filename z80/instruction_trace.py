@@ -0,0 +1,245 @@
+'''
+Instruction traces, written by Z80.run(tracer=InstructionTracer(path)).
+
+For each instruction executed the trace records the step number (instructions
+executed so far in the run), T-states and registers after it, the address it was
+fetched from, its opcode bytes and its Instruction.text. Records can be limited to PC
+ranges or to mnemonics (Instruction.instruction_base, e.g. "call").
+
+Records are packed into blocks of block_records, and a background thread compresses
+each block with zlib and writes it, so compression overlaps emulation. Blocks wait in
+a queue of at most queue_blocks, bounding memory if the writer falls behind. The file
+ends with a sparse index of each block's first record number and file offset, so
+InstructionTraceReader can seek to record N by decompressing one block.
+'''
+import bisect
+import queue
+import struct
+import threading
+import zlib
+
+from checkpoint import CHECKPOINT_REGISTERS
+
+TRACE_MAGIC = b"Z80T"
+TRACE_VERSION = 1
+# magic, version
+TRACE_HEADER = struct.Struct("<4sH")
+# compressed length, record count
+TRACE_BLOCK_HEADER = struct.Struct("<II")
+# first record number, file offset of each block
+TRACE_INDEX_ENTRY = struct.Struct("<QQ")
+# index offset, block count, magic
+TRACE_FOOTER = struct.Struct("<QQ4s")
+# step, T-states, PC, registers, opcode length, text length; opcode and text follow
+TRACE_RECORD = struct.Struct("<QQH{}HBB".format(len(CHECKPOINT_REGISTERS)))
+
+DEFAULT_BLOCK_RECORDS = 4096
+DEFAULT_QUEUE_BLOCKS = 8
+DEFAULT_COMPRESSION_LEVEL = 6
+
+
+class TraceRecord:
+
+    def __init__(self, step, tstates, pc, opcode, text, registers):
+        self.step = step
+        self.tstates = tstates
+        self.pc = pc
+        self.opcode = opcode
+        self.text = text
+        self.registers = registers
+
+    def __repr__(self):
+        return "{} {:04x} {:<14} {}".format(self.step, self.pc, self.text, self.opcode.hex())
+
+
+class InstructionTracer:
+
+    def __init__(self, path, pc_ranges=None, mnemonics=None, block_records=DEFAULT_BLOCK_RECORDS,
+                 queue_blocks=DEFAULT_QUEUE_BLOCKS, level=DEFAULT_COMPRESSION_LEVEL):
+        '''
+        pc_ranges is a list of (start, end) addresses, end excluded, and mnemonics a
+        collection of instruction bases. An instruction is recorded if it matches both
+        filters that are given.
+        '''
+        self.pc_ranges = pc_ranges
+        self.mnemonics = set(mnemonics) if mnemonics is not None else None
+        self.block_records = block_records
+        self.level = level
+        self.step = 0
+        self.count = 0
+        self.z80 = None
+        self.register_getters = None
+        self.block = bytearray()
+        self.block_count = 0
+        self.queue = queue.Queue(maxsize=queue_blocks)
+        self.error = None
+        self.file = open(path, "wb")
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION))
+        self.writer = threading.Thread(target=self.write_blocks, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def wanted(self, pc, instruction):
+        if self.mnemonics is not None and instruction.instruction_base not in self.mnemonics:
+            return False
+        if self.pc_ranges is not None:
+            return any(start <= pc < end for start, end in self.pc_ranges)
+        return True
+
+    def record(self, z80, pc, opcode, instruction):
+        '''
+        Called by Z80.run after each instruction with the address and bytes it was
+        fetched from. DDCB and FDCB instructions are given as the instruction they stand
+        for (see Z80.indexed_bit_instruction).
+        '''
+        step = self.step
+        self.step += 1
+        if (self.mnemonics is not None or self.pc_ranges is not None) and not self.wanted(pc, instruction):
+            return
+        if z80 is not self.z80:
+            self.z80 = z80
+            self.register_getters = [z80.registers_by_name[name].get_contents for name in CHECKPOINT_REGISTERS]
+        text = instruction.text.encode()
+        self.block += TRACE_RECORD.pack(
+            step, z80.tstates, pc, *[get() for get in self.register_getters], len(opcode), len(text)
+        ) + opcode + text
+        self.count += 1
+        self.block_count += 1
+        if self.block_count == self.block_records:
+            self.flush()
+
+    def flush(self):
+        if self.block_count:
+            if self.error is not None:
+                raise self.error
+            self.queue.put((bytes(self.block), self.block_count))
+            self.block = bytearray()
+            self.block_count = 0
+
+    def write_blocks(self):
+        index = []
+        first_record = 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            data, count = item
+            if self.error is not None:
+                continue
+            try:
+                compressed = zlib.compress(data, self.level)
+                index.append((first_record, self.file.tell()))
+                self.file.write(TRACE_BLOCK_HEADER.pack(len(compressed), count))
+                self.file.write(compressed)
+                first_record += count
+            except Exception as e:
+                self.error = e
+        self.index = index
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+        try:
+            if self.error is not None:
+                raise self.error
+            index_offset = self.file.tell()
+            for entry in self.index:
+                self.file.write(TRACE_INDEX_ENTRY.pack(*entry))
+            self.file.write(TRACE_FOOTER.pack(index_offset, len(self.index), TRACE_MAGIC))
+        finally:
+            self.file.close()
+
+
+class InstructionTraceReader:
+    '''
+    The records of a trace file: len(reader), reader[n] and iteration, reading one
+    block at a time
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic, version = TRACE_HEADER.unpack(self.file.read(TRACE_HEADER.size))
+        self.file.seek(-TRACE_FOOTER.size, 2)
+        index_offset, block_count, end_magic = TRACE_FOOTER.unpack(self.file.read(TRACE_FOOTER.size))
+        if magic != TRACE_MAGIC or end_magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise Exception("Not a complete instruction trace!!! path: {}".format(path))
+        self.file.seek(index_offset)
+        data = self.file.read(TRACE_INDEX_ENTRY.size * block_count)
+        entries = [TRACE_INDEX_ENTRY.unpack_from(data, i * TRACE_INDEX_ENTRY.size) for i in range(block_count)]
+        self.first_records = [first for first, _ in entries]
+        self.offsets = [offset for _, offset in entries]
+        self.length = 0
+        if entries:
+            self.file.seek(self.offsets[-1])
+            _, count = TRACE_BLOCK_HEADER.unpack(self.file.read(TRACE_BLOCK_HEADER.size))
+            self.length = self.first_records[-1] + count
+        self.cached_block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return self.length
+
+    def read_block(self, block):
+        if self.cached_block is not None and self.cached_block[0] == block:
+            return self.cached_block[1]
+        self.file.seek(self.offsets[block])
+        length, _ = TRACE_BLOCK_HEADER.unpack(self.file.read(TRACE_BLOCK_HEADER.size))
+        records = list(unpack_records(zlib.decompress(self.file.read(length))))
+        self.cached_block = (block, records)
+        return records
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.length
+        if not 0 <= n < self.length:
+            raise IndexError(n)
+        block = bisect.bisect_right(self.first_records, n) - 1
+        return self.read_block(block)[n - self.first_records[block]]
+
+    def records(self, start=0):
+        '''
+        Records from number start on
+        '''
+        if start >= self.length:
+            return
+        block = bisect.bisect_right(self.first_records, start) - 1
+        skip = start - self.first_records[block]
+        for block in range(block, len(self.offsets)):
+            records = self.read_block(block)
+            yield from records[skip:]
+            skip = 0
+
+    def __iter__(self):
+        return self.records()
+
+
+def unpack_records(data):
+    position = 0
+    register_count = len(CHECKPOINT_REGISTERS)
+    while position < len(data):
+        fields = TRACE_RECORD.unpack_from(data, position)
+        position += TRACE_RECORD.size
+        step, tstates, pc = fields[:3]
+        registers = dict(zip(CHECKPOINT_REGISTERS, fields[3:3 + register_count]))
+        opcode_length, text_length = fields[3 + register_count:]
+        opcode = data[position:position + opcode_length]
+        position += opcode_length
+        text = data[position:position + text_length].decode()
+        position += text_length
+        yield TraceRecord(step, tstates, pc, opcode, text, registers)
@@ -68,16 +68,34 @@ SET_CARRY_FLAG = "scf"
 RESTART = "rst"
 RESET = "res"
 SET = "set"
+HALT = "halt"
+DISABLE_INTERRUPTS = "di"
+ENABLE_INTERRUPTS = "ei"
+INTERRUPT_MODE = "im"
 DDCB = "DDCB"
 FDCB = "FDCB"
 
 
 JUMP_INSTRUCTIONS = [JUMP, JUMP_RELATIVE, DEC_JUMP_RELATIVE, CALL]
 
+REPEAT_INSTRUCTIONS = [
+    LOAD_INC_REPEAT, LOAD_DEC_REPEAT, COMPARE_INC_REPEAT, COMPARE_DEC_REPEAT,
+    IN_INC_REPEAT, IN_DEC_REPEAT, OUT_INC_REPEAT, OUT_DEC_REPEAT,
+]
+
 INSTRUCTION_FLAG_POSITIONS = [
     CARRY_FLAG, ADD_SUBTRACT_FLAG, PARITY_OVERFLOW_FLAG, HALF_CARRY_FLAG, ZERO_FLAG, SIGN_FLAG
 ]
 
+def parse_time(time):
+    '''
+    Returns (tstates, tstates_not_taken) for a time such as "4" or "12/7". The first
+    value is for a branch that is taken or a block instruction that repeats.
+    '''
+    values = [int(value) for value in time.split("/")]
+    return values[0], values[-1]
+
+
 class Instruction:
     
     def __init__(self, opcode, instruction_base, left_arg, right_arg, size, time, flags, text, desc):
@@ -85,6 +103,7 @@ class Instruction:
         self.text = text
         self.size = int(size)
         self.time = time
+        self.tstates, self.tstates_not_taken = parse_time(time)
         self.flags = flags
         self.desc = desc
         self.instruction_base = instruction_base
@@ -1370,3 +1389,23 @@ instructions = [
 instructions_by_opcode = {i.opcode: i for i in instructions}
 
 instructions_by_text = {i.text: i for i in instructions}
+
+OPCODE_PREFIXES = ["", "CB", "ED", "DD", "FD", DDCB, FDCB]
+
+
+def build_opcode_tables():
+    '''
+    One 256 entry list per opcode prefix, indexed by the final opcode byte.
+    Unassigned opcodes are None.
+    '''
+    tables = {prefix: [None] * 256 for prefix in OPCODE_PREFIXES}
+    for i in instructions:
+        opcode = i.opcode.rstrip("0123456789")
+        if opcode == i.opcode:
+            # DDCB/FDCB dispatch hacks, looked up via instructions_by_opcode
+            continue
+        tables[opcode][int(i.opcode[len(opcode):])] = i
+    return tables
+
+
+instructions_by_prefix = build_opcode_tables()
@@ -0,0 +1,134 @@
+'''
+Host time spent in each phase of the interpreter, for attributing slowdowns in the
+emulator itself rather than in guest code (see profiler.py for that).
+
+InstrumentedZ80 is a Z80 that overrides decode_instruction, set_flags_if_required and
+execute_instruction to add perf_counter_ns differences to per-phase totals, and to
+per-mnemonic totals for execute_instruction:
+
+    decode        decode_instruction, including read_memory_and_increment_pc and
+                  dd_opcode/fd_opcode
+    substitute    the operand resolvers (see operands.py), including substitute_arg
+                  for the operands they hand back to it
+    execute       the execute method, without the flag setting below
+    flags         set_flags_if_required
+    undocumented  the undocumented flag method
+
+Time in run that is in none of these (the run loop, interrupts, the block engine's
+translated code) is reported as other. execute_instruction is a timed copy of
+Z80.execute_instruction rather than a wrapper, so the plain Z80 keeps its single
+method and pays nothing; the two need changing together. A Z80 is not instrumented at
+all, so choose InstrumentedZ80 when constructing the emulator to measure it. Each
+timed section adds the cost of reading the clock, so compare reports with each other
+rather than with uninstrumented timings.
+'''
+import time
+
+from instructions import DDCB, FDCB
+from z80 import Z80
+
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    # Python 3.6
+    def perf_counter_ns():
+        return int(time.perf_counter() * 1e9)
+
+DECODE_PHASE = "decode"
+SUBSTITUTE_PHASE = "substitute"
+EXECUTE_PHASE = "execute"
+FLAGS_PHASE = "flags"
+UNDOCUMENTED_PHASE = "undocumented"
+OTHER_PHASE = "other"
+PHASES = [DECODE_PHASE, SUBSTITUTE_PHASE, EXECUTE_PHASE, FLAGS_PHASE, UNDOCUMENTED_PHASE]
+
+
+class InstrumentedZ80(Z80):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_instrumentation()
+
+    def reset_instrumentation(self):
+        self.phase_ns = {phase: 0 for phase in PHASES}
+        self.run_ns = 0
+        self.instruction_count = 0
+        self.mnemonic_counts = {}
+        # Time in execute_instruction by instruction base
+        self.mnemonic_ns = {}
+
+    def run(self, *args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            super().run(*args, **kwargs)
+        finally:
+            self.run_ns += perf_counter_ns() - start
+
+    def decode_instruction(self):
+        start = perf_counter_ns()
+        result = super().decode_instruction()
+        self.phase_ns[DECODE_PHASE] += perf_counter_ns() - start
+        return result
+
+    def set_flags_if_required(self, instruction, potential_flags):
+        start = perf_counter_ns()
+        super().set_flags_if_required(instruction, potential_flags)
+        self.phase_ns[FLAGS_PHASE] += perf_counter_ns() - start
+
+    def execute_instruction(self, instruction):
+        phase_ns = self.phase_ns
+        start = perf_counter_ns()
+        if instruction.instruction_base == DDCB or instruction.instruction_base == FDCB:
+            instruction = self.indexed_bit_instruction(instruction)
+            substituted_left_arg = instruction.substitute_left_prefixed(self)
+            substituted_right_arg = instruction.substitute_right_prefixed(self)
+        else:
+            substituted_left_arg = instruction.substitute_left(self)
+            substituted_right_arg = instruction.substitute_right(self)
+        substituted = perf_counter_ns()
+        flags_ns = phase_ns[FLAGS_PHASE]
+        self.handlers[instruction.execute_index](instruction, substituted_left_arg, substituted_right_arg)
+        self.tstates += instruction.tstates_not_taken
+        executed = perf_counter_ns()
+        if instruction.undocumented_index is not None:
+            self.handlers[instruction.undocumented_index](instruction, substituted_left_arg, substituted_right_arg)
+        end = perf_counter_ns()
+        phase_ns[SUBSTITUTE_PHASE] += substituted - start
+        phase_ns[EXECUTE_PHASE] += executed - substituted - (phase_ns[FLAGS_PHASE] - flags_ns)
+        phase_ns[UNDOCUMENTED_PHASE] += end - executed
+        base = instruction.instruction_base
+        self.instruction_count += 1
+        self.mnemonic_counts[base] = self.mnemonic_counts.get(base, 0) + 1
+        self.mnemonic_ns[base] = self.mnemonic_ns.get(base, 0) + end - start
+
+    def phases(self):
+        '''
+        [(phase, nanoseconds)], including OTHER_PHASE
+        '''
+        totals = [(phase, self.phase_ns[phase]) for phase in PHASES]
+        totals.append((OTHER_PHASE, max(0, self.run_ns - sum(self.phase_ns.values()))))
+        return totals
+
+    def mnemonics(self):
+        '''
+        [(instruction base, executions, nanoseconds)], most time first
+        '''
+        totals = [(base, count, self.mnemonic_ns[base]) for base, count in self.mnemonic_counts.items()]
+        totals.sort(key=lambda e: (-e[2], e[0]))
+        return totals
+
+    def instrumentation_report(self, count=20):
+        '''
+        Text tables of the time in each phase and for the mnemonics that took longest
+        '''
+        total = max(1, self.run_ns)
+        instructions = max(1, self.instruction_count)
+        lines = ["{} instructions in {:.1f} ms".format(self.instruction_count, self.run_ns / 1e6), ""]
+        lines.append("{:<12} {:>10} {:>10} {:>6}".format("phase", "ms", "ns/instr", "%"))
+        for phase, ns in self.phases():
+            lines.append("{:<12} {:>10.2f} {:>10.0f} {:>6.1f}".format(phase, ns / 1e6, ns / instructions, 100 * ns / total))
+        lines.append("")
+        lines.append("{:<12} {:>10} {:>10} {:>10}".format("mnemonic", "count", "ms", "ns/instr"))
+        for base, executions, ns in self.mnemonics()[:count]:
+            lines.append("{:<12} {:>10} {:>10.2f} {:>10.0f}".format(base, executions, ns / 1e6, ns / executions))
+        return "\n".join(lines)
@@ -0,0 +1,295 @@
+'''
+Operand compilation.
+
+Z80.substitute_arg and Z80.substitute_right_arg work out what an argument string such as
+"(ix+*)" means every time an instruction executes. The left and right args of an
+instruction never change, so the same decisions are made here once per instruction and
+stored on it as resolvers: callables that take the Z80 and return the substituted arg,
+reading any immediate bytes from memory exactly as the string based versions do.
+Resolvers of registers and constants give the same result every time for a Z80, so
+they are marked fixed and the block engine resolves them once when translating.
+'''
+from instructions import (
+    SPECIAL_ARGS, JUMP_INSTRUCTIONS, RESTART, DDCB, FDCB, ROT_RIGHT_C_ACC, ROT_LEFT_ACC,
+    ROT_LEFT_C_ACC, ROT_RIGHT_ACC, ROT_RIGHT_DEC, EXCHANGE,
+)
+
+DOUBLE_REGISTERS = ["AF", "BC", "DE", "HL", "IX", "IY", "PC", "SP", "AF'", "BC'", "DE'", "HL'"]
+
+SINGLE_REGISTERS = [
+    "A", "B", "C", "D", "E", "F", "H", "L", "I", "R", "IXH", "IXL", "IYH", "IYL",
+    "A'", "B'", "C'", "D'", "E'", "F'",
+]
+
+IMPLIED_A_INSTRUCTIONS = [ROT_RIGHT_C_ACC, ROT_LEFT_ACC, ROT_LEFT_C_ACC, ROT_RIGHT_ACC, ROT_RIGHT_DEC]
+
+# Substituted arg shapes, used to decide what a right arg resolves to
+CONSTANT = "constant"
+REGISTER = "register"
+CELL = "cell"
+CELL_PAIR = "cell pair"
+VALUE = "value"
+
+
+def is_register(arg):
+    return arg.upper() in DOUBLE_REGISTERS or arg.upper() in SINGLE_REGISTERS
+
+
+def is_digit(arg):
+    return isinstance(arg, str) and arg.isdigit()
+
+
+def wants_single_cell(opposite_arg):
+    '''
+    Mirrors the (reg) / (**) checks in Z80.substitute_arg: a memory operand is a single
+    cell unless the other arg is a 16 bit register. Returns None when the answer is only
+    known at run time (the string path raises for these).
+    '''
+    if not opposite_arg:
+        return True
+    if opposite_arg.upper() in SINGLE_REGISTERS:
+        return True
+    if opposite_arg.upper() in DOUBLE_REGISTERS:
+        return False
+    return None
+
+
+def read_byte(z80):
+    return z80.read_memory_and_increment_pc()[0]
+
+
+def read_word(z80):
+    low_byte, end_of_memory_reached = z80.read_memory_and_increment_pc()
+    if end_of_memory_reached:
+        raise Exception("Out of memory!!!")
+    high_byte, _ = z80.read_memory_and_increment_pc()
+    return high_byte * 256 + low_byte
+
+
+def port_resolver(z80):
+    '''
+    in a,(*) and out (*),a put A on the high byte of the port address
+    '''
+    return (z80.A.get_contents() << 8) | read_byte(z80)
+
+
+def constant_resolver(value):
+    def resolve(z80):
+        return value
+    resolve.fixed = True
+    return resolve
+
+
+def register_resolver(name):
+    def resolve(z80):
+        return z80.registers_by_name[name]
+    resolve.fixed = True
+    return resolve
+
+
+def register_value_resolver(name):
+    def resolve(z80):
+        return z80.registers_by_name[name].get_contents()
+    return resolve
+
+
+def register_indirect_resolver(name, single_cell):
+    if single_cell:
+        def resolve(z80):
+            return z80.memory.get_contents(z80.registers_by_name[name].get_contents())
+    else:
+        def resolve(z80):
+            address = z80.registers_by_name[name].get_contents()
+            return (z80.memory.get_contents(address), z80.memory.get_contents(address + 1))
+    return resolve
+
+
+def indexed_resolver(name, skip_trailing_byte):
+    def resolve(z80):
+        index_value = z80.registers_by_name[name].get_contents()
+        displacement = z80.twos_complement(read_byte(z80))
+        substituted_arg = z80.memory.get_contents(index_value + displacement)
+        if skip_trailing_byte:
+            read_byte(z80)
+        return substituted_arg
+    return resolve
+
+
+def absolute_resolver(single_cell):
+    if single_cell:
+        def resolve(z80):
+            return z80.memory.get_contents(read_word(z80))
+    else:
+        def resolve(z80):
+            address = read_word(z80)
+            return (z80.memory.get_contents(address), z80.memory.get_contents(address + 1))
+    return resolve
+
+
+def fallback_resolver(arg, opposite_arg, special, right):
+    if right:
+        def resolve(z80):
+            return z80.substitute_right_arg(arg, opposite_arg, special)
+    else:
+        def resolve(z80):
+            return z80.substitute_arg(arg, opposite_arg, special)
+    return resolve
+
+
+def compile_arg(arg, opposite_arg, special=False):
+    '''
+    Returns (resolver, shape) equivalent to Z80.substitute_arg(arg, opposite_arg, special),
+    or (None, None) if the arg can only be handled by the string path.
+    '''
+    resolver, shape = compile_arg_body(arg, opposite_arg, special)
+    if resolver and special in [DDCB, FDCB] and not opposite_arg.isdigit():
+        body = resolver
+
+        def resolver(z80):
+            read_byte(z80)
+            return body(z80)
+    return resolver, shape
+
+
+def compile_arg_body(arg, opposite_arg, special):
+    if arg and arg.isdigit():
+        return constant_resolver(int(arg)), VALUE
+    if not arg or arg in SPECIAL_ARGS:
+        return constant_resolver(arg), CONSTANT
+    if is_register(arg):
+        return register_resolver(arg.upper()), REGISTER
+    if "(" in arg:
+        arg = arg[1:-1]
+        if arg == "c":
+            return register_value_resolver("BC"), VALUE
+        if arg == "*":
+            return port_resolver, VALUE
+        if is_register(arg):
+            if is_digit(opposite_arg) or opposite_arg == "*":
+                single_cell = True
+            else:
+                single_cell = wants_single_cell(opposite_arg)
+            if single_cell is None:
+                return None, None
+            return register_indirect_resolver(arg.upper(), single_cell), CELL if single_cell else CELL_PAIR
+        if arg == "ix+*":
+            skip_trailing_byte = special == DDCB and opposite_arg.isdigit()
+            return indexed_resolver("IX", skip_trailing_byte), CELL
+        if arg == "iy+*":
+            skip_trailing_byte = special == FDCB and opposite_arg.isdigit()
+            return indexed_resolver("IY", skip_trailing_byte), CELL
+        if "**" in arg:
+            single_cell = wants_single_cell(opposite_arg)
+            if single_cell is None:
+                return None, None
+            return absolute_resolver(single_cell), CELL if single_cell else CELL_PAIR
+        return None, None
+    if arg == "*":
+        return read_byte, VALUE
+    if arg == "**":
+        return read_word, VALUE
+    return None, None
+
+
+def compile_right_arg(arg, opposite_arg=None, special=False):
+    '''
+    Returns a resolver equivalent to Z80.substitute_right_arg(arg, opposite_arg, special)
+    '''
+    if not arg or arg in SPECIAL_ARGS:
+        if special == DDCB:
+            def resolve(z80):
+                read_byte(z80)
+                return arg
+            return resolve
+        return constant_resolver(arg)
+    resolver, shape = compile_arg(arg, opposite_arg, special)
+    if resolver is None:
+        return fallback_resolver(arg, opposite_arg, special, right=True)
+    if is_digit(opposite_arg) or shape in [VALUE, CONSTANT]:
+        return resolver
+    if shape in [REGISTER, CELL]:
+        if special == DDCB:
+            return resolver
+        if shape == REGISTER:
+            return register_value_resolver(arg.upper())
+        return value_resolver(resolver)
+    return pair_value_resolver(resolver)
+
+
+def value_resolver(resolver):
+    def resolve(z80):
+        return resolver(z80).get_contents()
+    return resolve
+
+
+def pair_value_resolver(resolver):
+    def resolve(z80):
+        low, high = resolver(z80)
+        return high.get_contents() * 256 + low.get_contents()
+    return resolve
+
+
+def compile_left_arg(arg, opposite_arg, special=False):
+    resolver, _ = compile_arg(arg, opposite_arg, special)
+    if resolver is None:
+        return fallback_resolver(arg, opposite_arg, special, right=False)
+    return resolver
+
+
+def skip_byte_resolver(z80):
+    read_byte(z80)
+    return None
+
+
+def compile_operands(instruction):
+    '''
+    Sets instruction.substitute_left and instruction.substitute_right, the resolvers used
+    by Z80.execute_instruction. Instructions in the DDCB and FDCB tables also get
+    substitute_left_prefixed and substitute_right_prefixed, used when they are reached
+    through the DDCB/FDCB dispatch hack.
+    '''
+    left_arg = instruction.left_arg
+    right_arg = instruction.right_arg
+    if instruction.instruction_base in [DDCB, FDCB]:
+        instruction.substitute_left = None
+        instruction.substitute_right = None
+        return
+    if instruction.instruction_base in JUMP_INSTRUCTIONS:
+        left_arg = left_arg.replace("(", "").replace(")", "")
+        if left_arg == "c":
+            left_arg = "cf"
+        if right_arg:
+            right_arg = right_arg.replace("(", "").replace(")", "")
+        else:
+            right_arg = left_arg
+            left_arg = None
+        instruction.substitute_left = compile_left_arg(left_arg, right_arg)
+        instruction.substitute_right = compile_right_arg(right_arg, left_arg)
+    elif instruction.instruction_base == RESTART:
+        instruction.substitute_left = constant_resolver(int(left_arg.replace("h", ""), 16))
+        instruction.substitute_right = constant_resolver(None)
+    elif instruction.instruction_base in IMPLIED_A_INSTRUCTIONS:
+        instruction.substitute_left = register_resolver("A")
+        instruction.substitute_right = constant_resolver(None)
+    elif instruction.instruction_base == EXCHANGE:
+        # exchange needs the right register itself rather than its value
+        instruction.substitute_left = compile_left_arg(left_arg, right_arg)
+        instruction.substitute_right = compile_left_arg(right_arg, left_arg)
+    else:
+        instruction.substitute_left = compile_left_arg(left_arg, right_arg)
+        instruction.substitute_right = compile_right_arg(right_arg, left_arg)
+
+    if instruction.opcode.startswith(DDCB):
+        instruction.substitute_left_prefixed = compile_left_arg(left_arg, right_arg)
+        instruction.substitute_right_prefixed = compile_right_arg(right_arg, left_arg, DDCB)
+    elif instruction.opcode.startswith(FDCB):
+        instruction.substitute_left_prefixed = compile_left_arg(left_arg, right_arg)
+        if right_arg:
+            instruction.substitute_right_prefixed = compile_left_arg(right_arg, left_arg, FDCB)
+        else:
+            instruction.substitute_right_prefixed = skip_byte_resolver
+
+
+def compile_instructions(instructions):
+    for instruction in instructions:
+        compile_operands(instruction)
@@ -0,0 +1,211 @@
+'''
+Paged memory for machines with more RAM or ROM than the 64K address space, such as the
+128K Spectrum.
+
+All banks live in one bytearray pool and each bank is a memoryview of it. The address
+space is split into pages of page_size bytes (16K by default), and the page tables map
+each page to a bank: read_pages for reads and write_pages for writes. Bank switching
+replaces page table entries, so no bytes are copied. A read only bank is mapped for
+writes to a scratch page, so ROM costs nothing extra on a write.
+
+Write listeners (such as the block engine's BlockCache) are told about a bank switch
+as a write to the whole of the page it affects, so only code in that page is dropped.
+A bank can be mapped at more than one page, so a write is reported at every page the
+written bank is mapped at.
+
+The pool is the storage of the memory, so dirty pages (see Memory.track_dirty_pages)
+record which parts of which banks were written, whatever was mapped at the time.
+'''
+from base import Memory, ADDRESS_SPACE_SIZE, DIRTY_PAGE_SHIFT
+
+DEFAULT_PAGE_SIZE = 16 * 1024
+
+
+class PagedMemory(Memory):
+
+    def __init__(self, bank_count, page_size=DEFAULT_PAGE_SIZE, size=ADDRESS_SPACE_SIZE):
+        if page_size & (page_size - 1) or size % page_size:
+            raise Exception("Page size must be a power of 2 dividing the memory size!!! page size: {}".format(page_size))
+        self.size = size
+        self.page_size = page_size
+        self.page_shift = page_size.bit_length() - 1
+        self.page_mask = page_size - 1
+        self.write_listeners = []
+        self.region_map = None
+        self.dirty_pages = None
+        self.pool = bytearray(bank_count * page_size)
+        self.storage = self.pool
+        pool_view = memoryview(self.pool)
+        self.banks = [pool_view[i * page_size:(i + 1) * page_size] for i in range(bank_count)]
+        self.scratch_page = memoryview(bytearray(page_size))
+        page_count = size // page_size
+        self.read_pages = [None] * page_count
+        self.write_pages = [None] * page_count
+        # The bank mapped at each page
+        self.page_banks = [None] * page_count
+        # For each page, the start addresses of the pages its bank is mapped at
+        self.page_aliases = [[] for _ in range(page_count)]
+        for page in range(page_count):
+            self.map_bank(page, page % bank_count)
+
+    def map_bank(self, page, bank, read_only=False):
+        '''
+        Maps bank into page. Writes to a read only bank are discarded.
+        '''
+        view = self.banks[bank]
+        self.read_pages[page] = view
+        self.write_pages[page] = self.scratch_page if read_only else view
+        self.page_banks[page] = bank
+        for other_page, other_bank in enumerate(self.page_banks):
+            self.page_aliases[other_page] = [
+                alias << self.page_shift for alias, alias_bank in enumerate(self.page_banks) if alias_bank == other_bank
+            ]
+        for listener in self.write_listeners:
+            listener(page << self.page_shift, self.page_size)
+
+    def layout(self):
+        '''
+        The bank mapped at each page, then whether each page is read only
+        '''
+        read_only = [self.write_pages[page] is self.scratch_page for page in range(len(self.page_banks))]
+        return bytes(self.page_banks) + bytes(read_only)
+
+    def set_layout(self, layout):
+        page_count = len(self.page_banks)
+        for page in range(page_count):
+            self.map_bank(page, layout[page], bool(layout[page_count + page]))
+
+    def load_bank(self, bank, data, start=0):
+        '''
+        Loads data into a bank whether or not it is mapped, e.g. a ROM image
+        '''
+        self.banks[bank][start:start + len(data)] = bytes(data)
+        self.bank_written(bank, start, len(data))
+
+    def bank_written(self, bank, start, length):
+        '''
+        Records a change to a bank made through self.banks, telling write listeners
+        about the pages it is mapped at
+        '''
+        self.mark_dirty(bank * self.page_size + start, length)
+        for page, mapped_bank in enumerate(self.page_banks):
+            if mapped_bank == bank:
+                for listener in self.write_listeners:
+                    listener((page << self.page_shift) + start, length)
+
+    def written(self, start, length):
+        for page, offset, piece in self.page_ranges(start, length):
+            self.mark_dirty(self.page_banks[page] * self.page_size + offset, piece)
+            self.page_written(page, offset, piece)
+
+    def page_written(self, page, offset, length):
+        '''
+        Tells write listeners about a write through page, at every page its bank is
+        mapped at
+        '''
+        for alias in self.page_aliases[page]:
+            for listener in self.write_listeners:
+                listener(alias + offset, length)
+
+    def storage_offset(self, address):
+        return self.page_banks[address >> self.page_shift] * self.page_size + (address & self.page_mask)
+
+    def get_contents_value(self, address):
+        return self.read_pages[address >> self.page_shift][address & self.page_mask]
+
+    def set_contents_value(self, address, value):
+        self.write_pages[address >> self.page_shift][address & self.page_mask] = value
+        if self.write_listeners:
+            self.page_written(address >> self.page_shift, address & self.page_mask, 1)
+
+    def tracked_set_contents_value(self, address, value):
+        self.write_pages[address >> self.page_shift][address & self.page_mask] = value
+        self.dirty_pages[self.storage_offset(address) >> DIRTY_PAGE_SHIFT] = 1
+        if self.write_listeners:
+            self.page_written(address >> self.page_shift, address & self.page_mask, 1)
+
+    def mapped_get_contents_value(self, address):
+        region = self.region_map[address]
+        if region is None or region[0] is None:
+            return self.read_pages[address >> self.page_shift][address & self.page_mask]
+        return region[0](address)
+
+    def mapped_set_contents_value(self, address, value):
+        region = self.region_map[address]
+        if region is None or region[1] is None:
+            self.write_pages[address >> self.page_shift][address & self.page_mask] = value
+            if self.dirty_pages is not None:
+                self.dirty_pages[self.storage_offset(address) >> DIRTY_PAGE_SHIFT] = 1
+        else:
+            region[1](address, value)
+        if self.write_listeners:
+            self.page_written(address >> self.page_shift, address & self.page_mask, 1)
+
+    def clone(self):
+        memory = PagedMemory(len(self.banks), self.page_size, self.size)
+        memory.pool[:] = self.pool
+        memory.set_layout(self.layout())
+        return memory
+
+    def page_ranges(self, start, length):
+        '''
+        Splits start..start + length - 1 into (page, offset, length) pieces that each
+        stay within one page
+        '''
+        end = start + length
+        while start < end:
+            page = start >> self.page_shift
+            offset = start & self.page_mask
+            piece = min(self.page_size - offset, end - start)
+            yield page, offset, piece
+            start += piece
+
+    def read_block(self, start, length):
+        return b"".join(
+            self.read_pages[page][offset:offset + piece].tobytes()
+            for page, offset, piece in self.page_ranges(start, length)
+        )
+
+    def copy_block(self, source, destination, length):
+        return False
+
+    def find(self, value, start, end):
+        return None
+
+    def rfind(self, value, start, end):
+        return None
+
+    def dump(self):
+        return list(self.read_block(0, self.size))
+
+    def load(self, data, start=0):
+        '''
+        Loads data into the banks mapped for reading, so ROM can be loaded this way
+        '''
+        if start + len(data) > self.size:
+            raise Exception("Data does not fit in memory!!! start: {}, length: {}, memory size: {}".format(start, len(data), self.size))
+        data = bytes(data)
+        position = 0
+        for page, offset, piece in self.page_ranges(start, len(data)):
+            self.read_pages[page][offset:offset + piece] = data[position:position + piece]
+            position += piece
+        self.written(start, len(data))
+
+    def load_file(self, file, start, length):
+        if start + length > self.size:
+            raise Exception("Data does not fit in memory!!! start: {}, length: {}, memory size: {}".format(start, length, self.size))
+        count = 0
+        for page, offset, piece in self.page_ranges(start, length):
+            count += file.readinto(self.read_pages[page][offset:offset + piece])
+        self.written(start, length)
+        return count
+
+    def block_view(self, start, length):
+        '''
+        As Memory.block_view, but None if the bytes cross a page boundary
+        '''
+        page = start >> self.page_shift
+        offset = start & self.page_mask
+        if offset + length > self.page_size:
+            return None
+        return self.read_pages[page][offset:offset + length]
@@ -0,0 +1,196 @@
+'''
+Guest code profiling, used by Z80.run(profiler=Profiler()).
+
+For each instruction the profiler counts executions and T-states by the address it
+was fetched from, in two 64K array('L') histograms, and by mnemonic
+(Instruction.instruction_base). With interval N about one instruction in N is counted,
+weighted by the number of instructions since the previous sample, so the figures are
+estimates that cost less to collect. The gap between samples is drawn at random
+between 1 and 2N - 1, so a loop whose length divides N is not always sampled at the
+same instruction. seed makes the choice repeatable.
+
+Calls are followed whatever the interval: a taken call or rst (the instructions run by
+call_execute and restart_execute) or an accepted interrupt enters a subroutine at its
+target, and a ret, reti or retn that moves the stack pointer above the stack pointer a
+subroutine was entered with leaves it. Code that discards return addresses without
+ret is unwound the same way by the next ret. Each subroutine gets its calls, its
+exclusive T-states (spent in its own instructions) and its inclusive T-states (from
+entry to return, counted once for recursive calls). T-states are also summed by call
+stack, and folded_stacks gives them in the "root;8000;8123 1234" form flamegraph.pl
+reads. symbols can name addresses, otherwise they are shown in hex.
+
+Profiled runs always use the interpreter. Time spent halted is not counted.
+'''
+import random
+from array import array
+
+from instructions import CALL, RESTART, RETURN, RETURN_NMI, RETURN_INTERRUPT
+
+PROFILE_SIZE = 256 * 256
+ROOT_NAME = "root"
+RETURN_INSTRUCTIONS = {RETURN, RETURN_NMI, RETURN_INTERRUPT}
+# Stack pointer of the root frame, above any real one so it is never left
+ROOT_STACK_POINTER = PROFILE_SIZE
+
+
+class Frame:
+
+    def __init__(self, target, stack_pointer, start_tstates):
+        self.target = target
+        self.stack_pointer = stack_pointer
+        self.start_tstates = start_tstates
+
+
+class Profiler:
+
+    def __init__(self, interval=1, symbols=None, seed=None):
+        '''
+        interval is the mean number of instructions per sample. symbols is an optional
+        {address: name} dict.
+        '''
+        if interval < 1:
+            raise Exception("Profiler interval must be at least 1!!! interval: {}".format(interval))
+        self.interval = interval
+        self.symbols = symbols or {}
+        self.counts = array("L", bytes(array("L").itemsize * PROFILE_SIZE))
+        self.tstates = array("L", bytes(array("L").itemsize * PROFILE_SIZE))
+        self.mnemonic_counts = {}
+        self.mnemonic_tstates = {}
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.stacks = {}
+        self.frames = [Frame(None, ROOT_STACK_POINTER, 0)]
+        self.stack_key = (None,)
+        # Number of frames of each target, so recursion is only counted once
+        self.active = {None: 1}
+        self.random = random.Random(seed)
+        self.gap = self.next_gap()
+        self.countdown = self.gap
+        self.last_tstates = 0
+
+    def next_gap(self):
+        return self.random.randint(1, 2 * self.interval - 1)
+
+    def record(self, z80, pc, instruction, tstates):
+        '''
+        Called by Z80.run after each instruction with the address it was fetched from
+        and the T-states it took. DDCB and FDCB instructions are given as the
+        instruction they stand for (see Z80.indexed_bit_instruction).
+        '''
+        self.countdown -= 1
+        if self.countdown == 0:
+            self.sample(pc, instruction, tstates * self.gap, self.gap)
+            self.gap = self.next_gap()
+            self.countdown = self.gap
+        base = instruction.instruction_base
+        if base == CALL:
+            # A call does not change the flags, so its condition still holds if it did
+            if instruction.right_arg is None or z80.check_flag_arg(instruction.left_arg):
+                self.enter(z80, z80.program_counter.get_contents())
+        elif base == RESTART:
+            self.enter(z80, z80.program_counter.get_contents())
+        elif base in RETURN_INSTRUCTIONS:
+            self.leave(z80)
+
+    def sample(self, pc, instruction, tstates, weight):
+        self.counts[pc] += weight
+        self.tstates[pc] += tstates
+        base = instruction.instruction_base
+        self.mnemonic_counts[base] = self.mnemonic_counts.get(base, 0) + weight
+        self.mnemonic_tstates[base] = self.mnemonic_tstates.get(base, 0) + tstates
+        target = self.frames[-1].target
+        self.exclusive[target] = self.exclusive.get(target, 0) + tstates
+        self.stacks[self.stack_key] = self.stacks.get(self.stack_key, 0) + tstates
+
+    def enter(self, z80, target):
+        '''
+        Enters the subroutine at target, whose return address has just been pushed
+        '''
+        self.frames.append(Frame(target, z80.stack_pointer.get_contents(), z80.tstates))
+        self.stack_key += (target,)
+        self.calls[target] = self.calls.get(target, 0) + 1
+        self.active[target] = self.active.get(target, 0) + 1
+
+    def leave(self, z80):
+        '''
+        Leaves every subroutine whose return address is now off the stack
+        '''
+        stack_pointer = z80.stack_pointer.get_contents()
+        while self.frames[-1].stack_pointer < stack_pointer:
+            frame = self.frames.pop()
+            self.stack_key = self.stack_key[:-1]
+            self.active[frame.target] -= 1
+            if not self.active[frame.target]:
+                self.inclusive[frame.target] = self.inclusive.get(frame.target, 0) + z80.tstates - frame.start_tstates
+
+    def name(self, address):
+        if address is None:
+            return ROOT_NAME
+        return self.symbols.get(address, "{:04x}".format(address))
+
+    def hot_spots(self, count=None):
+        '''
+        [(address, executions, T-states)] of the addresses that took the most T-states
+        '''
+        spots = [(pc, self.counts[pc], self.tstates[pc]) for pc in range(PROFILE_SIZE) if self.counts[pc]]
+        spots.sort(key=lambda e: (-e[2], e[0]))
+        return spots[:count]
+
+    def mnemonics(self):
+        '''
+        [(instruction base, executions, T-states)], most T-states first
+        '''
+        totals = [(base, count, self.mnemonic_tstates[base]) for base, count in self.mnemonic_counts.items()]
+        totals.sort(key=lambda e: (-e[2], e[0]))
+        return totals
+
+    def subroutines(self):
+        '''
+        [(target, calls, inclusive T-states, exclusive T-states)], most inclusive
+        T-states first. Subroutines still running count up to the end of the last run.
+        '''
+        inclusive = dict(self.inclusive)
+        seen = set()
+        for frame in self.frames[1:]:
+            # The outermost frame of a recursive subroutine covers the others
+            if frame.target not in seen:
+                seen.add(frame.target)
+                inclusive[frame.target] = inclusive.get(frame.target, 0) + self.last_tstates - frame.start_tstates
+        totals = [
+            (target, calls, inclusive.get(target, 0), self.exclusive.get(target, 0))
+            for target, calls in self.calls.items()
+        ]
+        totals.sort(key=lambda e: (-e[2], e[0]))
+        return totals
+
+    def folded_stacks(self):
+        '''
+        Lines of "frame;frame;... T-states", outermost frame first
+        '''
+        return [
+            "{} {}".format(";".join(self.name(target) for target in key), tstates)
+            for key, tstates in sorted(self.stacks.items(), key=lambda e: [self.name(t) for t in e[0]])
+        ]
+
+    def write_folded(self, path):
+        with open(path, "w") as f:
+            for line in self.folded_stacks():
+                f.write(line + "\n")
+
+    def report(self, count=20):
+        '''
+        Text tables of the hot spots, mnemonics and subroutines
+        '''
+        lines = ["{:<8} {:>10} {:>12}".format("address", "count", "tstates")]
+        for pc, executions, tstates in self.hot_spots(count):
+            lines.append("{:<8} {:>10} {:>12}".format(self.name(pc), executions, tstates))
+        lines.append("")
+        lines.append("{:<8} {:>10} {:>12}".format("mnemonic", "count", "tstates"))
+        for base, executions, tstates in self.mnemonics()[:count]:
+            lines.append("{:<8} {:>10} {:>12}".format(base, executions, tstates))
+        lines.append("")
+        lines.append("{:<8} {:>10} {:>12} {:>12}".format("routine", "calls", "inclusive", "exclusive"))
+        for target, calls, inclusive, exclusive in self.subroutines()[:count]:
+            lines.append("{:<8} {:>10} {:>12} {:>12}".format(self.name(target), calls, inclusive, exclusive))
+        return "\n".join(lines)
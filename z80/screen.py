@@ -0,0 +1,186 @@
+'''
+ZX Spectrum screen rendering with NumPy, without pygame so it can run headless.
+
+The screen is the 6912 bytes from 0x4000: a 6144 byte bitmap of 256x192 pixels, one
+bit per pixel, followed by 768 attribute bytes, one per 8x8 character cell. Bitmap
+rows are interleaved: row y is at ((y & 0xC0) << 5) | ((y & 0x07) << 8) |
+((y & 0x38) << 2). Each attribute holds the ink (bits 0-2) and paper (bits 3-5)
+colours, BRIGHT (bit 6) and FLASH (bit 7), which swaps ink and paper every
+FLASH_FRAMES frames.
+
+Rendering gathers the bitmap rows into screen order with ROW_OFFSETS, expands each
+byte to 8 pixels with BIT_TABLE and picks each pixel's colour from the ink and paper
+tables, so no Python code runs per pixel or per byte. Frames are (192, 256, 3) uint8
+RGB arrays.
+
+ScreenRenderer keeps a frame up to date incrementally: it listens for writes to the
+screen and only re-renders the 8x8 cells that changed since the last frame.
+
+Needs numpy.
+'''
+import numpy as np
+
+SCREEN_START = 0x4000
+BITMAP_LENGTH = 6144
+ATTRIBUTES_START = SCREEN_START + BITMAP_LENGTH
+ATTRIBUTES_LENGTH = 768
+SCREEN_LENGTH = BITMAP_LENGTH + ATTRIBUTES_LENGTH
+SCREEN_END = SCREEN_START + SCREEN_LENGTH
+
+SCREEN_WIDTH = 256
+SCREEN_HEIGHT = 192
+COLUMNS = SCREEN_WIDTH // 8
+ROWS = SCREEN_HEIGHT // 8
+CELL_SIZE = 8
+CELL_COUNT = ROWS * COLUMNS
+
+FLASH_FRAMES = 16
+
+# Normal colours 0-7 then BRIGHT colours 8-15
+PALETTE = np.array([
+    (0x00, 0x00, 0x00), (0x00, 0x00, 0xD7), (0xD7, 0x00, 0x00), (0xD7, 0x00, 0xD7),
+    (0x00, 0xD7, 0x00), (0x00, 0xD7, 0xD7), (0xD7, 0xD7, 0x00), (0xD7, 0xD7, 0xD7),
+    (0x00, 0x00, 0x00), (0x00, 0x00, 0xFF), (0xFF, 0x00, 0x00), (0xFF, 0x00, 0xFF),
+    (0x00, 0xFF, 0x00), (0x00, 0xFF, 0xFF), (0xFF, 0xFF, 0x00), (0xFF, 0xFF, 0xFF),
+], dtype=np.uint8)
+
+# Offset in the bitmap of each pixel row
+ROW_OFFSETS = np.array(
+    [((y & 0xC0) << 5) | ((y & 0x07) << 8) | ((y & 0x38) << 2) for y in range(SCREEN_HEIGHT)],
+    dtype=np.intp,
+)
+# Offset in the bitmap of each byte, in screen order
+BITMAP_INDEX = ROW_OFFSETS[:, None] + np.arange(COLUMNS, dtype=np.intp)
+# Offset in the bitmap of each of the 8 bytes of each cell, top first
+CELL_BITMAP_INDEX = BITMAP_INDEX.reshape(ROWS, CELL_SIZE, COLUMNS).transpose(0, 2, 1).reshape(CELL_COUNT, CELL_SIZE)
+# The cell each screen byte (bitmap then attributes) belongs to
+CELL_OF_OFFSET = np.empty(SCREEN_LENGTH, dtype=np.intp)
+CELL_OF_OFFSET[CELL_BITMAP_INDEX] = np.arange(CELL_COUNT)[:, None]
+CELL_OF_OFFSET[BITMAP_LENGTH:] = np.arange(CELL_COUNT)
+# The 8 pixels of each byte value, leftmost first
+BIT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).astype(bool)
+
+
+def attribute_tables():
+    '''
+    Palette indexes of the ink and paper of each attribute value, for each flash
+    phase: ink[phase][attribute], paper[phase][attribute]
+    '''
+    attributes = np.arange(256)
+    bright = (attributes & 0x40) >> 3
+    ink = (attributes & 0x07) | bright
+    paper = ((attributes >> 3) & 0x07) | bright
+    flash = (attributes & 0x80) != 0
+    inks = np.array([ink, np.where(flash, paper, ink)], dtype=np.uint8)
+    papers = np.array([paper, np.where(flash, ink, paper)], dtype=np.uint8)
+    return inks, papers
+
+
+INK_TABLE, PAPER_TABLE = attribute_tables()
+
+
+def flash_phase(frame):
+    '''
+    1 if FLASH cells show swapped ink and paper in this frame, else 0
+    '''
+    return (frame // FLASH_FRAMES) & 1
+
+
+def screen_bytes(memory):
+    '''
+    The screen bytes of a Memory, without copying where the memory allows it
+    '''
+    view = memory.block_view(SCREEN_START, SCREEN_LENGTH)
+    if view is None:
+        return memory.read_block(SCREEN_START, SCREEN_LENGTH)
+    return view
+
+
+def render(data, flash=0, out=None):
+    '''
+    RGB frame of 6912 screen bytes (a .scr file, or memory from 0x4000). flash is the
+    flash phase (see flash_phase). out is an optional (192, 256, 3) uint8 array to
+    render into.
+    '''
+    screen = np.frombuffer(data, dtype=np.uint8, count=SCREEN_LENGTH)
+    bitmap = screen[BITMAP_INDEX]
+    attributes = screen[BITMAP_LENGTH:].reshape(ROWS, COLUMNS)
+    ink = np.repeat(INK_TABLE[flash][attributes], CELL_SIZE, axis=0)
+    paper = np.repeat(PAPER_TABLE[flash][attributes], CELL_SIZE, axis=0)
+    colours = np.where(BIT_TABLE[bitmap], ink[:, :, None], paper[:, :, None])
+    if out is None:
+        out = np.empty((SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+    np.take(PALETTE, colours.reshape(SCREEN_HEIGHT, SCREEN_WIDTH), axis=0, out=out)
+    return out
+
+
+def render_memory(memory, flash=0, out=None):
+    '''
+    RGB frame of the screen in a Memory, such as Z80.memory
+    '''
+    return render(screen_bytes(memory), flash, out)
+
+
+class ScreenRenderer:
+    '''
+    Renders the screen in memory into a persistent frame, only redrawing the cells
+    written since the last render. A write to a bitmap byte or an attribute dirties its
+    cell; a change of flash phase dirties the flashing cells. When more than
+    full_render_cells cells are dirty the whole frame is rendered instead.
+
+    The renderer is a write listener of the memory, so it sees writes made by the Z80,
+    Memory.load, bank switching and Z80.restore. Call close to stop listening.
+    '''
+
+    def __init__(self, memory, full_render_cells=CELL_COUNT // 4):
+        self.memory = memory
+        self.full_render_cells = full_render_cells
+        self.frame = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+        # The frame as (row, column, cell line, cell pixel, RGB), sharing its data
+        self.cells = self.frame.reshape(ROWS, CELL_SIZE, COLUMNS, CELL_SIZE, 3).transpose(0, 2, 1, 3, 4)
+        # One flag per cell; a bytearray is cheapest to set from a single byte write
+        self.dirty = bytearray(b"\x01" * CELL_COUNT)
+        self.dirty_view = np.frombuffer(self.dirty, dtype=np.uint8)
+        self.cell_of_offset = CELL_OF_OFFSET.tolist()
+        self.flash = 0
+        memory.add_write_listener(self.memory_written)
+
+    def close(self):
+        self.memory.remove_write_listener(self.memory_written)
+
+    def memory_written(self, start, length):
+        if length == 1:
+            if SCREEN_START <= start < SCREEN_END:
+                self.dirty[self.cell_of_offset[start - SCREEN_START]] = 1
+            return
+        first = max(start, SCREEN_START)
+        end = min(start + length, SCREEN_END)
+        if first < end:
+            self.dirty_view[CELL_OF_OFFSET[first - SCREEN_START:end - SCREEN_START]] = 1
+
+    def dirty_cells(self):
+        '''
+        Indexes (row * 32 + column) of the cells to redraw on the next render
+        '''
+        return np.flatnonzero(self.dirty_view)
+
+    def render(self, flash=0):
+        '''
+        Brings self.frame up to date for the flash phase (see flash_phase) and returns it
+        '''
+        data = screen_bytes(self.memory)
+        screen = np.frombuffer(data, dtype=np.uint8, count=SCREEN_LENGTH)
+        if flash != self.flash:
+            self.flash = flash
+            self.dirty_view[screen[BITMAP_LENGTH:] >= 0x80] = 1
+        cells = self.dirty_cells()
+        if len(cells) > self.full_render_cells:
+            render(data, flash, self.frame)
+        elif len(cells):
+            attributes = screen[BITMAP_LENGTH + cells]
+            ink = INK_TABLE[flash][attributes][:, None, None]
+            paper = PAPER_TABLE[flash][attributes][:, None, None]
+            colours = np.where(BIT_TABLE[screen[CELL_BITMAP_INDEX[cells]]], ink, paper)
+            self.cells[cells // COLUMNS, cells % COLUMNS] = PALETTE[colours]
+        self.dirty_view[:] = 0
+        return self.frame
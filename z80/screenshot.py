@@ -0,0 +1,135 @@
+'''
+Converts every .sna and .scr snapshot in a directory to a PNG of its screen, run from
+this directory:
+
+    python screenshot.py DIR OUT [--workers N]
+
+Files are shared out across a process pool. Each worker reads the screen bytes
+straight from the file (a .scr file is the 6912 screen bytes, a .sna file has them
+after its header), renders them with screen.render and writes the PNG with
+encode_png, which only needs zlib. The number of images per second is printed at the
+end.
+'''
+import argparse
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from screen import render, SCREEN_LENGTH
+from snapshot import SNA_HEADER, SNA_LENGTH
+
+SNAPSHOT_EXTENSIONS = [".sna", ".scr"]
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Width, height, bit depth, colour type (2 is RGB), compression, filter, interlace
+PNG_IHDR = struct.Struct(">IIBBBBB")
+PNG_RGB = 2
+PNG_COMPRESSION_LEVEL = 6
+# Snapshots each worker is sent at a time
+CHUNK_SIZE = 16
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(frame, level=PNG_COMPRESSION_LEVEL):
+    '''
+    PNG file bytes of a (height, width, 3) uint8 RGB array
+    '''
+    height, width, _ = frame.shape
+    rows = frame.reshape(height, width * 3)
+    # Each row starts with its filter type, 0 for none
+    raw = b"".join(b"\x00" + row.tobytes() for row in rows)
+    return b"".join([
+        PNG_SIGNATURE,
+        png_chunk(b"IHDR", PNG_IHDR.pack(width, height, 8, PNG_RGB, 0, 0, 0)),
+        png_chunk(b"IDAT", zlib.compress(raw, level)),
+        png_chunk(b"IEND", b""),
+    ])
+
+
+def read_screen(path):
+    '''
+    The 6912 screen bytes of a .sna or .scr file
+    '''
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.lower().endswith(".scr"):
+        if len(data) != SCREEN_LENGTH:
+            raise Exception("Not a .scr file!!! path: {}, length: {}".format(path, len(data)))
+        return data
+    # 128K .sna files start with the same header and 48K of RAM
+    if len(data) < SNA_LENGTH:
+        raise Exception("Not a .sna file!!! path: {}, length: {}".format(path, len(data)))
+    return data[SNA_HEADER.size:SNA_HEADER.size + SCREEN_LENGTH]
+
+
+def screenshot(path, out_dir):
+    '''
+    Writes the screen of the snapshot at path to a PNG of the same name in out_dir,
+    returning the PNG's path
+    '''
+    name = os.path.splitext(os.path.basename(path))[0] + ".png"
+    out_path = os.path.join(out_dir, name)
+    data = encode_png(render(read_screen(path)))
+    with open(out_path, "wb") as f:
+        f.write(data)
+    return out_path
+
+
+def screenshot_job(job):
+    '''
+    screenshot for the process pool: returns (path, error message or None) so one bad
+    file does not stop the batch
+    '''
+    path, out_dir = job
+    try:
+        screenshot(path, out_dir)
+    except Exception as e:
+        return path, str(e)
+    return path, None
+
+
+def snapshot_paths(directory):
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SNAPSHOT_EXTENSIONS:
+            yield entry.path
+
+
+def screenshot_directory(directory, out_dir, workers=None):
+    '''
+    Converts every snapshot in directory, returning (images written, errors as
+    (path, message), seconds taken)
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    count = 0
+    errors = []
+    jobs = ((path, out_dir) for path in snapshot_paths(directory))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path, error in executor.map(screenshot_job, jobs, chunksize=CHUNK_SIZE):
+            if error is None:
+                count += 1
+            else:
+                errors.append((path, error))
+    return count, errors, time.perf_counter() - start
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Write a PNG of the screen of each .sna and .scr file in a directory")
+    parser.add_argument("directory")
+    parser.add_argument("out_dir")
+    parser.add_argument("--workers", type=int, default=None, help="processes to use, by default one per CPU")
+    args = parser.parse_args(args)
+    count, errors, seconds = screenshot_directory(args.directory, args.out_dir, args.workers)
+    for path, error in errors:
+        print("{}: {}".format(path, error), file=sys.stderr)
+    print("{} images in {:.2f} s, {:.1f} images/s".format(count, seconds, count / seconds if seconds else 0))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
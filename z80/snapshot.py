@@ -0,0 +1,313 @@
+'''
+Snapshot files, used by Z80.load_sna, Z80.save_sna and Z80.from_sna.
+
+A 48K .sna file is a 27 byte header of registers followed by the 48K of RAM from
+16384. The program counter is not in the header: it is on the stack, as if an
+interrupt had just pushed it, and loading pops it. The RAM is read straight into the
+memory buffer with readinto.
+
+A .z80 file (Z80.load_z80, Z80.save_z80) is a 30 byte header, then for version 1 the
+48K of RAM, or for versions 2 and 3 an extended header and 16K memory pages. Memory is
+usually compressed by replacing runs with ED ED count byte. Decompression goes
+straight into the memory buffer: literal stretches between runs are found with
+bytes.find and copied as slices, and runs are filled as slices. 128K snapshots need a
+paging.PagedMemory with RAM banks 0-7 as its first 8 banks.
+'''
+import re
+import struct
+
+# I, HL', DE', BC', AF', HL, DE, BC, IY, IX, interrupt flags, R, AF, SP, IM, border
+SNA_HEADER = struct.Struct("<BHHHHHHHHHBBHHBB")
+SNA_RAM_START = 16384
+SNA_RAM_LENGTH = 48 * 1024
+SNA_LENGTH = SNA_HEADER.size + SNA_RAM_LENGTH
+# Bit of the interrupt flags byte holding IFF2
+SNA_IFF2_MASK = 0x04
+
+SNA_WORD_REGISTERS = ["HL'", "DE'", "BC'", "AF'", "HL", "DE", "BC", "IY", "IX"]
+
+
+def load_sna(z80, path):
+    '''
+    Restores z80 from a 48K .sna file, returning the border colour
+    '''
+    with open(path, "rb") as f:
+        header = f.read(SNA_HEADER.size)
+        if len(header) != SNA_HEADER.size:
+            raise Exception("Snapshot too short!!! path: {}".format(path))
+        if z80.memory.load_file(f, SNA_RAM_START, SNA_RAM_LENGTH) != SNA_RAM_LENGTH or f.read(1):
+            raise Exception("Only 48K .sna snapshots are supported!!! path: {}".format(path))
+    fields = SNA_HEADER.unpack(header)
+    z80.I.set_contents(fields[0])
+    for name, value in zip(SNA_WORD_REGISTERS, fields[1:10]):
+        z80.registers_by_name[name].set_contents_value(value)
+    interrupt_flags, r, af, sp, interrupt_mode, border = fields[10:]
+    z80.IFF2 = 1 if interrupt_flags & SNA_IFF2_MASK else 0
+    z80.IFF1 = z80.IFF2
+    z80.R.set_contents(r)
+    z80.AF.set_contents_value(af)
+    z80.stack_pointer.set_contents_value(sp)
+    z80.interrupt_mode = interrupt_mode
+    z80.halted = False
+    z80.pop_execute(None, z80.program_counter)
+    return border
+
+
+def save_sna(z80, path, border=0):
+    '''
+    Writes z80 to a 48K .sna file. As the format requires, the program counter is
+    pushed onto the stack in the file; z80 itself is not changed.
+    '''
+    sp = (z80.stack_pointer.get_contents() - 2) & 0xFFFF
+    fields = [z80.I.get_contents()]
+    fields += [z80.registers_by_name[name].get_contents() for name in SNA_WORD_REGISTERS]
+    fields += [
+        SNA_IFF2_MASK if z80.IFF2 else 0,
+        z80.R.get_contents(),
+        z80.AF.get_contents(),
+        sp,
+        z80.interrupt_mode,
+        border,
+    ]
+    ram = bytearray(z80.memory.read_block(SNA_RAM_START, SNA_RAM_LENGTH))
+    pc = z80.program_counter.get_contents()
+    for address, value in [(sp, pc & 0xFF), ((sp + 1) & 0xFFFF, pc >> 8)]:
+        if address >= SNA_RAM_START:
+            ram[address - SNA_RAM_START] = value
+    with open(path, "wb") as f:
+        f.write(SNA_HEADER.pack(*fields))
+        f.write(ram)
+
+
+# A, F, BC, HL, PC, SP, I, R, flags, DE, BC', DE', HL', A', F', IY, IX, IFF1, IFF2, IM flags
+Z80_HEADER = struct.Struct("<BBHHHHBBBHHHHBBHHBBB")
+# Extended header length, PC, hardware mode, last out to port 7FFD
+Z80_EXTENDED_HEADER = struct.Struct("<HHBB")
+Z80_V2_EXTENDED_LENGTH = 23
+Z80_V3_EXTENDED_LENGTH = 54
+Z80_BLOCK_HEADER = struct.Struct("<HB")
+# Block length meaning an uncompressed 16K page (version 3)
+Z80_UNCOMPRESSED_BLOCK = 0xFFFF
+Z80_PAGE_LENGTH = 16 * 1024
+Z80_V1_RAM_START = 0x4000
+Z80_V1_RAM_LENGTH = 48 * 1024
+Z80_COMPRESSED_FLAG = 0x20
+RUN_MARKER = b"\xed\xed"
+RUN_MARKER_BYTE = 0xED
+MAX_RUN = 255
+# Runs shorter than this are cheaper as literals, except runs of ED
+MIN_RUN = 5
+RUN_PATTERN = re.compile(b"\xed{2,}|(.)\\1{4,}", re.S)
+
+# Page numbers of the 48K RAM in version 2 and 3 files
+Z80_48K_PAGES = {8: 0x4000, 4: 0x8000, 5: 0xC000}
+# 128K RAM bank n is page n + 3
+Z80_128K_FIRST_RAM_PAGE = 3
+Z80_128K_BANKS = 8
+Z80_V2_128K_MODE = 3
+Z80_V3_128K_MODE = 4
+PORT_7FFD_BANK_MASK = 0x07
+
+Z80_WORD_REGISTERS = ["DE", "BC'", "DE'", "HL'"]
+
+
+def decompress_into(data, view, position=0):
+    '''
+    Expands ED ED count byte runs from data (bytes), starting at position, into view
+    until view is full. Returns the position after the last byte used.
+    '''
+    source = memoryview(data)
+    written = 0
+    length = len(view)
+    while written < length:
+        marker = data.find(RUN_MARKER, position)
+        if marker == -1:
+            marker = len(data)
+        literal = min(marker - position, length - written)
+        view[written:written + literal] = source[position:position + literal]
+        written += literal
+        position += literal
+        if written == length:
+            break
+        if marker + 4 > len(data):
+            raise Exception("Compressed data ends early!!! written: {}, expected: {}".format(written, length))
+        count = data[marker + 2]
+        if written + count > length:
+            raise Exception("Compressed run overflows memory!!! written: {}, run: {}".format(written, count))
+        view[written:written + count] = bytes((data[marker + 3],)) * count
+        written += count
+        position = marker + 4
+    return position
+
+
+def compress(data):
+    '''
+    Compresses data (bytes) with ED ED count byte runs. A byte following a single ED is
+    never the start of a run, so the output decompresses unambiguously.
+    '''
+    out = bytearray()
+    position = 0
+    lone_ed = False
+    for match in RUN_PATTERN.finditer(data):
+        start, end = match.span()
+        if start > position:
+            out += data[position:start]
+            lone_ed = data[start - 1] == RUN_MARKER_BYTE
+        value = data[start]
+        if lone_ed:
+            out.append(value)
+            start += 1
+        while start < end:
+            count = min(end - start, MAX_RUN)
+            if count >= MIN_RUN or (value == RUN_MARKER_BYTE and count > 1):
+                out += RUN_MARKER
+                out.append(count)
+                out.append(value)
+                lone_ed = False
+            else:
+                out += data[start:start + count]
+                lone_ed = value == RUN_MARKER_BYTE
+            start += count
+        position = end
+    out += data[position:]
+    return bytes(out)
+
+
+def load_z80(z80, path):
+    '''
+    Restores z80 from a version 1, 2 or 3 .z80 file, returning the border colour
+    '''
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < Z80_HEADER.size:
+        raise Exception("Snapshot too short!!! path: {}".format(path))
+    fields = Z80_HEADER.unpack_from(data)
+    a, f_register, bc, hl, pc, sp, i, r, flags, _, _, _, _, a_alt, f_alt, iy, ix, iff1, iff2, im_flags = fields
+    if flags == 0xFF:
+        flags = 1
+    position = Z80_HEADER.size
+    if pc:
+        load_z80_v1_ram(z80, data, position, flags & Z80_COMPRESSED_FLAG)
+    else:
+        extended_length, pc, mode, port_7ffd = Z80_EXTENDED_HEADER.unpack_from(data, position)
+        position += 2 + extended_length
+        if extended_length == Z80_V2_EXTENDED_LENGTH:
+            is_128k = mode >= Z80_V2_128K_MODE
+        else:
+            is_128k = mode >= Z80_V3_128K_MODE
+        load_z80_pages(z80, data, position, is_128k)
+        if is_128k:
+            memory = z80.memory
+            memory.map_bank(1, 5)
+            memory.map_bank(2, 2)
+            memory.map_bank(3, port_7ffd & PORT_7FFD_BANK_MASK)
+    z80.A.set_contents(a)
+    z80.F.set_contents(f_register)
+    z80.BC.set_contents_value(bc)
+    z80.HL.set_contents_value(hl)
+    for name, value in zip(Z80_WORD_REGISTERS, fields[9:13]):
+        z80.registers_by_name[name].set_contents_value(value)
+    z80.A_ALT.set_contents(a_alt)
+    z80.F_ALT.set_contents(f_alt)
+    z80.IY.set_contents_value(iy)
+    z80.IX.set_contents_value(ix)
+    z80.program_counter.set_contents_value(pc)
+    z80.stack_pointer.set_contents_value(sp)
+    z80.I.set_contents(i)
+    z80.R.set_contents((r & 0x7F) | ((flags & 1) << 7))
+    z80.IFF1 = 1 if iff1 else 0
+    z80.IFF2 = 1 if iff2 else 0
+    z80.interrupt_mode = im_flags & 0x03
+    z80.halted = False
+    return (flags >> 1) & 0x07
+
+
+def load_z80_v1_ram(z80, data, position, compressed):
+    memory = z80.memory
+    view = memory.block_view(Z80_V1_RAM_START, Z80_V1_RAM_LENGTH)
+    # Memory that is not contiguous (paged, copy-on-write) is filled through a buffer
+    buffer = None if view is not None else bytearray(Z80_V1_RAM_LENGTH)
+    if buffer is not None:
+        view = memoryview(buffer)
+    if compressed:
+        decompress_into(data, view, position)
+    else:
+        view[:] = memoryview(data)[position:position + Z80_V1_RAM_LENGTH]
+    if buffer is not None:
+        memory.load(buffer, Z80_V1_RAM_START)
+    else:
+        memory.written(Z80_V1_RAM_START, Z80_V1_RAM_LENGTH)
+
+
+def load_z80_pages(z80, data, position, is_128k):
+    memory = z80.memory
+    if is_128k and len(getattr(memory, "banks", [])) < Z80_128K_BANKS:
+        raise Exception("128K snapshots need a PagedMemory with at least {} banks!!!".format(Z80_128K_BANKS))
+    while position < len(data):
+        length, page = Z80_BLOCK_HEADER.unpack_from(data, position)
+        position += Z80_BLOCK_HEADER.size
+        buffer = None
+        if is_128k:
+            bank = page - Z80_128K_FIRST_RAM_PAGE
+            if not 0 <= bank < Z80_128K_BANKS:
+                raise Exception("Unsupported .z80 page!!! page: {}".format(page))
+            view = memory.banks[bank]
+        else:
+            if page not in Z80_48K_PAGES:
+                raise Exception("Unsupported .z80 page!!! page: {}".format(page))
+            view = memory.block_view(Z80_48K_PAGES[page], Z80_PAGE_LENGTH)
+            if view is None:
+                buffer = bytearray(Z80_PAGE_LENGTH)
+                view = memoryview(buffer)
+        if length == Z80_UNCOMPRESSED_BLOCK:
+            view[:] = memoryview(data)[position:position + Z80_PAGE_LENGTH]
+            length = Z80_PAGE_LENGTH
+        else:
+            decompress_into(data, view, position)
+        position += length
+        if is_128k:
+            memory.bank_written(bank, 0, Z80_PAGE_LENGTH)
+        elif buffer is not None:
+            memory.load(buffer, Z80_48K_PAGES[page])
+        else:
+            memory.written(Z80_48K_PAGES[page], Z80_PAGE_LENGTH)
+
+
+def save_z80(z80, path, border=0):
+    '''
+    Writes z80 to a version 3 .z80 file with compressed pages. With a PagedMemory of 8
+    or more banks it is saved as a 128K machine, with the bank at 0C000h as the last
+    out to port 7FFD.
+    '''
+    memory = z80.memory
+    is_128k = len(getattr(memory, "banks", [])) >= Z80_128K_BANKS
+    r = z80.R.get_contents()
+    header = Z80_HEADER.pack(
+        z80.A.get_contents(), z80.F.get_contents(), z80.BC.get_contents(), z80.HL.get_contents(),
+        0, z80.stack_pointer.get_contents(), z80.I.get_contents(), r & 0x7F,
+        (r >> 7) | ((border & 0x07) << 1),
+        *[z80.registers_by_name[name].get_contents() for name in Z80_WORD_REGISTERS],
+        z80.A_ALT.get_contents(), z80.F_ALT.get_contents(), z80.IY.get_contents(), z80.IX.get_contents(),
+        z80.IFF1, z80.IFF2, z80.interrupt_mode,
+    )
+    if is_128k:
+        mode = Z80_V3_128K_MODE
+        port_7ffd = memory.page_banks[3] & PORT_7FFD_BANK_MASK
+        pages = [(bank + Z80_128K_FIRST_RAM_PAGE, memory.banks[bank]) for bank in range(Z80_128K_BANKS)]
+    else:
+        mode = 0
+        port_7ffd = 0
+        pages = [(page, memory.read_block(address, Z80_PAGE_LENGTH)) for page, address in Z80_48K_PAGES.items()]
+    extended_header = Z80_EXTENDED_HEADER.pack(Z80_V3_EXTENDED_LENGTH, z80.program_counter.get_contents(), mode, port_7ffd)
+    extended_header += bytes(Z80_V3_EXTENDED_LENGTH + 2 - len(extended_header))
+    with open(path, "wb") as f:
+        f.write(header)
+        f.write(extended_header)
+        for page, contents in pages:
+            compressed = compress(bytes(contents))
+            if len(compressed) >= Z80_PAGE_LENGTH:
+                f.write(Z80_BLOCK_HEADER.pack(Z80_UNCOMPRESSED_BLOCK, page))
+                f.write(contents)
+            else:
+                f.write(Z80_BLOCK_HEADER.pack(len(compressed), page))
+                f.write(compressed)
@@ -0,0 +1,56 @@
+from base import Component, FLAG_POSITIONS
+from alu import (
+    ADD_TABLE, SUB_TABLE, INC_TABLE, DEC_TABLE, LOGIC_FLAGS_TABLE, alu_index, compile_flag_template
+)
+
+
+class Dec:
+    instruction_base = "dec"
+
+
+def component_entry(a, value, subtract, instruction=False):
+    register = Component("A")
+    register.set_contents(a)
+    if subtract:
+        register.subtraction_with_flags(value)
+    else:
+        register.addition_with_flags(value)
+    register.set_potential_flags(instruction=instruction)
+    flags = 0
+    for flag, position in FLAG_POSITIONS.items():
+        if register.potential_flags[flag]:
+            flags |= 1 << position
+    return (flags << 8) | register.get_contents()
+
+
+def test_add_and_sub_tables_match_component():
+    for carry in range(2):
+        for a in range(256):
+            for operand in range(256):
+                index = alu_index(carry, a, operand)
+                assert ADD_TABLE[index] == component_entry(a, operand + carry, subtract=False)
+                assert SUB_TABLE[index] == component_entry(a, operand + carry, subtract=True)
+
+
+def test_inc_and_dec_tables_match_component():
+    for a in range(256):
+        assert INC_TABLE[a] == component_entry(a, 1, subtract=False)
+        assert DEC_TABLE[a] == component_entry(a, 1, subtract=True, instruction=Dec())
+
+
+def test_logic_flags_table():
+    register = Component("A")
+    for result in range(256):
+        register.set_contents(result)
+        register.set_potential_flags()
+        assert (LOGIC_FLAGS_TABLE[result] >> 7) & 1 == register.potential_flags["S"]
+        assert (LOGIC_FLAGS_TABLE[result] >> 6) & 1 == register.potential_flags["Z"]
+        assert (LOGIC_FLAGS_TABLE[result] >> 2) & 1 == register.potential_flags["parity"]
+
+
+def test_compile_flag_template():
+    assert compile_flag_template("------") == (0xFF, 0, 0)
+    assert compile_flag_template("++V+++") == (0b00101000, 0b11010111, 0)
+    assert compile_flag_template("00P1++") == (0b00101000, 0b11000100, 0b00010000)
+    assert compile_flag_template("-+V+++") == (0b00101001, 0b11010110, 0)
+    assert compile_flag_template("-1*+++") is None
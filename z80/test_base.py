@@ -2,7 +2,7 @@ import pytest
 
 from z80 import Z80
 from base import (
-    Component, Memory, DoubleComponent, SIGN_FLAG, ZERO_FLAG, HALF_CARRY_FLAG, PARITY_OVERFLOW_FLAG, ADD_SUBTRACT_FLAG, CARRY_FLAG,
+    Component, Memory, IOBus, DoubleComponent, SIGN_FLAG, ZERO_FLAG, HALF_CARRY_FLAG, PARITY_OVERFLOW_FLAG, ADD_SUBTRACT_FLAG, CARRY_FLAG,
     FLAG_POSITIONS
 )
 
@@ -165,3 +165,136 @@ def test_set_bit_position():
     register.set_contents(0)
     register.set_bit_position(7, 1)
     assert register.get_contents() == 128
+
+    register.set_bit_position(7, 0)
+    assert register.get_contents() == 0
+
+
+def test_flags_match_bit_lists():
+    register = Component("F")
+    for value in range(256):
+        register.set_contents(value)
+        bit_list = register.convert_contents_to_bit_list()
+        assert register.parity() == (sum(bit_list) % 2 == 0)
+        for flag, position in FLAG_POSITIONS.items():
+            assert register.get_flag(flag) == bit_list[7 - position]
+            assert register.get_bit_position(position) == bit_list[7 - position]
+
+
+def test_set_undocumented_bits():
+    flag_register = Component("F")
+    flag_register.set_contents(0b11010111)
+    flag_register.set_undocumented_bits(0b00101000)
+    assert flag_register.get_contents() == 0b11111111
+
+    flag_register.set_undocumented_bits(0b11010111)
+    assert flag_register.get_contents() == 0b11010111
+
+
+def test_memory_cell():
+    memory = Memory(256)
+    cell = memory.get_contents(10)
+    cell.set_contents(200)
+    assert memory.get_contents_value(10) == 200
+    assert cell.name == 10
+    assert cell == memory.get_contents(10)
+    assert cell != memory.get_contents(11)
+
+    cell.addition_with_flags(100)
+    assert memory.get_contents_value(10) == 44
+    assert cell.potential_flags[CARRY_FLAG] == True
+
+    cell.set_bit_position(7, 1)
+    assert memory.get_contents_value(10) == 172
+    assert memory.get_contents(-1).name == 255
+
+    with pytest.raises(Exception):
+        memory.get_contents(256)
+
+
+def test_memory_load_and_dump():
+    memory = Memory(8)
+    memory.load([1, 2, 3])
+    memory.load([9, 8], start=6)
+    assert memory.dump() == [1, 2, 3, 0, 0, 0, 9, 8]
+    assert memory.read_block(1, 3) == bytes([2, 3, 0])
+
+    with pytest.raises(Exception):
+        memory.load([1, 2, 3], start=6)
+
+
+def test_memory_copy_block_and_find():
+    memory = Memory(16)
+    memory.load([1, 2, 3, 4])
+    assert memory.copy_block(0, 8, 4)
+    assert memory.read_block(8, 4) == bytes([1, 2, 3, 4])
+    assert not memory.copy_block(0, 2, 4)
+    assert not memory.copy_block(0, 14, 4)
+    assert memory.find(3, 0, 16) == 2
+    assert memory.rfind(3, 0, 16) == 10
+    assert memory.find(9, 0, 16) == -1
+    assert memory.find(3, 0, 17) is None
+
+    memory.add_write_listener(lambda start, length: None)
+    assert not memory.copy_block(0, 8, 4)
+
+
+def test_memory_regions():
+    memory = Memory(16)
+    assert "set_contents_value" not in vars(memory)
+    memory.load([1, 2, 3, 4])
+    memory.map_rom(0, 4)
+    memory.map_mirror(8, 16, 4, 4)
+    assert "set_contents_value" in vars(memory)
+
+    memory.set_contents_value(1, 99)
+    assert memory.get_contents_value(1) == 2
+    memory.set_contents_value(13, 7)
+    assert memory.get_contents_value(5) == 7
+    assert memory.get_contents_value(9) == 7
+    memory.get_contents(4).set_contents(5)
+    assert memory.get_contents(12).get_contents() == 5
+    assert not memory.copy_block(0, 4, 2)
+    assert memory.find(5, 0, 16) is None
+
+    written = []
+    memory.map_region(6, 8, read=lambda address: address * 2, write=lambda address, value: written.append((address, value)))
+    assert memory.get_contents_value(7) == 14
+    memory.set_contents_value(6, 3)
+    assert written == [(6, 3)]
+
+    memory.unmap_region(0, 4)
+    memory.set_contents_value(1, 99)
+    assert memory.get_contents_value(1) == 99
+
+
+def test_io_bus():
+    ports = Memory(256)
+    io = IOBus(ports)
+    io.write(0x12FE, 5)
+    assert ports.get_contents_value(0xFE) == 5
+    assert io.read(0x34FE) == 5
+
+    written = []
+    io.add_read_handler(0xFE, lambda address: address >> 8, mask=0x01)
+    io.add_write_handler(0x7FFD, lambda address, value: written.append((address, value)), mask=0x8002)
+    assert io.read(0x12FC) == 0x12
+    ports.set_contents_value(0xFD, 9)
+    assert io.read(0x12FD) == 9 and io.data == 9
+    io.write(0x7FFD, 3)
+    io.write(0xFFFD, 4)
+    assert written == [(0x7FFD, 3)]
+    assert ports.get_contents_value(0xFD) == 4
+
+
+def test_memory_dirty_pages():
+    memory = Memory(4096)
+    assert "set_contents_value" not in vars(memory)
+    memory.track_dirty_pages()
+    memory.set_contents_value(0x100, 1)
+    memory.set_contents_value(0x2FF, 1)
+    memory.load([1] * 10, start=0x7FE)
+    assert memory.dirty_ranges() == [(0x100, 0x300), (0x700, 0x900)]
+    memory.clear_dirty_pages()
+    assert memory.copy_block(0, 0xF00, 16)
+    assert memory.dirty_ranges() == [(0xF00, 0x1000)]
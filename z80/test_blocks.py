@@ -0,0 +1,113 @@
+import pytest
+
+from z80 import Z80, BLOCK_ENGINE, INTERPRETER_ENGINE
+from instructions import instructions_by_prefix
+
+
+LOOP_PROGRAM = [
+    0x06, 0x0A,  # ld b,10
+    0x3E, 0x00,  # ld a,0
+    0x80,        # add a,b
+    0x10, 0xFD,  # djnz -3
+]
+
+# Where test_block_engine_matches_interpreter_for_every_opcode puts its programs, above
+# the restart vectors
+OPCODE_PROGRAM_START = 0x200
+
+SELF_MODIFYING_PROGRAM = [
+    0x3E, 0x3C,        # ld a,3Ch (the opcode of inc a)
+    0x32, 0x06, 0x00,  # ld (0006h),a
+    0x00,              # nop
+    0x00,              # nop, overwritten with inc a
+]
+
+
+def run_program(program, engine):
+    z80 = Z80()
+    z80.memory.load(program)
+    z80.run(code_end=len(program), engine=engine)
+    return z80
+
+
+def test_block_engine_matches_interpreter():
+    interpreted = run_program(LOOP_PROGRAM, INTERPRETER_ENGINE)
+    translated = run_program(LOOP_PROGRAM, BLOCK_ENGINE)
+    assert translated.A.get_contents() == 55
+    for name, register in interpreted.registers_by_name.items():
+        assert translated.registers_by_name[name].get_contents() == register.get_contents(), name
+
+
+def test_block_engine_matches_interpreter_for_every_opcode():
+    prefixes = {"": [], "CB": [0xCB], "ED": [0xED], "DD": [0xDD], "FD": [0xFD]}
+    programs = []
+    for prefix, prefix_bytes in prefixes.items():
+        for opcode, instruction in enumerate(instructions_by_prefix[prefix]):
+            if instruction is not None:
+                programs.append(prefix_bytes + [opcode])
+    for opcode in range(256):
+        programs.append([0xDD, 0xCB, 0x05, opcode])
+        programs.append([0xFD, 0xCB, 0xFB, opcode])
+    for code in programs:
+        # Operands 12h 34h 56h (ld (de),a; inc (hl); ld d,(hl) if not read), with inc a
+        # before and after, so the instruction is inside a block
+        program = [0x3C] + code + [0x12, 0x34, 0x56] + [0x3C] * 4
+        states = []
+        for engine in [INTERPRETER_ENGINE, BLOCK_ENGINE]:
+            z80 = Z80()
+            # Jumps, calls, returns and restarts all end up past the program
+            for vector in range(0, OPCODE_PROGRAM_START, 8):
+                z80.memory.load([0xC3, 0x00, 0xF8], start=vector)  # jp 0F800h
+            z80.memory.load([0x00, 0xF8], start=0xF000)
+            z80.stack_pointer.set_contents_value(0xF000)
+            z80.BC.set_contents_value(0x0102)
+            z80.HL.set_contents_value(0x7FFE)
+            z80.IX.set_contents_value(0x8000)
+            z80.IY.set_contents_value(0x9000)
+            z80.memory.load(program, start=OPCODE_PROGRAM_START)
+            z80.program_counter.set_contents_value(OPCODE_PROGRAM_START)
+            z80.run(code_end=OPCODE_PROGRAM_START + len(program), engine=engine)
+            registers = {name: register.get_contents() for name, register in z80.registers_by_name.items()}
+            states.append((registers, z80.tstates, bytes(z80.memory.contents)))
+        assert states[0] == states[1], code
+
+
+def test_block_engine_caches_blocks():
+    z80 = run_program(LOOP_PROGRAM, BLOCK_ENGINE)
+    assert sorted(z80.block_cache.blocks) == [0, 4]
+    assert z80.block_cache.blocks[4].end == 7
+
+
+def test_self_modifying_code():
+    assert run_program(SELF_MODIFYING_PROGRAM, INTERPRETER_ENGINE).A.get_contents() == 0x3D
+    assert run_program(SELF_MODIFYING_PROGRAM, BLOCK_ENGINE).A.get_contents() == 0x3D
+
+
+def test_load_invalidates_blocks():
+    z80 = run_program(LOOP_PROGRAM, BLOCK_ENGINE)
+    z80.memory.load([0x3E, 0x07], start=2)  # ld a,7
+    z80.program_counter.set_contents_value(0)
+    z80.run(code_end=len(LOOP_PROGRAM), engine=BLOCK_ENGINE)
+    assert z80.A.get_contents() == 7 + 55
+
+
+@pytest.mark.parametrize("engine", [INTERPRETER_ENGINE, BLOCK_ENGINE])
+def test_tstates(engine):
+    # ld b,10; ld a,0; 10 x add a,b; djnz taken 9 times, then not taken
+    assert run_program(LOOP_PROGRAM, engine).tstates == 7 + 7 + 10 * 4 + 9 * 13 + 8
+
+
+@pytest.mark.parametrize("engine", [INTERPRETER_ENGINE, BLOCK_ENGINE])
+def test_run_tstates_budget(engine):
+    z80 = Z80()
+    z80.memory.load(LOOP_PROGRAM)
+    z80.run(engine=engine, tstates=20)
+    assert z80.tstates == 7 + 7 + 4 + 13
+    assert z80.program_counter.get_contents() == 4
+    z80.run(engine=engine, tstates=8)
+    assert z80.tstates == 31 + 4 + 13
+
+
+def test_unknown_engine():
+    with pytest.raises(Exception):
+        Z80().run(engine="jit")
@@ -0,0 +1,57 @@
+from z80 import Z80
+from bus_trace import (
+    read_bus_log, EVENT_NAMES, MEMORY_READ_EVENT, MEMORY_WRITE_EVENT, PORT_READ_EVENT, PORT_WRITE_EVENT
+)
+from fuse_corpus import EVENT_KINDS
+
+PROGRAM = [
+    0x3E, 0x12,        # ld a,12h
+    0x32, 0x00, 0x80,  # ld (8000h),a
+    0xD3, 0xFE,        # out (0feh),a
+    0xDB, 0x1F,        # in a,(1fh)
+]
+
+
+def test_bus_trace():
+    assert EVENT_NAMES == EVENT_KINDS
+    z80 = Z80()
+    z80.memory.load(PROGRAM)
+    z80.ports.set_contents_value(0x1F, 0x55)
+    trace = z80.start_bus_trace()
+    z80.run(code_end=len(PROGRAM))
+    assert z80.stop_bus_trace() is trace
+    events = [(kind, address, data) for _, kind, address, data in trace]
+    assert events == [
+        (MEMORY_READ_EVENT, 0, 0x3E), (MEMORY_READ_EVENT, 1, 0x12),
+        (MEMORY_READ_EVENT, 2, 0x32), (MEMORY_READ_EVENT, 3, 0x00), (MEMORY_READ_EVENT, 4, 0x80),
+        # ld reads the byte back after writing it, to set its potential flags
+        (MEMORY_WRITE_EVENT, 0x8000, 0x12), (MEMORY_READ_EVENT, 0x8000, 0x12),
+        (MEMORY_READ_EVENT, 5, 0xD3), (MEMORY_READ_EVENT, 6, 0xFE), (PORT_WRITE_EVENT, 0x12FE, 0x12),
+        (MEMORY_READ_EVENT, 7, 0xDB), (MEMORY_READ_EVENT, 8, 0x1F), (PORT_READ_EVENT, 0x121F, 0x55),
+    ]
+    assert [tstates for tstates, _, _, _ in trace] == [0, 0, 7, 7, 7, 7, 7, 20, 20, 20, 31, 31, 31]
+    for name in ["get_contents_value", "set_contents_value", "copy_block", "find", "rfind"]:
+        assert name not in z80.memory.__dict__
+    assert "read" not in z80.io.__dict__ and "write" not in z80.io.__dict__
+
+
+def test_bus_trace_ring_buffer(tmp_path):
+    z80 = Z80()
+    z80.memory.load([0x01, 0x04, 0x00, 0x21, 0x00, 0x90, 0x11, 0x00, 0xA0, 0xED, 0xB0])  # ld bc,4; ld hl,9000h; ld de,0a000h; ldir
+    z80.memory.load([1, 2, 3, 4], 0x9000)
+    trace = z80.start_bus_trace(capacity=5)
+    assert trace.capacity == 8
+    z80.run(code_end=11)
+    z80.stop_bus_trace()
+    # ldir runs a byte at a time while tracing, so the last copy is the final event
+    assert trace.count > 8 and trace.dropped == trace.count - 8
+    events = list(trace)
+    assert len(events) == 8
+    assert events[-1][1:] == (MEMORY_WRITE_EVENT, 0xA003, 4)
+    assert [e[1:] for e in events if e[1] == MEMORY_WRITE_EVENT][-2:] == [(MEMORY_WRITE_EVENT, 0xA002, 3), (MEMORY_WRITE_EVENT, 0xA003, 4)]
+
+    path = str(tmp_path / "bus.log")
+    trace.dump(path)
+    assert list(read_bus_log(path)) == events
+    trace.clear()
+    assert list(trace) == []
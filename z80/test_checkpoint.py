@@ -0,0 +1,103 @@
+import pytest
+
+from z80 import Z80
+from paging import PagedMemory
+from test_blocks import LOOP_PROGRAM
+
+
+def register_values(z80):
+    return {name: register.get_contents() for name, register in z80.registers_by_name.items()}
+
+
+def test_checkpoint_and_restore():
+    z80 = Z80()
+    z80.memory.load(LOOP_PROGRAM)
+    z80.run(tstates=40)
+    z80.IFF1 = z80.IFF2 = 1
+    z80.interrupt_mode = 2
+    z80.raise_int(0x42)
+    z80.interrupt_check = False
+    saved = z80.checkpoint()
+    registers = register_values(z80)
+    tstates = z80.tstates
+
+    z80.run(code_end=len(LOOP_PROGRAM))
+    z80.memory.load([0xFF] * 16, start=0x8000)
+    z80.restore(saved)
+    assert register_values(z80) == registers
+    assert z80.tstates == tstates
+    assert (z80.IFF1, z80.IFF2, z80.interrupt_mode) == (1, 1, 2)
+    assert z80.interrupt_pending and z80.interrupt_data_bus == 0x42
+    assert z80.memory.read_block(0x8000, 16) == bytes(16)
+
+    z80.interrupt_pending = False
+    z80.run(code_end=len(LOOP_PROGRAM))
+    assert z80.A.get_contents() == 55
+
+
+def test_checkpoint_scheduled_interrupts():
+    z80 = Z80()
+    z80.memory.load([0xED, 0x56, 0xFB, 0x3C, 0x18, 0xFD])  # im 1; ei; loop: inc a; jr loop
+    z80.memory.load([0xFB, 0xC9], 0x38)  # 0038h: ei; ret
+    z80.stack_pointer.set_contents_value(0xFF00)
+    z80.schedule_interrupt(100)
+    z80.schedule_interrupt(200, 0x10)
+    saved = z80.checkpoint()
+
+    z80.run(tstates=300)
+    first = (z80.A.get_contents(), z80.tstates, register_values(z80))
+    assert z80.scheduled_interrupts == []
+    z80.schedule_interrupt(250)
+    z80.restore(saved)
+    assert z80.scheduled_interrupts == [(100, 0xFF), (200, 0x10)]
+    assert z80.next_interrupt_tstates == 100
+    z80.run(tstates=300)
+    assert (z80.A.get_contents(), z80.tstates, register_values(z80)) == first
+
+
+def test_incremental_checkpoints():
+    z80 = Z80()
+    with pytest.raises(Exception):
+        z80.checkpoint(incremental=True)
+    z80.memory.track_dirty_pages()
+    base = z80.checkpoint()
+    z80.memory.set_contents_value(0x1234, 1)
+    z80.A.set_contents(7)
+    first = z80.checkpoint(incremental=True)
+    z80.memory.set_contents_value(0x9000, 2)
+    second = z80.checkpoint(incremental=True)
+    assert len(first) < 1024 and len(second) < 1024
+
+    z80.memory.set_contents_value(0x1234, 3)
+    z80.restore(base)
+    assert z80.memory.get_contents_value(0x1234) == 0
+    z80.restore(first)
+    assert z80.A.get_contents() == 7
+    assert z80.memory.get_contents_value(0x1234) == 1
+    assert z80.memory.get_contents_value(0x9000) == 0
+    z80.restore(second)
+    assert z80.memory.get_contents_value(0x9000) == 2
+
+
+def test_checkpoint_paged_memory():
+    z80 = Z80(memory=PagedMemory(10))
+    z80.memory.track_dirty_pages()
+    z80.memory.load_bank(7, [5])
+    z80.memory.map_bank(0, 9, read_only=True)
+    saved = z80.checkpoint()
+    z80.memory.map_bank(0, 0)
+    z80.memory.banks[7][0] = 0
+    z80.restore(saved)
+    assert z80.memory.page_banks == [9, 1, 2, 3]
+    assert z80.memory.write_pages[0] is z80.memory.scratch_page
+    assert z80.memory.banks[7][0] == 5
+
+    z80.memory.map_bank(3, 7)
+    z80.memory.set_contents_value(0xC001, 6)
+    delta = z80.checkpoint(incremental=True)
+    z80.memory.banks[7][1] = 0
+    z80.restore(delta)
+    assert z80.memory.banks[7][1] == 6
+
+    with pytest.raises(Exception):
+        Z80().restore(saved)
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+import conformance
+from conformance import (
+    load_tests, run_shard, run_tests, main, ConformanceRunner, PASS, FAIL, SKIPPED_TESTS, EXPECTED_FAILURES
+)
+from fuse_corpus import parse_fuse_file, PORT_READ, PORT_WRITE, NO_EVENT_DATA
+from z80 import BLOCK_ENGINE
+
+TESTS_IN = """db
+0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0000
+00 00 0 0 0 0     1
+0000 db 23 -1
+-1
+"""
+
+TESTS_EXPECTED = """db
+    0 MC 0000
+    4 MR 0000 db
+   11 PR 0023 a5
+a500 0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0002
+00 02 0 0 0 0 11
+
+"""
+
+
+@pytest.fixture(scope="module")
+def fuse_tests(tmp_path_factory):
+    return load_tests(cache_directory=str(tmp_path_factory.mktemp("cache")))
+
+
+def write_corpus(tmp_path):
+    (tmp_path / "tests.in").write_text(TESTS_IN)
+    (tmp_path / "tests.expected").write_text(TESTS_EXPECTED)
+    return str(tmp_path / "tests.in"), str(tmp_path / "tests.expected")
+
+
+def test_parse_fuse_files(tmp_path):
+    tests_in, tests_expected = write_corpus(tmp_path)
+    before = parse_fuse_file(tests_in)["db"]
+    assert before.registers == [0] * 12 and before.tstates == 1
+    assert before.memory == [(0, bytes([0xDB, 0x23]))]
+    after = parse_fuse_file(tests_expected)["db"]
+    assert after.registers[0] == 0xA500 and after.r == 2 and after.tstates == 11
+    assert after.events[0] == (0, "MC", 0, NO_EVENT_DATA)
+    assert after.events[2] == (11, PORT_READ, 0x23, 0xA5)
+
+    [(before, after)] = load_tests(tests_in, tests_expected, cache_directory=None)
+    runner = ConformanceRunner()
+    assert runner.run_test(before, after)["status"] == PASS
+    assert runner.port_events == [(PORT_READ, 0x23, 0xA5)]
+    after.events[2] = (11, PORT_WRITE, 0x23, 0xA5)
+    result = runner.run_test(before, after)
+    assert result["status"] == FAIL
+    assert [d["kind"] for d in result["differences"]] == ["register", "ports"]
+
+
+def test_runner_resets_between_tests(fuse_tests):
+    tests = {before.name: (before, after) for before, after in fuse_tests}
+    runner = ConformanceRunner()
+    # 02 writes to 0001, 00 expects it untouched afterwards
+    assert runner.run_test(*tests["02"])["status"] == PASS
+    assert runner.run_test(*tests["00"])["status"] == PASS
+    assert runner.z80.memory.get_contents_value(1) == 0
+
+
+def test_fuse_corpus(fuse_tests):
+    tests = [test for test in fuse_tests if test[0].name not in SKIPPED_TESTS]
+    failures = [result["name"] for result in run_shard(tests) if result["status"] != PASS]
+    assert failures == EXPECTED_FAILURES
+
+
+def test_run_tests_report(fuse_tests):
+    tests = [test for test in fuse_tests if test[0].name in ["00", "01", "ed41", "dd00"]]
+    report = run_tests(tests, BLOCK_ENGINE, workers=2)
+    assert report["summary"]["total"] == 4 and report["summary"][PASS] == 3
+    assert [result["name"] for result in report["tests"]] == ["00", "01", "dd00", "ed41"]
+
+
+def test_main_exit_status(tmp_path, monkeypatch):
+    cache = str(tmp_path / "cache")
+    assert main(["00", "dd00", "--workers", "1", "--cache-directory", cache]) == 0
+    monkeypatch.setattr(conformance, "EXPECTED_FAILURES", [])
+    assert main(["00", "dd00", "--workers", "1", "--cache-directory", cache]) == 1
+    monkeypatch.undo()
+    report_path = tmp_path / "report.json"
+    assert main(["ed41", "--workers", "1", "--cache-directory", cache, "--report", str(report_path)]) == 0
+    assert json.loads(report_path.read_text())["summary"]["unexpected_failures"] == []
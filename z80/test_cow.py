@@ -0,0 +1,66 @@
+from z80 import Z80
+from cow import CowMemory
+from test_blocks import LOOP_PROGRAM
+
+
+def test_cow_memory_clone():
+    memory = CowMemory()
+    memory.load([1, 2, 3], start=0x1000)
+    clone = memory.clone()
+    assert memory.owned_page_count() == 0 and clone.owned_page_count() == 0
+    assert clone.read_block(0x1000, 3) == bytes([1, 2, 3])
+
+    clone.set_contents_value(0x1001, 9)
+    memory.set_contents_value(0x8000, 7)
+    assert memory.get_contents_value(0x1001) == 2
+    assert clone.get_contents_value(0x8000) == 0
+    assert clone.owned_page_count() == 1 and memory.owned_page_count() == 1
+    assert memory.changed_ranges(clone) == [(0x1000, 0x1100), (0x8000, 0x8100)]
+
+    clone.set_contents_value(0x1001, 2)
+    assert memory.changed_ranges(clone) == [(0x8000, 0x8100)]
+
+
+def test_cow_memory_dirty_pages():
+    memory = CowMemory()
+    memory.track_dirty_pages()
+    memory.set_contents_value(0x20FF, 1)
+    memory.load([2] * 2, start=0x21FF)
+    assert memory.dirty_ranges() == [(0x2000, 0x2300)]
+    assert memory.read_block(0x21FE, 3) == bytes([0, 2, 2])
+    memory.clear_dirty_pages()
+    memory.map_rom(0, 0x100)
+    memory.set_contents_value(0x10, 1)
+    memory.set_contents_value(0x110, 1)
+    assert memory.get_contents_value(0x10) == 0
+    assert memory.dirty_ranges() == [(0x100, 0x200)]
+
+
+def test_z80_clone():
+    z80 = Z80(memory=CowMemory())
+    z80.memory.load(LOOP_PROGRAM)
+    z80.run(tstates=40)
+    clone = z80.clone()
+    assert clone.program_counter.get_contents() == z80.program_counter.get_contents()
+    assert clone.tstates == z80.tstates
+
+    clone.run(code_end=len(LOOP_PROGRAM))
+    clone.memory.set_contents_value(0x9000, 1)
+    assert clone.A.get_contents() == 55
+    assert z80.A.get_contents() != 55
+    assert z80.memory.get_contents_value(0x9000) == 0
+    z80.run(code_end=len(LOOP_PROGRAM))
+    assert z80.A.get_contents() == 55
+
+    saved = clone.checkpoint()
+    clone.memory.set_contents_value(0x9000, 2)
+    clone.restore(saved)
+    assert clone.memory.get_contents_value(0x9000) == 1
+
+
+def test_clone_flat_memory():
+    z80 = Z80()
+    z80.memory.set_contents_value(0x4000, 3)
+    clone = z80.clone()
+    clone.memory.set_contents_value(0x4000, 4)
+    assert z80.memory.get_contents_value(0x4000) == 3
@@ -0,0 +1,50 @@
+import os
+
+from fuse_corpus import load_corpus, parse_tests, build_corpus, FuseCorpus
+
+
+def state_fields(state):
+    return (
+        state.name, state.registers, state.i, state.r, state.iff1, state.iff2, state.interrupt_mode, state.halted,
+        state.tstates, state.memory, state.events
+    )
+
+
+def test_corpus_matches_parsed_tests():
+    parsed = parse_tests()
+    corpus = FuseCorpus(build_corpus(parsed))
+    assert corpus.count == len(parsed)
+    for (before, after), (cached_before, cached_after) in zip(parsed, corpus.tests()):
+        assert state_fields(cached_before) == state_fields(before)
+        assert state_fields(cached_after) == state_fields(after)
+
+
+def test_load_corpus_cache(tmp_path):
+    tests_in = tmp_path / "tests.in"
+    tests_expected = tmp_path / "tests.expected"
+    tests_in.write_text("00\n0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0000\n00 00 0 0 0 0     1\n0000 00 -1\n-1\n")
+    tests_expected.write_text(
+        "00\n    0 MC 0000\n    4 MR 0000 00\n"
+        "0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0000 0001\n00 01 0 0 0 0 4\n\n"
+    )
+    cache = tmp_path / "cache"
+    corpus = load_corpus(str(tests_in), str(tests_expected), str(cache))
+    [path] = os.listdir(cache)
+    assert corpus.names == ["00"]
+    after = corpus.state(0, "after")
+    assert after.registers[-1] == 1 and after.r == 1 and after.tstates == 4
+    assert after.events == [(0, "MC", 0, -1), (4, "MR", 0, 0)]
+
+    assert load_corpus(str(tests_in), str(tests_expected), str(cache)).names == ["00"]
+    assert os.listdir(cache) == [path]
+    tests_in.write_text(tests_in.read_text().replace("0000 00 -1", "0000 01 -1"))
+    corpus = load_corpus(str(tests_in), str(tests_expected), str(cache))
+    assert corpus.state(0, "before").memory == [(0, b"\x01")]
+    # The cache of the old contents is replaced
+    assert len(os.listdir(cache)) == 1 and os.listdir(cache) != [path]
+
+
+def test_corpus_paths_independent_of_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    corpus = load_corpus(cache_directory=str(tmp_path / "cache"))
+    assert corpus.count == len(parse_tests())
@@ -0,0 +1,96 @@
+from z80 import Z80
+from instruction_trace import InstructionTracer, InstructionTraceReader
+
+PROGRAM = [
+    0x06, 0x05,        # ld b,5
+    0x3E, 0x00,        # ld a,0
+    0x3C,              # loop: inc a
+    0x10, 0xFD,        # djnz loop
+    0x32, 0x00, 0x80,  # ld (8000h),a
+]
+
+
+def run_traced(path, **kwargs):
+    z80 = Z80()
+    z80.memory.load(PROGRAM)
+    with InstructionTracer(path, **kwargs) as tracer:
+        z80.run(code_end=len(PROGRAM), tracer=tracer)
+    return z80, tracer
+
+
+def test_instruction_trace(tmp_path):
+    path = str(tmp_path / "run.trace")
+    z80, tracer = run_traced(path)
+    assert tracer.count == 13
+    with InstructionTraceReader(path) as reader:
+        records = list(reader)
+        assert len(reader) == 13
+        assert [record.step for record in records] == list(range(13))
+        assert [record.pc for record in records] == [0, 2] + [4, 5] * 5 + [7]
+        assert records[0].opcode == bytes([0x06, 0x05])
+        assert records[-1].opcode == bytes([0x32, 0x00, 0x80])
+        assert records[2].text == z80.unprefixed_instruction(0x3C).text
+        assert records[3].registers["BC"] == 0x0400
+        assert records[-1].registers["AF"] >> 8 == 5
+        assert records[-1].registers["PC"] == len(PROGRAM)
+        assert records[-1].tstates == z80.tstates
+        assert records[0].tstates == 7
+
+
+def test_instruction_trace_filters(tmp_path):
+    path = str(tmp_path / "loop.trace")
+    run_traced(path, pc_ranges=[(4, 7)])
+    with InstructionTraceReader(path) as reader:
+        assert [record.pc for record in reader] == [4, 5] * 5
+        # Steps count every instruction, recorded or not
+        assert [record.step for record in reader][:2] == [2, 3]
+
+    path = str(tmp_path / "djnz.trace")
+    run_traced(path, mnemonics=["djnz"])
+    with InstructionTraceReader(path) as reader:
+        assert [record.pc for record in reader] == [5] * 5
+
+    path = str(tmp_path / "none.trace")
+    run_traced(path, pc_ranges=[(4, 7)], mnemonics=["ld"])
+    with InstructionTraceReader(path) as reader:
+        assert len(reader) == 0
+        assert list(reader) == []
+
+
+def test_instruction_trace_seek(tmp_path):
+    path = str(tmp_path / "blocks.trace")
+    run_traced(path, block_records=3, queue_blocks=1)
+    with InstructionTraceReader(path) as reader:
+        assert len(reader.offsets) == 5
+        records = list(reader)
+        for n in [0, 2, 3, 7, 12]:
+            assert reader[n].step == n
+            assert reader[n].pc == records[n].pc
+        assert reader[-1].step == 12
+        assert [record.step for record in reader.records(4)] == list(range(4, 13))
+        assert list(reader.records(13)) == []
+        try:
+            reader[13]
+            assert False
+        except IndexError:
+            pass
+
+
+def test_instruction_trace_indexed_bit_instructions(tmp_path):
+    z80 = Z80()
+    program = [
+        0xDD, 0x21, 0x00, 0x80,  # ld ix,8000h
+        0xDD, 0xCB, 0x05, 0x46,  # bit 0,(ix+5)
+        0xFD, 0xCB, 0x02, 0xCE,  # set 1,(iy+2)
+    ]
+    z80.memory.load(program)
+    path = str(tmp_path / "bit.trace")
+    with InstructionTracer(path, mnemonics=["bit", "set"]) as tracer:
+        z80.run(code_end=len(program), tracer=tracer)
+    with InstructionTraceReader(path) as reader:
+        records = list(reader)
+    assert [record.pc for record in records] == [4, 8]
+    assert [record.text for record in records] == ["bit 0,(ix+*)", "set 1,(iy+*)"]
+    assert records[0].opcode == bytes(program[4:8])
+    assert records[1].opcode == bytes(program[8:12])
+    assert z80.memory.get_contents_value(2) == 0x02
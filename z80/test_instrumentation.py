@@ -0,0 +1,49 @@
+from z80 import Z80, INTERPRETER_ENGINE, BLOCK_ENGINE
+from instrumentation import InstrumentedZ80, PHASES, OTHER_PHASE, FLAGS_PHASE, UNDOCUMENTED_PHASE
+from benchmarks import ENGINE_PROGRAM
+
+PROGRAM = [
+    0x3E, 0x0F,              # ld a,0fh
+    0xC6, 0x01,              # add a,1
+    0xDD, 0x21, 0x00, 0x80,  # ld ix,8000h
+    0xDD, 0xCB, 0x00, 0x06,  # rlc (ix+0)
+]
+
+
+def test_instrumented_z80():
+    z80 = InstrumentedZ80()
+    z80.memory.load(PROGRAM)
+    z80.run(code_end=len(PROGRAM))
+    assert z80.A.get_contents() == 0x10
+    assert z80.instruction_count == 4
+    assert z80.mnemonic_counts == {"ld": 2, "add": 1, "rlc": 1}
+    phases = dict(z80.phases())
+    assert list(phases) == PHASES + [OTHER_PHASE]
+    assert all(ns >= 0 for ns in phases.values())
+    assert phases[FLAGS_PHASE] > 0 and phases[UNDOCUMENTED_PHASE] > 0
+    assert sum(phases.values()) >= z80.run_ns
+    report = z80.instrumentation_report()
+    assert "4 instructions" in report and "rlc" in report
+
+    plain = Z80()
+    plain.memory.load(PROGRAM)
+    plain.run(code_end=len(PROGRAM))
+    assert z80.checkpoint() == plain.checkpoint()
+
+    z80.reset_instrumentation()
+    assert z80.instruction_count == 0 and z80.run_ns == 0
+    assert "execute_instruction" not in Z80().__dict__
+
+
+def test_instrumented_engines():
+    results = []
+    for engine in [INTERPRETER_ENGINE, BLOCK_ENGINE]:
+        z80 = InstrumentedZ80()
+        z80.memory.load(ENGINE_PROGRAM)
+        z80.run(code_end=len(ENGINE_PROGRAM), engine=engine)
+        results.append((z80.HL.get_contents(), z80.tstates, z80.instruction_count))
+    plain = Z80()
+    plain.memory.load(ENGINE_PROGRAM)
+    plain.run(code_end=len(ENGINE_PROGRAM))
+    assert results[0] == results[1]
+    assert results[0][:2] == (plain.HL.get_contents(), plain.tstates)
@@ -0,0 +1,121 @@
+import pytest
+
+from z80 import Z80, BLOCK_ENGINE, INTERPRETER_ENGINE
+
+ENGINES = [INTERPRETER_ENGINE, BLOCK_ENGINE]
+
+HALT = 0x76
+STACK = 0x8000
+
+
+def make_z80(program, interrupt_mode=1, iff=0, handlers=None):
+    z80 = Z80()
+    z80.memory.load(program)
+    for address, code in (handlers or {}).items():
+        z80.memory.load(code, start=address)
+    z80.stack_pointer.set_contents_value(STACK)
+    z80.interrupt_mode = interrupt_mode
+    z80.IFF1 = iff
+    z80.IFF2 = iff
+    return z80
+
+
+def return_address(z80):
+    sp = z80.stack_pointer.get_contents()
+    return z80.memory.get_contents_value(sp) + 256 * z80.memory.get_contents_value(sp + 1)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_im1_interrupt(engine):
+    z80 = make_z80([0x00, HALT], iff=1, handlers={0x38: [HALT]})
+    z80.raise_int()
+    z80.run(engine=engine)
+    assert z80.program_counter.get_contents() == 0x39
+    assert return_address(z80) == 0
+    assert z80.IFF1 == 0 and z80.IFF2 == 0
+    assert z80.halted
+    assert z80.tstates == 13 + 4
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_ei_delays_interrupt_by_one_instruction(engine):
+    z80 = make_z80([0xFB, 0x3E, 0x01, 0x3E, 0x02, HALT], handlers={0x38: [HALT]})  # ei; ld a,1; ld a,2
+    z80.raise_int()
+    z80.run(engine=engine)
+    assert z80.A.get_contents() == 1
+    assert return_address(z80) == 3
+    assert z80.program_counter.get_contents() == 0x39
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_di_holds_interrupt_pending(engine):
+    z80 = make_z80([0xF3, 0x00, HALT], iff=1)  # di; nop; halt
+    z80.schedule_interrupt(2)
+    z80.run(engine=engine)
+    assert z80.program_counter.get_contents() == 3
+    assert z80.halted
+    assert z80.interrupt_pending
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_im2_vector(engine):
+    z80 = make_z80([HALT], interrupt_mode=2, iff=1, handlers={0x8010: [0x40, 0x01], 0x0140: [HALT]})
+    z80.I.set_contents(0x80)
+    z80.raise_int(data_bus=0x10)
+    z80.run(engine=engine)
+    assert z80.program_counter.get_contents() == 0x0141
+    assert z80.tstates == 19 + 4
+
+
+def test_im0_executes_data_bus_instruction():
+    z80 = make_z80([HALT], interrupt_mode=0, iff=1, handlers={0x10: [HALT]})
+    z80.raise_int(data_bus=0xD7)  # rst 10h
+    z80.run()
+    assert z80.program_counter.get_contents() == 0x11
+    assert z80.tstates == 13 + 4
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nmi_and_retn(engine):
+    z80 = make_z80([HALT], iff=1, handlers={0x66: [HALT]})
+    z80.raise_nmi()
+    z80.run(engine=engine)
+    assert z80.program_counter.get_contents() == 0x67
+    assert z80.IFF1 == 0 and z80.IFF2 == 1
+    assert z80.tstates == 11 + 4
+
+    z80 = make_z80([HALT], iff=1, handlers={0x66: [0xED, 0x45]})  # retn
+    z80.raise_nmi()
+    z80.run(engine=engine)
+    assert z80.IFF1 == 1
+    assert z80.program_counter.get_contents() == 1
+    assert z80.tstates == 11 + 14 + 4
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_halt_fast_forwards_to_scheduled_interrupt(engine):
+    z80 = make_z80([0xFB, HALT], handlers={0x38: [HALT]})  # ei; halt
+    z80.schedule_interrupt(1000)
+    z80.run(engine=engine)
+    assert z80.tstates == 1000 + 13 + 4
+    assert return_address(z80) == 2
+    assert z80.scheduled_interrupts == []
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_halt_stops_at_tstates_budget(engine):
+    z80 = make_z80([HALT])
+    z80.run(engine=engine, tstates=100)
+    assert z80.tstates == 100
+    assert z80.halted
+    z80.run(engine=engine, tstates=50)
+    assert z80.tstates == 152
+    assert z80.program_counter.get_contents() == 1
+
+
+def test_interrupt_mode_instruction():
+    z80 = make_z80([0xED, 0x5E, 0xED, 0x56, HALT])  # im 2; im 1
+    z80.run(code_end=2)
+    assert z80.interrupt_mode == 2
+    z80.run()
+    assert z80.interrupt_mode == 1
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from z80 import Z80
+from instructions import instructions, JUMP_INSTRUCTIONS, DDCB, FDCB
+from operands import DOUBLE_REGISTERS, SINGLE_REGISTERS, compile_right_arg, compile_left_arg
+
+
+def random_z80(seed):
+    rng = random.Random(seed)
+    z80 = Z80()
+    z80.memory.load([rng.randrange(256) for _ in range(z80.MEMORY_SIZE)])
+    for register in z80.registers:
+        if register.SIZE == 1:
+            register.set_contents(rng.randrange(256))
+    z80.program_counter.set_contents_value(0x8000)
+    return z80
+
+
+def comparable(substituted_arg):
+    if isinstance(substituted_arg, tuple):
+        return tuple(comparable(e) for e in substituted_arg)
+    if hasattr(substituted_arg, "get_contents"):
+        return (substituted_arg.name, substituted_arg.get_contents())
+    return substituted_arg
+
+
+def test_register_names():
+    z80 = Z80()
+    assert sorted(DOUBLE_REGISTERS + SINGLE_REGISTERS) == sorted(z80.registers_by_name)
+    for name in DOUBLE_REGISTERS:
+        assert z80.registers_by_name[name].SIZE == 2
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_compiled_operands_match_substitution(seed):
+    expected_z80 = random_z80(seed)
+    z80 = random_z80(seed)
+    for instruction in instructions:
+        if instruction.instruction_base in JUMP_INSTRUCTIONS + [DDCB, FDCB, "rst", "ex"]:
+            continue
+        if instruction.instruction_base in ["rrca", "rla", "rlca", "rra", "rrd"]:
+            continue
+        expected_z80.program_counter.set_contents_value(0x8000)
+        expected = (
+            expected_z80.substitute_arg(instruction.left_arg, instruction.right_arg),
+            expected_z80.substitute_right_arg(instruction.right_arg, instruction.left_arg),
+        )
+        z80.program_counter.set_contents_value(0x8000)
+        actual = (instruction.substitute_left(z80), instruction.substitute_right(z80))
+        assert comparable(actual) == comparable(expected), instruction.text
+        assert z80.program_counter.get_contents() == expected_z80.program_counter.get_contents()
+
+
+def test_compiled_ddcb_operands():
+    expected_z80 = random_z80(3)
+    z80 = random_z80(3)
+    for left_arg, right_arg in [("(ix+*)", "b"), ("0", "(ix+*)"), ("(ix+*)", None)]:
+        expected = (
+            expected_z80.substitute_arg(left_arg, right_arg),
+            expected_z80.substitute_right_arg(right_arg, left_arg, DDCB),
+        )
+        actual = (compile_left_arg(left_arg, right_arg)(z80), compile_right_arg(right_arg, left_arg, DDCB)(z80))
+        assert comparable(actual) == comparable(expected)
+        assert z80.program_counter.get_contents() == expected_z80.program_counter.get_contents()
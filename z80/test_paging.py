@@ -0,0 +1,92 @@
+import pytest
+
+from z80 import Z80, BLOCK_ENGINE
+from paging import PagedMemory
+
+
+def test_bank_switching():
+    memory = PagedMemory(8)
+    assert memory.page_banks == [0, 1, 2, 3]
+    memory.set_contents_value(0xC000, 1)
+    memory.map_bank(3, 7)
+    assert memory.get_contents_value(0xC000) == 0
+    memory.set_contents_value(0xC000, 2)
+    memory.map_bank(3, 3)
+    assert memory.get_contents_value(0xC000) == 1
+    assert memory.banks[7][0] == 2
+    assert memory.pool[7 * 0x4000] == 2
+
+
+def test_read_only_bank():
+    memory = PagedMemory(10)
+    memory.load_bank(8, [0xF3, 0xAF])
+    memory.map_bank(0, 8, read_only=True)
+    assert memory.read_block(0, 3) == bytes([0xF3, 0xAF, 0])
+    memory.set_contents_value(0, 0)
+    assert memory.get_contents_value(0) == 0xF3
+    assert memory.scratch_page[0] == 0
+    memory.load([1], start=0)
+    assert memory.banks[8][0] == 1
+
+
+def test_blocks_across_pages():
+    memory = PagedMemory(4, page_size=256)
+    assert len(memory.read_pages) == 256
+    memory.load([1, 2, 3, 4], start=254)
+    assert memory.read_block(254, 4) == bytes([1, 2, 3, 4])
+    assert memory.banks[0][255] == 2
+    assert memory.banks[1][0] == 3
+    assert memory.dump()[254:258] == [1, 2, 3, 4]
+
+    with pytest.raises(Exception):
+        PagedMemory(4, page_size=1000)
+
+
+def test_z80_bank_switch_from_port():
+    memory = PagedMemory(8)
+    z80 = Z80(memory=memory)
+    z80.io.add_write_handler(0x7FFD, lambda address, value: memory.map_bank(3, value & 7), mask=0x8002)
+    # ld a,5; ld (0C000h),a; ld bc,7FFDh; ld a,1; out (c),a; ld a,(0C000h)
+    program = [0x3E, 0x05, 0x32, 0x00, 0xC0, 0x01, 0xFD, 0x7F, 0x3E, 0x01, 0xED, 0x79, 0x3A, 0x00, 0xC0]
+    z80.memory.load(program)
+    z80.run(code_end=len(program))
+    assert memory.page_banks[3] == 1
+    assert z80.A.get_contents() == 0
+    assert memory.banks[3][0] == 5
+
+
+def test_bank_switch_drops_only_blocks_in_page():
+    memory = PagedMemory(8)
+    z80 = Z80(memory=memory)
+    memory.load([0x3C, 0xC3, 0x00, 0xC0], start=0x4000)  # inc a; jp 0C000h
+    memory.load([0x3C, 0x3C, 0x3C], start=0xC000)  # inc a; inc a; inc a
+    z80.program_counter.set_contents_value(0x4000)
+    z80.run(engine=BLOCK_ENGINE, code_end=0xC003)
+    assert z80.A.get_contents() == 4
+    cache = z80.block_cache
+    assert sorted(cache.blocks) == [0x4000, 0xC000]
+    memory.map_bank(3, 6)
+    assert sorted(cache.blocks) == [0x4000]
+
+
+def test_write_to_aliased_bank_drops_blocks():
+    memory = PagedMemory(2)
+    assert memory.page_banks == [0, 1, 0, 1]
+    z80 = Z80(memory=memory)
+    memory.load([0x3E, 0x01], start=0x8000)  # ld a,1
+    z80.program_counter.set_contents_value(0x8000)
+    z80.run(engine=BLOCK_ENGINE, code_end=0x8002)
+    assert z80.A.get_contents() == 1
+    # Page 0 is the same bank, so this makes the code at 8000h ld b,1
+    memory.set_contents_value(0x0000, 0x06)
+    assert z80.block_cache.blocks == {}
+    z80.A.set_contents(0)
+    z80.program_counter.set_contents_value(0x8000)
+    z80.run(engine=BLOCK_ENGINE, code_end=0x8002)
+    assert z80.A.get_contents() == 0
+    assert z80.B.get_contents() == 1
+
+    written = []
+    memory.add_write_listener(lambda start, length: written.append((start, length)))
+    memory.load([0], start=0x4001)
+    assert written == [(0x4001, 1), (0xC001, 1)]
@@ -0,0 +1,116 @@
+from z80 import Z80
+from profiler import Profiler
+
+PROGRAM = [
+    0x31, 0x00, 0xFF,  # ld sp,0ff00h
+    0x06, 0x03,        # ld b,3
+    0xCD, 0x20, 0x00,  # loop: call 0020h
+    0x10, 0xFB,        # djnz loop
+    0xC4, 0x20, 0x00,  # call nz,0020h, not taken as rlc of 0 sets z
+    0xC3, 0x00, 0x01,  # jp 0100h, ending the run
+]
+CODE_END = 0x100
+SUBROUTINE = [
+    0xCD, 0x30, 0x00,  # 0020h: call 0030h
+    0xC9,              # ret
+]
+LEAF = [
+    0xDD, 0xCB, 0x00, 0x06,  # 0030h: rlc (ix+0)
+    0xC9,                    # ret
+]
+
+
+def run_profiled(profiler):
+    z80 = Z80()
+    z80.memory.load(PROGRAM)
+    z80.memory.load(SUBROUTINE, 0x20)
+    z80.memory.load(LEAF, 0x30)
+    z80.IX.set_contents_value(0x8000)
+    z80.run(code_end=CODE_END, profiler=profiler)
+    return z80
+
+
+def test_profiler():
+    profiler = Profiler(symbols={0x30: "leaf"})
+    z80 = run_profiled(profiler)
+    assert profiler.counts[0x05] == 3 and profiler.tstates[0x05] == 3 * 17
+    assert profiler.counts[0x0A] == 1 and profiler.tstates[0x0A] == 10
+    assert profiler.counts[0x30] == 3 and profiler.tstates[0x30] == 3 * 23
+    assert sum(profiler.tstates) == z80.tstates
+    assert profiler.hot_spots(1) == [(0x30, 3, 69)]
+    mnemonics = {base: (count, tstates) for base, count, tstates in profiler.mnemonics()}
+    assert mnemonics["rlc"] == (3, 69)
+    assert mnemonics["call"] == (7, 6 * 17 + 10)
+    assert mnemonics["ret"] == (6, 60)
+
+    subroutines = {target: (calls, inclusive, exclusive) for target, calls, inclusive, exclusive in profiler.subroutines()}
+    leaf = 23 + 10
+    assert subroutines[0x30] == (3, 3 * leaf, 3 * leaf)
+    assert subroutines[0x20] == (3, 3 * (17 + leaf + 10), 3 * (17 + 10))
+    assert profiler.folded_stacks() == [
+        "root {}".format(z80.tstates - 3 * (17 + leaf + 10)),
+        "root;0020 {}".format(3 * 27),
+        "root;0020;leaf {}".format(3 * leaf),
+    ]
+    assert "leaf" in profiler.report()
+
+
+def test_profiler_interval():
+    profiler = Profiler(interval=4, seed=1)
+    run_profiled(profiler)
+    # 22 instructions; each sample counts the instructions since the one before, so
+    # only the instructions after the last sample are missing
+    assert 22 - 2 * 4 < sum(profiler.counts) <= 22
+    # Calls are followed between samples
+    assert [(target, calls) for target, calls, _, _ in profiler.subroutines()] == [(0x20, 3), (0x30, 3)]
+
+
+def test_profiler_open_frames_and_interrupts(tmp_path):
+    profiler = Profiler()
+    z80 = Z80()
+    z80.memory.load([0xED, 0x56, 0xFB, 0x76])  # im 1; ei; halt
+    z80.memory.load([0xC3, 0x38, 0x00], 0x38)  # 0038h: jp 0038h
+    z80.stack_pointer.set_contents_value(0xFF00)
+    z80.schedule_interrupt(100)
+    z80.run(tstates=200, profiler=profiler)
+    assert [(target, calls) for target, calls, _, _ in profiler.subroutines()] == [(0x38, 1)]
+    _, _, inclusive, exclusive = profiler.subroutines()[0]
+    assert inclusive == z80.tstates - profiler.frames[1].start_tstates
+    assert exclusive == sum(profiler.tstates[0x38:0x3B])
+    path = str(tmp_path / "profile.folded")
+    profiler.write_folded(path)
+    with open(path) as f:
+        assert f.read().splitlines() == profiler.folded_stacks()
+    assert profiler.folded_stacks()[-1].startswith("root;0038 ")
+
+
+def test_profiler_interval_short_loop():
+    program = [
+        0x06, 0x00,  # ld b,0
+        0x80,        # loop: add a,b
+        0x10, 0xFD,  # djnz loop
+    ]
+    for interval in [1, 2]:
+        profiler = Profiler(interval=interval, seed=2)
+        z80 = Z80()
+        z80.memory.load(program)
+        z80.run(code_end=len(program), profiler=profiler)
+        if interval == 1:
+            assert (profiler.counts[2], profiler.counts[3]) == (256, 256)
+        else:
+            # A loop of two instructions is not aliased onto one of them
+            assert 192 < profiler.counts[2] < 320 and 192 < profiler.counts[3] < 320
+
+
+def test_profiler_call_to_next_instruction():
+    profiler = Profiler()
+    z80 = Z80()
+    z80.memory.load([
+        0x31, 0x00, 0xFF,  # ld sp,0ff00h
+        0xCD, 0x06, 0x00,  # call 0006h, the next instruction, to push the pc
+        0xE1,              # 0006h: pop hl
+        0xC3, 0x00, 0x01,  # jp 0100h
+    ])
+    z80.run(code_end=0x100, profiler=profiler)
+    assert z80.HL.get_contents() == 0x06
+    assert [(target, calls) for target, calls, _, _ in profiler.subroutines()] == [(0x06, 1)]
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from z80 import Z80
+from cow import CowMemory
+from screen import (
+    render, render_memory, flash_phase, ScreenRenderer, PALETTE, SCREEN_START, SCREEN_LENGTH,
+    BITMAP_LENGTH, ATTRIBUTES_START
+)
+
+
+def reference_pixel(data, x, y, flash):
+    offset = ((y & 0xC0) << 5) | ((y & 0x07) << 8) | ((y & 0x38) << 2) | (x >> 3)
+    attribute = data[BITMAP_LENGTH + (y >> 3) * 32 + (x >> 3)]
+    bright = 8 if attribute & 0x40 else 0
+    ink = (attribute & 0x07) + bright
+    paper = ((attribute >> 3) & 0x07) + bright
+    if flash and attribute & 0x80:
+        ink, paper = paper, ink
+    bit = (data[offset] >> (7 - (x & 7))) & 1
+    return tuple(PALETTE[ink if bit else paper])
+
+
+def test_render_matches_reference():
+    rng = random.Random(1)
+    data = bytes(rng.randrange(256) for _ in range(SCREEN_LENGTH))
+    for flash in [0, 1]:
+        frame = render(data, flash)
+        assert frame.shape == (192, 256, 3)
+        for _ in range(2000):
+            x, y = rng.randrange(256), rng.randrange(192)
+            assert tuple(frame[y, x]) == reference_pixel(data, x, y, flash), (x, y, flash)
+
+
+def test_render_memory():
+    z80 = Z80()
+    # Top left pixel set, ink 2 on paper 7, bottom right cell bright and flashing
+    z80.memory.set_contents_value(SCREEN_START, 0x80)
+    z80.memory.set_contents_value(SCREEN_START + BITMAP_LENGTH, 0x3A)
+    z80.memory.set_contents_value(SCREEN_START + SCREEN_LENGTH - 1, 0xC1)
+    frame = render_memory(z80.memory)
+    assert tuple(frame[0, 0]) == (0xD7, 0x00, 0x00)
+    assert tuple(frame[0, 1]) == (0xD7, 0xD7, 0xD7)
+    assert tuple(frame[191, 255]) == (0x00, 0x00, 0x00)
+    assert tuple(render_memory(z80.memory, flash_phase(16))[191, 255]) == (0x00, 0x00, 0xFF)
+
+    memory = CowMemory()
+    memory.load(z80.memory.read_block(SCREEN_START, SCREEN_LENGTH), SCREEN_START)
+    assert (render_memory(memory) == frame).all()
+
+
+def test_incremental_render():
+    rng = random.Random(2)
+    z80 = Z80()
+    z80.memory.load(bytes(rng.randrange(256) for _ in range(SCREEN_LENGTH)), SCREEN_START)
+    renderer = ScreenRenderer(z80.memory)
+    assert (renderer.render() == render_memory(z80.memory)).all()
+    assert len(renderer.dirty_cells()) == 0
+
+    # Pixel row 1 of the top left cell, and the attribute of cell (row 2, column 3)
+    z80.memory.set_contents_value(SCREEN_START + 0x100, 0xFF)
+    z80.memory.set_contents_value(ATTRIBUTES_START + 2 * 32 + 3, 0x47)
+    z80.memory.set_contents_value(SCREEN_START - 1, 1)
+    assert list(renderer.dirty_cells()) == [0, 67]
+    assert (renderer.render() == render_memory(z80.memory)).all()
+
+    for frame in range(40):
+        for _ in range(rng.randrange(20)):
+            z80.memory.set_contents_value(rng.randrange(SCREEN_START, SCREEN_START + SCREEN_LENGTH), rng.randrange(256))
+        flash = flash_phase(frame * 4)
+        assert (renderer.render(flash) == render_memory(z80.memory, flash)).all(), frame
+
+    renderer.close()
+    z80.memory.set_contents_value(SCREEN_START, 0)
+    assert len(renderer.dirty_cells()) == 0
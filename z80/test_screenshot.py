@@ -0,0 +1,51 @@
+import os
+import struct
+import zlib
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from screen import render, SCREEN_LENGTH
+from screenshot import encode_png, read_screen, screenshot_directory
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(__file__), "..", "zx_image", "testData", "testSnapshot.sna")
+
+
+def decode_png(data):
+    assert data[:8] == b"\x89PNG\r\n\x1a\n"
+    position = 8
+    chunks = {}
+    while position < len(data):
+        length, = struct.unpack_from(">I", data, position)
+        kind = data[position + 4:position + 8]
+        body = data[position + 8:position + 8 + length]
+        crc, = struct.unpack_from(">I", data, position + 8 + length)
+        assert crc == zlib.crc32(kind + body)
+        chunks[kind] = body
+        position += 12 + length
+    width, height = struct.unpack_from(">II", chunks[b"IHDR"])
+    rows = np.frombuffer(zlib.decompress(chunks[b"IDAT"]), dtype=np.uint8).reshape(height, width * 3 + 1)
+    assert not rows[:, 0].any()
+    return rows[:, 1:].reshape(height, width, 3)
+
+
+def test_encode_png():
+    frame = render(bytes(range(256)) * 27)
+    assert (decode_png(encode_png(frame)) == frame).all()
+
+
+def test_screenshot_directory(tmp_path):
+    with open(SNAPSHOT_PATH, "rb") as f:
+        screen = f.read()[27:27 + SCREEN_LENGTH]
+    (tmp_path / "in").mkdir()
+    (tmp_path / "in" / "game.scr").write_bytes(screen)
+    (tmp_path / "in" / "bad.sna").write_bytes(bytes(10))
+    (tmp_path / "in" / "notes.txt").write_bytes(b"")
+    assert read_screen(SNAPSHOT_PATH) == screen
+
+    count, errors, _ = screenshot_directory(str(tmp_path / "in"), str(tmp_path / "out"), workers=2)
+    assert count == 1
+    assert [path.endswith("bad.sna") for path, _ in errors] == [True]
+    assert [p.name for p in (tmp_path / "out").iterdir()] == ["game.png"]
+    assert (decode_png((tmp_path / "out" / "game.png").read_bytes()) == render(screen)).all()
@@ -0,0 +1,135 @@
+import pytest
+
+from z80 import Z80
+from paging import PagedMemory
+from snapshot import SNA_HEADER, SNA_LENGTH, Z80_HEADER, compress, decompress_into
+
+
+def sna_z80():
+    z80 = Z80()
+    for name, value in [("HL'", 0x1122), ("DE'", 0x3344), ("BC'", 0x5566), ("AF'", 0x7788), ("HL", 0x99AA),
+                        ("DE", 0xBBCC), ("BC", 0xDDEE), ("IY", 0x5C3A), ("IX", 0xFEDC), ("AF", 0x1234)]:
+        z80.registers_by_name[name].set_contents_value(value)
+    z80.I.set_contents(0x3F)
+    z80.R.set_contents(0x55)
+    z80.IFF1 = z80.IFF2 = 1
+    z80.interrupt_mode = 1
+    z80.stack_pointer.set_contents_value(0xFF00)
+    z80.program_counter.set_contents_value(0x8123)
+    z80.memory.load(range(256), start=0x9000)
+    return z80
+
+
+def test_save_and_load_sna(tmp_path):
+    path = tmp_path / "test.sna"
+    saved = sna_z80()
+    saved.save_sna(path, border=2)
+    data = path.read_bytes()
+    assert len(data) == SNA_LENGTH
+    fields = SNA_HEADER.unpack(data[:SNA_HEADER.size])
+    assert fields[0] == 0x3F
+    assert fields[10] == 0x04
+    assert fields[13] == 0xFEFE
+    assert fields[15] == 2
+    # The program counter is pushed in the file but not in saved
+    assert saved.stack_pointer.get_contents() == 0xFF00
+    assert saved.memory.get_contents_value(0xFEFE) == 0
+
+    loaded = Z80.from_sna(path)
+    assert loaded.sna_border == 2
+    for name, register in saved.registers_by_name.items():
+        assert loaded.registers_by_name[name].get_contents() == register.get_contents(), name
+    assert loaded.program_counter.get_contents() == 0x8123
+    assert (loaded.IFF1, loaded.IFF2, loaded.interrupt_mode) == (1, 1, 1)
+    assert loaded.memory.read_block(0x9000, 256) == bytes(range(256))
+    assert loaded.memory.read_block(0, 16384) == bytes(16384)
+
+
+def test_load_sna_into_paged_memory(tmp_path):
+    path = tmp_path / "test.sna"
+    sna_z80().save_sna(path)
+    z80 = Z80(memory=PagedMemory(8))
+    z80.load_sna(path)
+    assert z80.memory.banks[2][0x1000:0x1100] == bytes(range(256))
+    assert z80.program_counter.get_contents() == 0x8123
+
+
+def test_load_sna_wrong_length(tmp_path):
+    path = tmp_path / "short.sna"
+    path.write_bytes(bytes(SNA_LENGTH - 1))
+    with pytest.raises(Exception):
+        Z80().load_sna(path)
+    path.write_bytes(bytes(SNA_LENGTH + 1))
+    with pytest.raises(Exception):
+        Z80().load_sna(path)
+
+
+def test_compress_round_trip():
+    data = bytes([1, 0xED, 0, 0, 0, 0, 0, 0, 0xED, 0xED, 2, 2, 2, 2, 2, 2]) + bytes(600)
+    compressed = compress(data)
+    assert compressed.startswith(bytes([1, 0xED, 0, 0xED, 0xED, 5, 0, 0xED, 0xED, 2, 0xED, 0xED, 0xED, 6, 2]))
+    view = bytearray(len(data))
+    assert decompress_into(compressed, memoryview(view)) == len(compressed)
+    assert bytes(view) == data
+
+
+def test_load_z80_version_1(tmp_path):
+    path = tmp_path / "v1.z80"
+    header = bytearray(Z80_HEADER.size)
+    header[0] = 0x12  # A
+    header[6:8] = bytes([0x34, 0x80])  # PC
+    header[8:10] = bytes([0x00, 0xFF])  # SP
+    header[11] = 0x05  # R
+    header[12] = 0x01 | (3 << 1) | 0x20  # R bit 7, border 3, compressed
+    header[27] = header[28] = 1
+    header[29] = 2  # IM 2
+    ram = bytearray(48 * 1024)
+    ram[0x1000:0x1003] = b"\x01\x02\x03"
+    path.write_bytes(bytes(header) + compress(bytes(ram)) + b"\x00\xed\xed\x00")
+
+    z80 = Z80()
+    assert z80.load_z80(path) == 3
+    assert z80.A.get_contents() == 0x12
+    assert z80.program_counter.get_contents() == 0x8034
+    assert z80.stack_pointer.get_contents() == 0xFF00
+    assert z80.R.get_contents() == 0x85
+    assert (z80.IFF1, z80.IFF2, z80.interrupt_mode) == (1, 1, 2)
+    assert z80.memory.read_block(0x5000, 4) == b"\x01\x02\x03\x00"
+
+    paged = Z80(memory=PagedMemory(4))
+    paged.load_z80(path)
+    assert paged.memory.read_block(0x5000, 4) == b"\x01\x02\x03\x00"
+
+
+def test_save_and_load_z80(tmp_path):
+    path = tmp_path / "test.z80"
+    saved = sna_z80()
+    saved.memory.load(bytes(range(256)) * 64, start=0x4000)
+    saved.save_z80(path, border=5)
+    assert path.stat().st_size < 48 * 1024
+
+    loaded = Z80()
+    assert loaded.load_z80(path) == 5
+    for name, register in saved.registers_by_name.items():
+        assert loaded.registers_by_name[name].get_contents() == register.get_contents(), name
+    assert loaded.program_counter.get_contents() == 0x8123
+    assert (loaded.IFF1, loaded.IFF2, loaded.interrupt_mode) == (1, 1, 1)
+    assert loaded.memory.read_block(0x4000, 0xC000) == saved.memory.read_block(0x4000, 0xC000)
+
+
+def test_save_and_load_z80_128k(tmp_path):
+    path = tmp_path / "128.z80"
+    saved = Z80(memory=PagedMemory(10))
+    for bank in range(8):
+        saved.memory.load_bank(bank, [bank + 1] * 10)
+    saved.memory.map_bank(3, 6)
+    saved.save_z80(path)
+
+    loaded = Z80(memory=PagedMemory(10))
+    loaded.load_z80(path)
+    assert loaded.memory.page_banks[1:] == [5, 2, 6]
+    for bank in range(8):
+        assert loaded.memory.banks[bank][:11] == bytes([bank + 1] * 10 + [0])
+
+    with pytest.raises(Exception):
+        Z80().load_z80(path)
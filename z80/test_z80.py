@@ -1,7 +1,7 @@
 import pytest
 
-from z80 import Z80
-from instructions import SPECIAL_ARGS
+from z80 import Z80, HANDLER_NAMES
+from instructions import SPECIAL_ARGS, parse_time
 
 from base import (
     SIGN_FLAG, ZERO_FLAG, HALF_CARRY_FLAG, PARITY_OVERFLOW_FLAG, ADD_SUBTRACT_FLAG, CARRY_FLAG,
@@ -37,6 +37,175 @@ def test_read_memory_and_increment_pc():
     assert z80.program_counter.get_contents() == 1
 
 
+def test_opcode_tables():
+    z80 = Z80()
+    for opcode, instruction in z80.instructions_by_opcode.items():
+        prefix = opcode.rstrip("0123456789")
+        if prefix != opcode:
+            assert z80.instructions_by_prefix[prefix][int(opcode[len(prefix):])] is instruction
+    assert z80.base_instructions[203] is None
+    assert z80.ed_instructions[0] is None
+
+
+def test_decode_instruction():
+    z80 = Z80()
+    z80.memory.load([203, 7, 221, 9, 221, 0, 237, 176, 253, 203, 5, 6])
+    z80.program_counter.set_contents_value(0)
+    assert z80.decode_instruction()[0].text == "rlc a"
+    assert z80.decode_instruction()[0].text == "add ix,bc"
+    assert z80.decode_instruction()[0].text == "nop"
+    assert z80.decode_instruction()[0].text == "ldir"
+    assert z80.decode_instruction()[0].instruction_base == "FDCB"
+    assert z80.program_counter.get_contents() == 10
+
+    z80.memory.load([237, 0])
+    z80.program_counter.set_contents_value(0)
+    with pytest.raises(Exception):
+        z80.decode_instruction()
+
+
+def test_parse_time():
+    assert parse_time("4") == (4, 4)
+    assert parse_time("21/16") == (21, 16)
+
+
+def test_tstates():
+    z80 = Z80()
+    z80.memory.load([221, 0, 237, 176, 32, 2])  # nop with ignored dd prefix, ldir, jr nz,2
+    z80.program_counter.set_contents_value(0)
+    z80.BC.set_contents_value(3)
+    z80.HL.set_contents_value(0x8000)
+    z80.DE.set_contents_value(0x9000)
+    z80.run(code_end=2)
+    assert z80.tstates == 8
+    z80.run(code_end=4)
+    assert z80.tstates == 8 + 21 + 21 + 16
+    z80.F.set_flag(ZERO_FLAG)
+    z80.run(code_end=6)
+    assert z80.tstates == 8 + 58 + 7
+
+
+def block_instruction_z80(opcode, bc, hl, de, a=0, per_iteration=False, listener=False):
+    z80 = Z80()
+    z80.memory.load([(address * 7) % 251 for address in range(0x1000)], start=0x8000)
+    z80.memory.load([237, opcode])
+    z80.program_counter.set_contents_value(0)
+    z80.BC.set_contents_value(bc)
+    z80.HL.set_contents_value(hl)
+    z80.DE.set_contents_value(de)
+    z80.A.set_contents(a)
+    z80.repeat_per_iteration = per_iteration
+    if listener:
+        z80.memory.add_write_listener(lambda start, length: None)
+    return z80
+
+
+def block_instruction_state(z80):
+    registers = {name: register.get_contents() for name, register in z80.registers_by_name.items()}
+    return registers, z80.memory.dump(), z80.tstates
+
+
+@pytest.mark.parametrize("opcode, bc, hl, de, a", [
+    (176, 3000, 0x8000, 0xA000, 0),  # ldir
+    (176, 3000, 0x8000, 0x8001, 0),  # ldir, overlapping fill
+    (184, 3000, 0x8FFF, 0x9FFF, 0),  # lddr
+    (177, 3000, 0x8000, 0, 250),     # cpir, found
+    (177, 300, 0x8000, 0, 255),      # cpir, not found
+    (185, 3000, 0x8FFF, 0, 250),     # cpdr, found
+])
+def test_block_instruction_modes_agree(opcode, bc, hl, de, a):
+    fast = block_instruction_z80(opcode, bc, hl, de, a)
+    fast.run(code_end=2)
+    slow = block_instruction_z80(opcode, bc, hl, de, a, listener=True)
+    slow.run(code_end=2)
+    stepped = block_instruction_z80(opcode, bc, hl, de, a, per_iteration=True)
+    while stepped.program_counter.get_contents() < 2:
+        stepped.run(code_end=2)
+    assert block_instruction_state(fast) == block_instruction_state(slow)
+    assert block_instruction_state(fast) == block_instruction_state(stepped)
+
+
+def test_ldir_tstates():
+    z80 = block_instruction_z80(176, 3000, 0x8000, 0xA000)
+    z80.run(code_end=2)
+    assert z80.tstates == 21 * 2999 + 16
+    assert z80.memory.read_block(0xA000, 3000) == z80.memory.read_block(0x8000, 3000)
+
+
+def test_repeat_per_iteration_budget():
+    z80 = block_instruction_z80(176, 1000, 0x8000, 0xA000, per_iteration=True)
+    z80.run(tstates=100)
+    assert z80.BC.get_contents() == 995
+    assert z80.program_counter.get_contents() == 0
+    assert z80.tstates == 21 * 5
+
+
+def test_io_port_addresses():
+    z80 = Z80()
+    reads = []
+    writes = []
+    z80.io.add_read_handler(0, lambda address: reads.append(address) or 0x55, mask=0)
+    z80.io.add_write_handler(0, lambda address, value: writes.append((address, value)), mask=0)
+    # ld a,12h; in a,(0FEh); ld bc,3456h; out (c),a; ld hl,8000h; ini; outd
+    z80.memory.load([0x3E, 0x12, 0xDB, 0xFE, 0x01, 0x56, 0x34, 0xED, 0x79, 0x21, 0x00, 0x80, 0xED, 0xA2, 0xED, 0xAB])
+    z80.run(code_end=16)
+    assert reads == [0x12FE, 0x3456]
+    assert writes == [(0x3456, 0x55), (0x3256, 0)]
+    assert z80.memory.get_contents_value(0x8000) == 0x55
+    assert z80.ports.dump() == [0] * 256
+
+
+def test_cp_undocumented_bits_from_operand():
+    z80 = Z80()
+    reads = []
+    z80.io.add_read_handler(0, lambda address: reads.append(address) or 0, mask=0)
+    z80.memory.load([0xFE, 0x28])  # cp 28h
+    z80.run(code_end=2)
+    assert z80.F.get_contents() & 0x28 == 0x28
+    assert reads == []
+
+
+def test_instructions_bound_to_handlers():
+    z80 = Z80()
+    unhandled = set()
+    for instruction in z80.instructions_by_opcode.values():
+        if HANDLER_NAMES[instruction.execute_index] == "nop_execute":
+            unhandled.add(instruction.instruction_base)
+    assert unhandled == {"nop", "DDCB", "FDCB"}
+
+    def undocumented_name(text):
+        index = z80.instructions_by_text[text].undocumented_index
+        return None if index is None else HANDLER_NAMES[index]
+
+    assert undocumented_name("ldd") == "load_dec_undocumented"
+    assert undocumented_name("bit 0,(ix+*)") == "indexed_bit_undocumented"
+    assert undocumented_name("sub b") == "accumulator_undocumented"
+    assert undocumented_name("ld b,*") is None
+    assert len(z80.handlers) == len(HANDLER_NAMES)
+    for name, handler in zip(HANDLER_NAMES, z80.handlers):
+        assert handler == getattr(z80, name)
+
+
+def test_subclass_overrides_execute_method():
+    class CountingZ80(Z80):
+        def __init__(self):
+            super().__init__()
+            self.adds = 0
+
+        def add_execute(self, instruction, substituted_left_arg, substituted_right_arg):
+            self.adds += 1
+            super().add_execute(instruction, substituted_left_arg, substituted_right_arg)
+
+    z80 = CountingZ80()
+    z80.memory.load([0x3E, 0x01, 0x87, 0x87])  # ld a,1; add a,a; add a,a
+    z80.run(code_end=4)
+    assert z80.adds == 2 and z80.A.get_contents() == 4
+    plain = Z80()
+    plain.memory.load([0x3E, 0x01, 0x87, 0x87])
+    plain.run(code_end=4)
+    assert plain.A.get_contents() == 4
+
+
 def test_run_nop():
     z80 = Z80()
     z80.program_counter.set_contents_value(0)
@@ -178,6 +347,8 @@ def test_load_execute_instruction():
     z80.memory.load([4, 11])
     z80.execute_instruction(instruction)
     assert z80.registers_by_name["BC"].get_contents() == 2820
+    assert z80.registers_by_name["B"].get_contents() == 11
+    assert z80.registers_by_name["C"].get_contents() == 4
     assert z80.program_counter.get_contents() == 2
 
     z80.program_counter.set_contents_value(0)
@@ -1,32 +1,100 @@
 from sre_constants import NEGATE
 from types import DynamicClassAttribute
 from base import (
-    Component, Memory, DoubleComponent, SIGN_FLAG, ZERO_FLAG, HALF_CARRY_FLAG, PARITY_OVERFLOW_FLAG, ADD_SUBTRACT_FLAG, CARRY_FLAG, PARITY
+    Component, Memory, IOBus, DoubleComponent, SIGN_FLAG, ZERO_FLAG, HALF_CARRY_FLAG, PARITY_OVERFLOW_FLAG, ADD_SUBTRACT_FLAG, CARRY_FLAG, PARITY
 )
 from instructions import (
-    CONVERT_CARRY_FLAG, instructions_by_opcode, instructions_by_text, NO_OPERATION, SPECIAL_ARGS, LOAD,
+    CONVERT_CARRY_FLAG, instructions_by_opcode, instructions_by_text, instructions_by_prefix, NO_OPERATION, SPECIAL_ARGS, LOAD,
     EXCHANGE, EXCHANGE_MULTI, ADD, INSTRUCTION_FLAG_POSITIONS, SUB, ADC, SBC, INC, DEC,
-    PUSH, POP, JUMP, JUMP_RELATIVE, JUMP_INSTRUCTIONS, DEC_JUMP_RELATIVE, CALL, COMPARE,
+    PUSH, POP, JUMP, JUMP_RELATIVE, DEC_JUMP_RELATIVE, CALL, COMPARE,
     COMPARE_INC, COMPARE_INC_REPEAT, COMPARE_DEC, COMPARE_DEC_REPEAT, COMPLEMENT, NEGATION,
     LOAD_INC, LOAD_DEC, LOAD_INC_REPEAT, LOAD_DEC_REPEAT, AND, OR, XOR, DAA, RETURN, BIT, IN,
     OUT, OUT_INC, OUT_INC_REPEAT, OUT_DEC, OUT_DEC_REPEAT, IN_INC, IN_INC_REPEAT, IN_DEC, 
     IN_DEC_REPEAT, ROT_LEFT, ROT_LEFT_ACC, ROT_LEFT_C, ROT_LEFT_C_ACC, ROT_LEFT_DEC, ROT_RIGHT,
     ROT_RIGHT_ACC, ROT_RIGHT_C, ROT_RIGHT_C_ACC, ROT_RIGHT_DEC, SHIFT_LEFT_A, SHIFT_LEFT_L, 
     SHIFT_RIGHT_A, SHIFT_RIGHT_L, CONVERT_CARRY_FLAG, SET_CARRY_FLAG, RESTART, RESET, SET, DDCB,
-    RETURN_NMI, RETURN_INTERRUPT, FDCB
+    RETURN_NMI, RETURN_INTERRUPT, FDCB, HALT, DISABLE_INTERRUPTS, ENABLE_INTERRUPTS, INTERRUPT_MODE,
+    instructions
 )
+from operands import compile_instructions
+from blocks import BlockCache, operand_length
+from snapshot import load_sna, save_sna, load_z80, save_z80
+from checkpoint import checkpoint, restore, cpu_state, set_cpu_state
+from bus_trace import BusTrace, DEFAULT_CAPACITY
+from alu import (
+    ADD_TABLE, SUB_TABLE, INC_TABLE, DEC_TABLE, LOGIC_FLAGS_TABLE, alu_index, compile_flag_template
+)
+
+
+compile_instructions(instructions)
+
+INTERPRETER_ENGINE = "interpreter"
+BLOCK_ENGINE = "block"
+
+# A DD or FD prefix that does not change the following opcode costs a 4 T-state nop
+IGNORED_PREFIX_TSTATES = 4
+
+# Value read from the data bus during an interrupt acknowledge when no device drives it
+DEFAULT_DATA_BUS = 0xFF
+NMI_ADDRESS = 0x66
+IM1_ADDRESS = 0x38
+NMI_TSTATES = 11
+IM1_TSTATES = 13
+IM2_TSTATES = 19
+# In IM 0 the instruction on the data bus (usually rst) takes 2 T-states longer than normal
+IM0_ACKNOWLEDGE_TSTATES = 2
+# While halted the Z80 executes nops
+HALT_NOP_TSTATES = 4
 
 
 class Z80():
 
     MEMORY_SIZE = 256 * 256
 
-    def __init__(self, memory_size=MEMORY_SIZE):
-        self.memory = Memory(memory_size)
+    def __init__(self, memory_size=MEMORY_SIZE, memory=None):
+        '''
+        memory can be given instead of memory_size to use another Memory, such as a
+        paging.PagedMemory
+        '''
+        if memory is None:
+            memory = Memory(memory_size)
+        self.memory = memory
         self.ports = Memory(256)
+        self.io = IOBus(self.ports)
         self._define_registers()
         self.instructions_by_opcode = instructions_by_opcode
         self.instructions_by_text = instructions_by_text
+        self.instructions_by_prefix = instructions_by_prefix
+        self.base_instructions = instructions_by_prefix[""]
+        self.cb_instructions = instructions_by_prefix["CB"]
+        self.ed_instructions = instructions_by_prefix["ED"]
+        self.dd_instructions = instructions_by_prefix["DD"]
+        self.fd_instructions = instructions_by_prefix["FD"]
+        self.ddcb_instructions = instructions_by_prefix[DDCB]
+        self.fdcb_instructions = instructions_by_prefix[FDCB]
+        # The execute and undocumented methods of this Z80, indexed by
+        # Instruction.execute_index and undocumented_index. Bound per instance so
+        # subclasses can override them
+        self.handlers = [getattr(self, name) for name in HANDLER_NAMES]
+        self.block_cache = None
+        self.bus_trace = None
+        self.tstates = 0
+        self.tstates_limit = float("inf")
+        # When set, ldir, cpir, inir, otir etc. do one iteration per execution and move
+        # the program counter back to repeat, so a T-state budget can stop them part way
+        self.repeat_per_iteration = False
+        self.interrupt_mode = 0
+        self.halted = False
+        self.interrupt_pending = False
+        self.interrupt_data_bus = DEFAULT_DATA_BUS
+        self.nmi_pending = False
+        # Set by ei so no interrupt is accepted until after the next instruction
+        self.interrupt_delay = False
+        # Set when something needs looking at between instructions (see service_interrupts)
+        self.interrupt_check = False
+        # (tstates, data bus) pairs in T-state order, see schedule_interrupt
+        self.scheduled_interrupts = []
+        self.next_interrupt_tstates = float("inf")
 
     def _define_registers(self):
         self.A = Component("A")
@@ -115,6 +183,79 @@ class Z80():
 
         self.registers_by_name = {reg.name: reg for reg in self.registers}
 
+    @classmethod
+    def from_sna(cls, path):
+        '''
+        A Z80 restored from a 48K .sna file. The border colour is in z80.sna_border.
+        '''
+        z80 = cls()
+        z80.sna_border = z80.load_sna(path)
+        return z80
+
+    def load_sna(self, path):
+        '''
+        Restores registers, interrupt state and RAM from a 48K .sna file, returning
+        the border colour (see snapshot.py)
+        '''
+        return load_sna(self, path)
+
+    def save_sna(self, path, border=0):
+        save_sna(self, path, border)
+
+    def load_z80(self, path):
+        '''
+        Restores the Z80 from a version 1, 2 or 3 .z80 file, returning the border
+        colour. 128K snapshots need a paging.PagedMemory.
+        '''
+        return load_z80(self, path)
+
+    def save_z80(self, path, border=0):
+        save_z80(self, path, border)
+
+    def checkpoint(self, incremental=False):
+        '''
+        The complete state of the Z80 as bytes, for restore. An incremental checkpoint
+        only has the memory pages written since the last checkpoint, and needs
+        self.memory.track_dirty_pages() (see checkpoint.py).
+        '''
+        return checkpoint(self, incremental)
+
+    def restore(self, data):
+        restore(self, data)
+
+    def start_bus_trace(self, capacity=DEFAULT_CAPACITY):
+        '''
+        Starts recording memory and port accesses into a ring buffer of the newest
+        capacity events, returning the BusTrace (see bus_trace.py)
+        '''
+        if self.bus_trace is None:
+            self.bus_trace = BusTrace(self, capacity)
+            self.bus_trace.start()
+        return self.bus_trace
+
+    def stop_bus_trace(self):
+        '''
+        Stops recording, returning the BusTrace with the events recorded
+        '''
+        trace = self.bus_trace
+        if trace is not None:
+            trace.stop()
+            self.bus_trace = None
+        return trace
+
+    def clone(self):
+        '''
+        A Z80 in the same state that runs independently of this one. Memory is copied
+        with memory.clone(), so a cow.CowMemory shares its pages with the clone until
+        they are written. I/O handlers are not copied.
+        '''
+        z80 = Z80(memory=self.memory.clone())
+        z80.ports.load(self.ports.read_block(0, self.ports.size))
+        set_cpu_state(z80, cpu_state(self))
+        z80.scheduled_interrupts = list(self.scheduled_interrupts)
+        z80.next_interrupt_tstates = self.next_interrupt_tstates
+        return z80
+
     def read_memory_and_increment_pc(self):
         memory_contents = self.memory.get_contents_value(self.program_counter.get_contents())
         if self.program_counter.get_contents() < self.MEMORY_SIZE - 1:
@@ -127,232 +268,374 @@ class Z80():
     def dd_opcode(self):
         opcode2, end_of_memory_reached = self.read_memory_and_increment_pc()
         if opcode2 == 253:
+            self.tstates += IGNORED_PREFIX_TSTATES
             return self.fd_opcode()
         elif opcode2 == 203:
-            opcode = "DDCB" 
-        elif "DD" + str(opcode2) not in self.instructions_by_opcode:
-            opcode = opcode2
-        else:
-            opcode = "DD" + str(opcode2)
-        return opcode
+            return self.instructions_by_opcode[DDCB]
+        instruction = self.dd_instructions[opcode2]
+        if instruction is None:
+            self.tstates += IGNORED_PREFIX_TSTATES
+            return self.unprefixed_instruction(opcode2)
+        return instruction
 
     def fd_opcode(self):
         opcode2, end_of_memory_reached = self.read_memory_and_increment_pc()
         if opcode2 == 221:
+            self.tstates += IGNORED_PREFIX_TSTATES
             return self.dd_opcode()
         elif opcode2 == 203:
-            opcode = FDCB
-        elif "FD" + str(opcode2) not in self.instructions_by_opcode:
-            opcode = opcode2
+            return self.instructions_by_opcode[FDCB]
+        instruction = self.fd_instructions[opcode2]
+        if instruction is None:
+            self.tstates += IGNORED_PREFIX_TSTATES
+            return self.unprefixed_instruction(opcode2)
+        return instruction
+
+    def unprefixed_instruction(self, opcode):
+        instruction = self.base_instructions[opcode]
+        if instruction is None:
+            raise Exception("Opcode {} not recognised!!!".format(opcode))
+        return instruction
+
+    def decode_instruction(self):
+        opcode, end_of_memory_reached = self.read_memory_and_increment_pc()
+        if opcode == 203:
+            opcode2, end_of_memory_reached = self.read_memory_and_increment_pc()
+            instruction = self.cb_instructions[opcode2]
+        elif opcode == 237:
+            opcode2, end_of_memory_reached = self.read_memory_and_increment_pc()
+            instruction = self.ed_instructions[opcode2]
+            if instruction is None:
+                raise Exception("Opcode ED{} not recognised!!!".format(opcode2))
+        elif opcode == 221:
+            instruction = self.dd_opcode()
+        elif opcode == 253:
+            instruction = self.fd_opcode()
         else:
-            opcode = "FD" + str(opcode2)
-        return opcode
-        
-    def run(self, code_end=-1):
+            instruction = self.unprefixed_instruction(opcode)
+        return instruction, end_of_memory_reached
+
+    def run(self, code_end=-1, engine=INTERPRETER_ENGINE, tstates=None, tracer=None, profiler=None):
+        '''
+        engine is INTERPRETER_ENGINE, which decodes every instruction as it is reached,
+        or BLOCK_ENGINE, which runs cached translations of basic blocks (see blocks.py).
+
+        If tracer (an instruction_trace.InstructionTracer) is given, each instruction is
+        recorded in it. Traced runs always use the interpreter.
+
+        If profiler (a profiler.Profiler) is given, each instruction is counted in it.
+        Profiled runs always use the interpreter.
+
+        If tstates is given, stops after the instruction that takes self.tstates to
+        tstates or more above its value at the start of the run.
+
+        Interrupts raised with raise_int, raise_nmi or schedule_interrupt are accepted
+        between instructions. A run that reaches a halt with no interrupt scheduled to
+        end it returns, leaving self.halted set.
+        '''
+        if tstates is None:
+            self.tstates_limit = float("inf")
+        else:
+            self.tstates_limit = self.tstates + tstates
+        if tracer is not None:
+            self.run_traced(code_end, tracer)
+            return
+        if profiler is not None:
+            self.run_profiled(code_end, profiler)
+            return
+        if engine == BLOCK_ENGINE:
+            if self.block_cache is None:
+                self.block_cache = BlockCache(self, type(self).execute_instruction is Z80.execute_instruction)
+            self.block_cache.run(code_end)
+            return
+        if engine != INTERPRETER_ENGINE:
+            raise Exception("Unknown engine {}!!!".format(engine))
         end_of_memory_reached = False
         while not end_of_memory_reached:
-            opcode, end_of_memory_reached = self.read_memory_and_increment_pc()
-            if opcode == 203:
-                opcode2, end_of_memory_reached = self.read_memory_and_increment_pc()
-                opcode = "CB" + str(opcode2)
-            elif opcode == 237:
-                opcode2, end_of_memory_reached = self.read_memory_and_increment_pc()
-                opcode = "ED" + str(opcode2)
-            elif opcode == 221:
-                opcode = self.dd_opcode()
-            elif opcode == 253:
-                opcode = self.fd_opcode()
-            if str(opcode) not in self.instructions_by_opcode:
-                raise Exception("Opcode {} not recognised!!!".format(opcode))
-            instruction = self.instructions_by_opcode[str(opcode)]
+            if self.interrupt_check or self.tstates >= self.next_interrupt_tstates:
+                if not self.service_interrupts():
+                    return
+            instruction, end_of_memory_reached = self.decode_instruction()
             self.execute_instruction(instruction)
             if code_end > -1:
                 if self.program_counter.get_contents() >= code_end:
                     return
-        
-    def execute_instruction(self, instruction):
-        if instruction.instruction_base == NO_OPERATION:
-            pass
-        if instruction.instruction_base == DDCB:
-            extra_opcode = self.memory.get_contents_value(self.program_counter.get_contents() + 1)
-            instruction = self.instructions_by_opcode[DDCB + str(extra_opcode)]
-            substituted_left_arg = self.substitute_arg(instruction.left_arg, instruction.right_arg)
-            substituted_right_arg = self.substitute_right_arg(instruction.right_arg, instruction.left_arg, DDCB)
-        elif instruction.instruction_base == FDCB:
-            extra_opcode = self.memory.get_contents_value(self.program_counter.get_contents() + 1)
-            instruction = self.instructions_by_opcode[FDCB + str(extra_opcode)]
-            substituted_left_arg = self.substitute_arg(instruction.left_arg, instruction.right_arg)
-            if instruction.right_arg:
-                substituted_right_arg = self.substitute_arg(instruction.right_arg, instruction.left_arg, FDCB)
-            else:
-                _, _ = self.read_memory_and_increment_pc()
-                substituted_right_arg = None
-        elif instruction.instruction_base in JUMP_INSTRUCTIONS:
-            left_arg = instruction.left_arg
-            right_arg = instruction.right_arg
-            left_arg = left_arg.replace("(", "")
-            left_arg = left_arg.replace(")", "")
-            if  left_arg == "c":
-                 left_arg = "cf"
-            if right_arg:
-                right_arg = right_arg.replace("(", "")
-                right_arg = right_arg.replace(")", "")
-            else:
-                right_arg = left_arg
-                left_arg = None
-            substituted_left_arg = self.substitute_arg(left_arg, right_arg)
-            substituted_right_arg = self.substitute_right_arg(right_arg, left_arg)
-        elif instruction.instruction_base == RESTART:
-            substituted_left_arg = int(instruction.left_arg.replace("h", ""), 16)
-            substituted_right_arg = None
+            if self.tstates >= self.tstates_limit:
+                return
+
+    def run_traced(self, code_end, tracer):
+        '''
+        The interpreter loop of run, recording each instruction in tracer
+        '''
+        end_of_memory_reached = False
+        while not end_of_memory_reached:
+            if self.interrupt_check or self.tstates >= self.next_interrupt_tstates:
+                if not self.service_interrupts():
+                    return
+            pc = self.program_counter.get_contents()
+            instruction, end_of_memory_reached = self.decode_instruction()
+            length = self.program_counter.get_contents() - pc + operand_length(instruction)
+            opcode = self.memory.read_block(pc, length)
+            recorded = self.indexed_bit_instruction(instruction)
+            self.execute_instruction(instruction)
+            tracer.record(self, pc, opcode, recorded)
+            if code_end > -1:
+                if self.program_counter.get_contents() >= code_end:
+                    return
+            if self.tstates >= self.tstates_limit:
+                return
+
+    def run_profiled(self, code_end, profiler):
+        '''
+        The interpreter loop of run, counting each instruction in profiler
+        '''
+        try:
+            end_of_memory_reached = False
+            while not end_of_memory_reached:
+                if self.interrupt_check or self.tstates >= self.next_interrupt_tstates:
+                    stack_pointer = self.stack_pointer.get_contents()
+                    if not self.service_interrupts():
+                        return
+                    if self.stack_pointer.get_contents() == (stack_pointer - 2) & 0xFFFF:
+                        profiler.enter(self, self.program_counter.get_contents())
+                pc = self.program_counter.get_contents()
+                tstates = self.tstates
+                instruction, end_of_memory_reached = self.decode_instruction()
+                recorded = self.indexed_bit_instruction(instruction)
+                self.execute_instruction(instruction)
+                profiler.record(self, pc, recorded, self.tstates - tstates)
+                if code_end > -1:
+                    if self.program_counter.get_contents() >= code_end:
+                        return
+                if self.tstates >= self.tstates_limit:
+                    return
+        finally:
+            profiler.last_tstates = self.tstates
+
+    def raise_int(self, data_bus=DEFAULT_DATA_BUS):
+        '''
+        Requests a maskable interrupt. It stays pending until accepted, which needs IFF1
+        set. data_bus is what the interrupting device puts on the bus: the instruction
+        to run in IM 0 or the low byte of the vector address in IM 2.
+        '''
+        self.interrupt_pending = True
+        self.interrupt_data_bus = data_bus
+        self.interrupt_check = True
+
+    def raise_nmi(self):
+        self.nmi_pending = True
+        self.interrupt_check = True
+
+    def schedule_interrupt(self, tstates, data_bus=DEFAULT_DATA_BUS):
+        '''
+        Raises a maskable interrupt once self.tstates reaches tstates
+        '''
+        self.scheduled_interrupts.append((tstates, data_bus))
+        self.scheduled_interrupts.sort(key=lambda e: e[0])
+        self.next_interrupt_tstates = self.scheduled_interrupts[0][0]
+
+    def raise_scheduled_interrupts(self):
+        while self.scheduled_interrupts and self.scheduled_interrupts[0][0] <= self.tstates:
+            _, data_bus = self.scheduled_interrupts.pop(0)
+            self.raise_int(data_bus)
+        if self.scheduled_interrupts:
+            self.next_interrupt_tstates = self.scheduled_interrupts[0][0]
         else:
-            if instruction.instruction_base in [ROT_RIGHT_C_ACC, ROT_LEFT_ACC, ROT_LEFT_C_ACC, ROT_RIGHT_ACC, ROT_RIGHT_DEC]:
-                substituted_left_arg = self.A
-                substituted_right_arg = None
-            else:
-                substituted_left_arg = self.substitute_arg(instruction.left_arg, instruction.right_arg)
-                substituted_right_arg = self.substitute_right_arg(instruction.right_arg, instruction.left_arg)
-        self.execute_instruction_base(instruction, substituted_left_arg, substituted_right_arg)
-        self.undocumented_behaviour(instruction, substituted_left_arg, substituted_right_arg)
+            self.next_interrupt_tstates = float("inf")
+
+    def interrupt_acceptable(self):
+        return self.nmi_pending or (self.interrupt_pending and self.IFF1 == 1 and not self.interrupt_delay)
+
+    def service_interrupts(self):
+        '''
+        Called between instructions to accept pending interrupts and, while halted, to
+        wait for one. Returns False if the run should stop: halted with nothing that
+        ends the halt before the T-state budget runs out.
+        '''
+        while True:
+            self.raise_scheduled_interrupts()
+            if self.nmi_pending:
+                self.accept_nmi()
+            elif self.interrupt_delay:
+                self.interrupt_delay = False
+            elif self.interrupt_pending and self.IFF1 == 1:
+                self.accept_interrupt()
+            if not self.halted:
+                break
+            if not self.skip_halt():
+                return False
+        self.interrupt_check = self.nmi_pending or (self.interrupt_pending and self.IFF1 == 1)
+        return True
+
+    def skip_halt(self):
+        '''
+        Rather than running the nops of a halt one at a time, moves self.tstates on to
+        the next scheduled interrupt or the end of the T-state budget, whichever is
+        first. Returns False if there is neither.
+        '''
+        if self.interrupt_acceptable():
+            return True
+        if self.tstates >= self.tstates_limit:
+            return False
+        target = min(self.next_interrupt_tstates, self.tstates_limit)
+        if target == float("inf"):
+            return False
+        nops = -(-(target - self.tstates) // HALT_NOP_TSTATES)
+        self.tstates += nops * HALT_NOP_TSTATES
+        return True
 
-    def execute_instruction_base(self, instruction, substituted_left_arg, substituted_right_arg):
-        if instruction.instruction_base == NO_OPERATION:
+    def accept_nmi(self):
+        self.nmi_pending = False
+        self.halted = False
+        self.IFF1 = 0
+        self.push_execute(None, self.program_counter)
+        self.program_counter.set_contents_value(NMI_ADDRESS)
+        self.tstates += NMI_TSTATES
+
+    def accept_interrupt(self):
+        self.interrupt_pending = False
+        self.halted = False
+        self.IFF1 = 0
+        self.IFF2 = 0
+        if self.interrupt_mode == 0:
+            instruction = self.base_instructions[self.interrupt_data_bus]
+            if instruction is None or instruction.size > 1:
+                raise Exception("IM 0 data bus opcode {} not supported!!!".format(self.interrupt_data_bus))
+            self.execute_instruction(instruction)
+            self.tstates += IM0_ACKNOWLEDGE_TSTATES
             return
-        elif instruction.instruction_base == LOAD:
-            self.load_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == EXCHANGE_MULTI:
-            self.exchange_execute(self.registers_by_name["BC"], self.registers_by_name["BC'"])
-            self.exchange_execute(self.registers_by_name["DE"], self.registers_by_name["DE'"])
-            self.exchange_execute(self.registers_by_name["HL"], self.registers_by_name["HL'"])
-        elif instruction.instruction_base == EXCHANGE:
-            substituted_right_arg = self.substitute_arg(instruction.right_arg, instruction.left_arg)
-            self.exchange_execute(substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == ADD:
-            self.add_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == SUB:
-            self.sub_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == ADC:
-            substituted_right_arg += self.flag_register.get_flag(CARRY_FLAG)
-            self.add_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == SBC:
-            substituted_right_arg += self.flag_register.get_flag(CARRY_FLAG)
-            self.sub_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == INC:
-            self.add_execute(instruction, substituted_left_arg, 1)
-        elif instruction.instruction_base == DEC:
-            self.sub_execute(instruction, substituted_left_arg, 1)
-        elif instruction.instruction_base == PUSH:
-            self.push_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == POP:
-            self.pop_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == JUMP:
-            self.jump_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == JUMP_RELATIVE:
-            self.jump_relative_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == DEC_JUMP_RELATIVE:
-            self.dec_jump_relative_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == CALL:
-            self.call_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == RETURN:
-            self.return_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == RETURN_NMI:
-            self.return_nmi_execute(instruction)
-        elif instruction.instruction_base == RETURN_INTERRUPT:
-            self.return_interrupt_execute(instruction)
-        elif instruction.instruction_base == COMPARE:
-            self.compare_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == COMPARE_INC:
-            self.compare_inc_execute(instruction)
-        elif instruction.instruction_base == COMPARE_INC_REPEAT:
-            self.compare_inc_repeat_execute(instruction)
-        elif instruction.instruction_base == COMPARE_DEC:
-            self.compare_dec_execute(instruction)
-        elif instruction.instruction_base == COMPARE_DEC_REPEAT:
-            self.compare_dec_repeat_execute(instruction)
-        elif instruction.instruction_base == COMPLEMENT:
-            self.complement_execute(instruction)
-        elif instruction.instruction_base == NEGATION:
-            self.negation_execute(instruction)
-        elif instruction.instruction_base == LOAD_INC:
-            self.load_inc_execute(instruction)
-        elif instruction.instruction_base == LOAD_DEC:
-            self.load_dec_execute(instruction)
-        elif instruction.instruction_base == LOAD_INC_REPEAT:
-            self.load_inc_repeat_execute(instruction)
-        elif instruction.instruction_base == LOAD_DEC_REPEAT:
-            self.load_dec_repeat_execute(instruction)
-        elif instruction.instruction_base == AND:
-            self.and_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == OR:
-            self.or_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == XOR:
-            self.xor_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == DAA:
-            self.daa_execute(instruction)
-        elif instruction.instruction_base == BIT:
-            self.bit_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == IN:
-            self.in_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == IN_INC:
-            self.in_inc_execute(instruction)
-        elif instruction.instruction_base == IN_INC_REPEAT:
-            self.in_inc_repeat_execute(instruction)
-        elif instruction.instruction_base == IN_DEC:
-            self.in_dec_execute(instruction)
-        elif instruction.instruction_base == IN_DEC_REPEAT:
-            self.in_dec_repeat_execute(instruction)
-        elif instruction.instruction_base == OUT:
-            self.out_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == OUT_INC:
-            self.out_inc_execute(instruction)
-        elif instruction.instruction_base == OUT_INC_REPEAT:
-            self.out_inc_repeat_execute(instruction)
-        elif instruction.instruction_base == OUT_DEC:
-            self.out_dec_execute(instruction)
-        elif instruction.instruction_base == OUT_DEC_REPEAT:
-            self.out_dec_repeat_execute(instruction)
-        elif instruction.instruction_base == ROT_LEFT:
-            self.rot_left_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == ROT_LEFT_ACC:
-            self.rot_left_execute(instruction, self.A)
-        elif instruction.instruction_base == ROT_LEFT_C:
-            self.rot_left_c_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == ROT_LEFT_C_ACC:
-            self.rot_left_c_execute(instruction, self.A)
-        elif instruction.instruction_base == ROT_LEFT_DEC:
-            self.rot_left_dec_execute(instruction)
-        elif instruction.instruction_base == ROT_RIGHT:
-            self.rot_right_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == ROT_RIGHT_ACC:
-            self.rot_right_execute(instruction, self.A)
-        elif instruction.instruction_base == ROT_RIGHT_C:
-            self.rot_right_c_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == ROT_RIGHT_C_ACC:
-            self.rot_right_c_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == ROT_RIGHT_DEC:
-            self.rot_right_dec_execute(instruction)
-        elif instruction.instruction_base == SHIFT_LEFT_A:
-            self.shift_left_a_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == SHIFT_LEFT_L:
-            self.shift_left_l_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == SHIFT_RIGHT_A:
-            self.shift_right_a_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == SHIFT_RIGHT_L:
-            self.shift_right_l_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == CONVERT_CARRY_FLAG:
-            self.convert_carry_flag_execute(instruction)
-        elif instruction.instruction_base == SET_CARRY_FLAG:
-            self.set_carry_flag_execute(instruction)
-        elif instruction.instruction_base == RESTART:
-            self.restart_execute(instruction, substituted_left_arg)
-        elif instruction.instruction_base == RESET:
-            self.reset_execute(instruction, substituted_left_arg, substituted_right_arg)
-        elif instruction.instruction_base == SET:
-            self.set_execute(instruction, substituted_left_arg, substituted_right_arg)
+        self.push_execute(None, self.program_counter)
+        if self.interrupt_mode == 1:
+            self.program_counter.set_contents_value(IM1_ADDRESS)
+            self.tstates += IM1_TSTATES
+            return
+        vector = (self.I.get_contents() << 8) | self.interrupt_data_bus
+        low_byte = self.memory.get_contents_value(vector)
+        high_byte = self.memory.get_contents_value((vector + 1) & 0xFFFF)
+        self.program_counter.set_contents_value(self.convert_low_and_high_bytes_to_value(low_byte, high_byte))
+        self.tstates += IM2_TSTATES
+
+    def indexed_bit_instruction(self, instruction):
+        '''
+        The instruction a DDCB or FDCB pseudo instruction from decode_instruction stands
+        for, read from the opcode after its displacement. Other instructions are returned
+        as they are.
+        '''
+        if instruction.instruction_base == DDCB:
+            return self.ddcb_instructions[self.memory.get_contents_value(self.program_counter.get_contents() + 1)]
+        if instruction.instruction_base == FDCB:
+            return self.fdcb_instructions[self.memory.get_contents_value(self.program_counter.get_contents() + 1)]
+        return instruction
+
+    def execute_instruction(self, instruction):
+        if instruction.instruction_base == DDCB or instruction.instruction_base == FDCB:
+            instruction = self.indexed_bit_instruction(instruction)
+            substituted_left_arg = instruction.substitute_left_prefixed(self)
+            substituted_right_arg = instruction.substitute_right_prefixed(self)
+        else:
+            substituted_left_arg = instruction.substitute_left(self)
+            substituted_right_arg = instruction.substitute_right(self)
+        self.handlers[instruction.execute_index](instruction, substituted_left_arg, substituted_right_arg)
+        self.tstates += instruction.tstates_not_taken
+        if instruction.undocumented_index is not None:
+            self.handlers[instruction.undocumented_index](instruction, substituted_left_arg, substituted_right_arg)
+
+    def nop_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        return
+
+    def add_branch_taken_tstates(self, instruction):
+        '''
+        execute_instruction counts the not taken time, this adds the difference
+        '''
+        self.tstates += instruction.tstates - instruction.tstates_not_taken
+
+    def add_repeat_tstates(self, instruction):
+        '''
+        Counts an iteration of a block instruction that repeats; execute_instruction
+        counts the final one
+        '''
+        self.tstates += instruction.tstates
+
+    def repeat_execute(self, instruction, step, repeating):
+        '''
+        Runs step, one iteration of a block instruction, then keeps running it while
+        repeating() is true. With repeat_per_iteration set only one iteration is run and
+        the program counter is moved back onto the instruction if it repeats.
+        '''
+        step(instruction)
+        if self.repeat_per_iteration:
+            if repeating():
+                self.program_counter.subtract_from_contents(instruction.size)
+                self.add_branch_taken_tstates(instruction)
+            return
+        while repeating():
+            self.add_repeat_tstates(instruction)
+            step(instruction)
+
+    def bc_not_zero(self):
+        return self.BC.get_contents() != 0
+
+    def b_not_zero(self):
+        return self.B.get_contents() != 0
+
+    def compare_repeating(self):
+        return not self.flag_register.get_flag(ZERO_FLAG) and self.BC.get_contents() != 0
+
+    def skip_repeat_iterations(self, instruction, count, direction):
+        '''
+        Moves the registers on by count iterations of ldir/lddr/cpir/cpdr whose memory
+        work has already been done in bulk. The flags they would set are all set again by
+        the final iteration.
+        '''
+        self.HL.add_to_contents(count * direction)
+        if instruction.instruction_base in [LOAD_INC_REPEAT, LOAD_DEC_REPEAT]:
+            self.DE.add_to_contents(count * direction)
+        self.BC.subtract_from_contents(count)
+        self.tstates += count * instruction.tstates
+
+    def load_repeat_fast_path(self, instruction, direction):
+        '''
+        Copies all but the last byte of an ldir (direction 1) or lddr (-1) as one slice
+        when the memory allows it, leaving the last iteration to run as normal
+        '''
+        count = self.BC.get_contents() - 1
+        if count <= 0:
+            return
+        source = self.HL.get_contents()
+        destination = self.DE.get_contents()
+        if direction < 0:
+            source -= count - 1
+            destination -= count - 1
+        if self.memory.copy_block(source, destination, count):
+            self.skip_repeat_iterations(instruction, count, direction)
+
+    def compare_repeat_fast_path(self, instruction, direction):
+        '''
+        Finds the first byte matching A that cpir (direction 1) or cpdr (-1) would reach
+        in one search, and skips the iterations before it (or all but the last)
+        '''
+        count = self.BC.get_contents() - 1
+        if count <= 0:
+            return
+        hl = self.HL.get_contents()
+        if direction > 0:
+            found = self.memory.find(self.A.get_contents(), hl, hl + count)
+        else:
+            found = self.memory.rfind(self.A.get_contents(), hl - count + 1, hl + 1)
+        if found is None:
+            return
+        if found >= 0:
+            count = (found - hl) * direction
+        if count > 0:
+            self.skip_repeat_iterations(instruction, count, direction)
 
     def load_execute(self, instruction, substituted_left_arg, substituted_right_arg):
         if not isinstance(substituted_left_arg, tuple):
-            substituted_left_arg.set_contents(substituted_right_arg)
+            if substituted_left_arg.SIZE == 2:
+                # ld rr,** etc. must split the value over both halves
+                substituted_left_arg.set_contents_value(substituted_right_arg)
+            else:
+                substituted_left_arg.set_contents(substituted_right_arg)
             substituted_left_arg.set_potential_flags()
             self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         elif len(substituted_left_arg) == 2:
@@ -377,17 +660,66 @@ class Z80():
             raise Exception("Left arg subsititution has too many components")
         substituted_right_arg.set_contents(temp_substituted_left_arg_contents)
 
-    def add_execute(self, instruction, substituted_left_arg, substituted_right_arg):
-        substituted_left_arg.addition_with_flags(substituted_right_arg)
+    def exchange_multi_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        self.exchange_execute(self.BC, self.BC_ALT)
+        self.exchange_execute(self.DE, self.DE_ALT)
+        self.exchange_execute(self.HL, self.HL_ALT)
+
+    def exchange_args_execute(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.exchange_execute(substituted_left_arg, substituted_right_arg)
+
+    def alu_execute(self, instruction, component, entry):
+        '''
+        Stores the result from an alu table entry in component and applies its flags
+        '''
+        component.set_contents(entry & 0xFF)
+        self.apply_alu_flags(instruction, entry >> 8)
+
+    def apply_alu_flags(self, instruction, flags):
+        keep, from_result, set_mask = instruction.flag_masks
+        self.flag_register.set_contents(
+            (self.flag_register.get_contents() & keep) | (flags & from_result) | set_mask
+        )
+
+    def add_execute(self, instruction, substituted_left_arg, substituted_right_arg, carry=0):
+        if substituted_left_arg.SIZE == 1:
+            entry = ADD_TABLE[alu_index(carry, substituted_left_arg.get_contents(), substituted_right_arg)]
+            self.alu_execute(instruction, substituted_left_arg, entry)
+            return
+        substituted_left_arg.addition_with_flags(substituted_right_arg + carry)
         substituted_left_arg.set_potential_flags()
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
 
-    def sub_execute(self, instruction, substituted_left_arg, substituted_right_arg):
-        substituted_left_arg.subtraction_with_flags(substituted_right_arg)
+    def sub_execute(self, instruction, substituted_left_arg, substituted_right_arg, carry=0):
+        if substituted_left_arg.SIZE == 1:
+            entry = SUB_TABLE[alu_index(carry, substituted_left_arg.get_contents(), substituted_right_arg)]
+            self.alu_execute(instruction, substituted_left_arg, entry)
+            return
+        substituted_left_arg.subtraction_with_flags(substituted_right_arg + carry)
         substituted_left_arg.set_potential_flags(instruction=instruction)
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
 
-    def push_execute(self, instruction, substituted_left_arg):
+    def adc_execute(self, instruction, substituted_left_arg, substituted_right_arg):
+        carry = self.flag_register.get_flag(CARRY_FLAG)
+        self.add_execute(instruction, substituted_left_arg, substituted_right_arg, carry)
+
+    def sbc_execute(self, instruction, substituted_left_arg, substituted_right_arg):
+        carry = self.flag_register.get_flag(CARRY_FLAG)
+        self.sub_execute(instruction, substituted_left_arg, substituted_right_arg, carry)
+
+    def inc_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
+        if substituted_left_arg.SIZE == 1:
+            self.alu_execute(instruction, substituted_left_arg, INC_TABLE[substituted_left_arg.get_contents()])
+        else:
+            self.add_execute(instruction, substituted_left_arg, 1)
+
+    def dec_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
+        if substituted_left_arg.SIZE == 1:
+            self.alu_execute(instruction, substituted_left_arg, DEC_TABLE[substituted_left_arg.get_contents()])
+        else:
+            self.sub_execute(instruction, substituted_left_arg, 1)
+
+    def push_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         self.stack_pointer.subtraction_with_flags(1)
         self.memory.set_contents_value(
             self.stack_pointer.get_contents(),
@@ -399,7 +731,7 @@ class Z80():
             substituted_left_arg.low.get_contents()
         )
 
-    def pop_execute(self, instruction, substituted_left_arg):
+    def pop_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         low_value = self.memory.get_contents_value(self.stack_pointer.get_contents())
         substituted_left_arg.low.set_contents(low_value)
         self.stack_pointer.addition_with_flags(1)
@@ -442,6 +774,7 @@ class Z80():
     def jump_relative_execute(self, instruction, substituted_left_arg, substituted_right_arg):
         if substituted_left_arg and not self.check_flag_arg(substituted_left_arg):
             return
+        self.add_branch_taken_tstates(instruction)
         displacement = self.twos_complement(substituted_right_arg)
         if displacement > 0:
             self.program_counter.add_to_contents(displacement)
@@ -452,6 +785,7 @@ class Z80():
         self.registers_by_name["B"].subtraction_with_flags(1)
         if self.registers_by_name["B"].get_contents() == 0:
             return
+        self.add_branch_taken_tstates(instruction)
         displacement = self.twos_complement(substituted_right_arg)
         if displacement > 0:
             self.program_counter.add_to_contents(displacement)
@@ -461,71 +795,91 @@ class Z80():
     def call_execute(self, instruction, substituted_left_arg, substituted_right_arg):
         if substituted_left_arg and not self.check_flag_arg(substituted_left_arg):
             return
+        self.add_branch_taken_tstates(instruction)
         self.push_execute(instruction, self.program_counter)
         self.program_counter.set_contents_value(substituted_right_arg)
 
-    def return_execute(self, instruction, substituted_left_arg):
+    def return_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         if substituted_left_arg and not self.check_flag_arg(substituted_left_arg):
             return
+        self.add_branch_taken_tstates(instruction)
         self.pop_execute(instruction, self.program_counter)
 
-    def return_nmi_execute(self, instruction):
+    def return_nmi_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         self.pop_execute(instruction, self.program_counter)
+        self.IFF1 = self.IFF2
 
-    def return_interrupt_execute(self, instruction):
+    def return_interrupt_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        # reti copies IFF2 to IFF1 as retn does
         self.pop_execute(instruction, self.program_counter)
+        self.IFF1 = self.IFF2
+
+    def halt_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        self.halted = True
+        self.interrupt_check = True
 
-    def compare_execute(self, instruction, substituted_left_arg):
+    def disable_interrupts_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        self.IFF1 = 0
+        self.IFF2 = 0
+
+    def enable_interrupts_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        self.IFF1 = 1
+        self.IFF2 = 1
+        self.interrupt_delay = True
+        self.interrupt_check = True
+
+    def interrupt_mode_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        # The undocumented "im 0/1" opcodes set IM 0
+        self.interrupt_mode = int(instruction.left_arg)
+
+    def compare_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         a = self.registers_by_name["A"]
+        if type(substituted_left_arg) is not int:
+            substituted_left_arg = substituted_left_arg.get_contents()
+        if instruction.flag_masks:
+            entry = SUB_TABLE[alu_index(0, a.get_contents(), substituted_left_arg)]
+            self.apply_alu_flags(instruction, entry >> 8)
+            return
         a_original_contents = a.get_contents()
-        if type(substituted_left_arg) is int:
-            a.subtraction_with_flags(substituted_left_arg)
-        else:
-            a.subtraction_with_flags(substituted_left_arg.get_contents())
+        a.subtraction_with_flags(substituted_left_arg)
         a.set_potential_flags()
         self.set_flags_if_required(instruction, a.potential_flags)
         a.set_contents(a_original_contents)
 
-    def compare_inc_execute(self, instruction):
+    def compare_inc_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         hl = self.registers_by_name["HL"]
         memory_loc = self.memory.get_contents(hl.get_contents())
         self.compare_execute(instruction, memory_loc)
         hl.add_to_contents(1)
         self.registers_by_name["BC"].subtract_from_contents(1)
 
-    def compare_inc_repeat_execute(self, instruction):
-        bc = self.registers_by_name["BC"]
-        self.compare_inc_execute(instruction)
-        while not self.flag_register.get_flag(ZERO_FLAG) and bc.get_contents() != 0:
-            self.compare_inc_execute(instruction)
+    def compare_inc_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if not self.repeat_per_iteration:
+            self.compare_repeat_fast_path(instruction, 1)
+        self.repeat_execute(instruction, self.compare_inc_execute, self.compare_repeating)
 
-    def compare_dec_execute(self, instruction):
+    def compare_dec_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         hl = self.registers_by_name["HL"]
         memory_loc = self.memory.get_contents(hl.get_contents())
         self.compare_execute(instruction, memory_loc)
         hl.subtract_from_contents(1)
         self.registers_by_name["BC"].subtract_from_contents(1)
 
-    def compare_dec_repeat_execute(self, instruction):
-        bc = self.registers_by_name["BC"]
-        self.compare_dec_execute(instruction)
-        while not self.flag_register.get_flag(ZERO_FLAG) and bc.get_contents() != 0:
-            self.compare_dec_execute(instruction)
+    def compare_dec_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if not self.repeat_per_iteration:
+            self.compare_repeat_fast_path(instruction, -1)
+        self.repeat_execute(instruction, self.compare_dec_execute, self.compare_repeating)
 
-    def complement_execute(self, instruction):
+    def complement_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         a = self.registers_by_name["A"]
         a.set_contents(a.MAX_VALUE - 1 - a.get_contents())
         self.set_flags_if_required(instruction, {})
 
-    def negation_execute(self, instruction):
+    def negation_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         a = self.registers_by_name["A"]
-        a_value = a.get_contents()
-        a.set_contents(0)
-        a.subtraction_with_flags(a_value)
-        a.set_potential_flags()
-        self.set_flags_if_required(instruction, a.potential_flags)
+        self.alu_execute(instruction, a, SUB_TABLE[alu_index(0, 0, a.get_contents())])
 
-    def load_inc_execute(self, instruction):
+    def load_inc_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         memory_value = self.memory.get_contents_value(self.HL.get_contents())
         self.memory.set_contents_value(self.DE.get_contents(), memory_value)
         self.HL.add_to_contents(1)
@@ -533,7 +887,7 @@ class Z80():
         self.BC.subtract_from_contents(1)
         self.set_flags_if_required(instruction, {})
 
-    def load_dec_execute(self, instruction):
+    def load_dec_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         memory_value = self.memory.get_contents_value(self.HL.get_contents())
         self.memory.set_contents_value(self.DE.get_contents(), memory_value)
         self.HL.subtract_from_contents(1)
@@ -541,36 +895,42 @@ class Z80():
         self.BC.subtract_from_contents(1)
         self.set_flags_if_required(instruction, {})
 
-    def load_inc_repeat_execute(self, instruction):
-        while self.BC.get_contents() != 0:
-            self.load_inc_execute(instruction)
+    def load_inc_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if self.BC.get_contents() == 0:
+            return
+        if not self.repeat_per_iteration:
+            self.load_repeat_fast_path(instruction, 1)
+        self.repeat_execute(instruction, self.load_inc_execute, self.bc_not_zero)
 
-    def load_dec_repeat_execute(self, instruction):
-        while self.BC.get_contents() != 0:
-            self.load_dec_execute(instruction)
+    def load_dec_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if self.BC.get_contents() == 0:
+            return
+        if not self.repeat_per_iteration:
+            self.load_repeat_fast_path(instruction, -1)
+        self.repeat_execute(instruction, self.load_dec_execute, self.bc_not_zero)
 
-    def and_execute(self, instruction, substituted_left_arg):
+    def and_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         if type(substituted_left_arg) is not int:
             substituted_left_arg = substituted_left_arg.get_contents()
-        self.A.set_contents(self.A.get_contents() & substituted_left_arg)
-        self.A.set_potential_flags()
-        self.set_flags_if_required(instruction, self.A.potential_flags)
+        result = self.A.get_contents() & substituted_left_arg
+        self.A.set_contents(result)
+        self.apply_alu_flags(instruction, LOGIC_FLAGS_TABLE[result])
 
-    def or_execute(self, instruction, substituted_left_arg):
+    def or_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         if type(substituted_left_arg) is not int:
             substituted_left_arg = substituted_left_arg.get_contents()
-        self.A.set_contents(self.A.get_contents() | substituted_left_arg)
-        self.A.set_potential_flags()
-        self.set_flags_if_required(instruction, self.A.potential_flags)
+        result = self.A.get_contents() | substituted_left_arg
+        self.A.set_contents(result)
+        self.apply_alu_flags(instruction, LOGIC_FLAGS_TABLE[result])
 
-    def xor_execute(self, instruction, substituted_left_arg):
+    def xor_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         if type(substituted_left_arg) is not int:
             substituted_left_arg = substituted_left_arg.get_contents()
-        self.A.set_contents(self.A.get_contents() ^ substituted_left_arg)
-        self.A.set_potential_flags()
-        self.set_flags_if_required(instruction, self.A.potential_flags)
+        result = self.A.get_contents() ^ substituted_left_arg
+        self.A.set_contents(result)
+        self.apply_alu_flags(instruction, LOGIC_FLAGS_TABLE[result])
 
-    def daa_execute(self, instruction):
+    def daa_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         if not self.F.get_flag(ADD_SUBTRACT_FLAG):
             if self.F.get_flag(HALF_CARRY_FLAG) or (self.A.get_contents() & 15) > 9:
                 self.A.addition_with_flags(6)
@@ -612,69 +972,73 @@ class Z80():
 
     def in_execute(self, instruction, substituted_left_arg, substituted_right_arg):
         if type(substituted_left_arg) is not int:
-            value = self.ports.get_contents_value(substituted_right_arg)
+            value = self.io.read(substituted_right_arg)
         else:
-            value = self.ports.get_contents_value(substituted_left_arg)
+            value = self.io.read(substituted_left_arg)
             substituted_left_arg = Component("temp")
         substituted_left_arg.set_contents(value)
         substituted_left_arg.set_potential_flags()
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
 
-    def in_inc_execute(self, instruction):
-        in_value = self.ports.get_contents_value(self.C.get_contents())
+    def in_inc_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        in_value = self.io.read(self.BC.get_contents())
         self.memory.set_contents_value(self.HL.get_contents(), in_value)
         self.HL.add_to_contents(1)
         self.B.subtraction_with_flags(1)
         self.B.set_potential_flags()
         self.set_flags_if_required(instruction, self.B.potential_flags)
 
-    def in_inc_repeat_execute(self, instruction):
-        while self.B.get_contents() != 0:
-            self.in_inc_execute(instruction) 
+    def in_inc_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if self.B.get_contents() == 0:
+            return
+        self.repeat_execute(instruction, self.in_inc_execute, self.b_not_zero)
 
-    def in_dec_execute(self, instruction):
-        in_value = self.ports.get_contents_value(self.C.get_contents())
+    def in_dec_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        in_value = self.io.read(self.BC.get_contents())
         self.memory.set_contents_value(self.HL.get_contents(), in_value)
         self.HL.subtraction_with_flags(1)
         self.B.subtraction_with_flags(1)
         self.B.set_potential_flags()
         self.set_flags_if_required(instruction, self.B.potential_flags)
 
-    def in_dec_repeat_execute(self, instruction):
-        while self.B.get_contents() != 0:
-            self.in_dec_execute(instruction) 
+    def in_dec_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if self.B.get_contents() == 0:
+            return
+        self.repeat_execute(instruction, self.in_dec_execute, self.b_not_zero)
 
     def out_execute(self, instruction, substituted_left_arg, substituted_right_arg):
-        self.ports.set_contents_value(substituted_left_arg, substituted_right_arg)
+        # out (c),0 has "0" as a special arg, so it arrives as a string
+        self.io.write(substituted_left_arg, int(substituted_right_arg))
 
-    def out_inc_execute(self, instruction):
+    def out_inc_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         out_value = self.memory.get_contents_value(self.HL.get_contents())
         self.B.subtraction_with_flags(1, False)
-        self.ports.set_contents_value(self.C.get_contents(), out_value)
+        self.io.write(self.BC.get_contents(), out_value)
         self.HL.add_to_contents(1)
         self.set_flags_if_required(instruction, None)
 
-    def out_inc_repeat_execute(self, instruction):
-        while self.B.get_contents() != 0:
-            self.out_inc_execute(instruction) 
+    def out_inc_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if self.B.get_contents() == 0:
+            return
+        self.repeat_execute(instruction, self.out_inc_execute, self.b_not_zero)
 
-    def out_dec_execute(self, instruction):
+    def out_dec_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         out_value = self.memory.get_contents_value(self.HL.get_contents())
         self.B.subtraction_with_flags(1, False)
-        self.ports.set_contents_value(self.C.get_contents(), out_value)
+        self.io.write(self.BC.get_contents(), out_value)
         self.HL.subtraction_with_flags(1)
         self.set_flags_if_required(instruction, None)
 
-    def out_dec_repeat_execute(self, instruction):
-        while self.B.get_contents() != 0:
-            self.out_dec_execute(instruction) 
+    def out_dec_repeat_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
+        if self.B.get_contents() == 0:
+            return
+        self.repeat_execute(instruction, self.out_dec_execute, self.b_not_zero)
 
     def rot_left_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        bl = substituted_left_arg.convert_contents_to_bit_list()
+        contents = substituted_left_arg.get_contents()
         c_flag = self.flag_register.get_flag(CARRY_FLAG)
-        c_value = bl[0]
-        rot_bl = bl[1:] + [c_flag]
-        substituted_left_arg.convert_bit_list_to_contents(rot_bl)
+        c_value = contents >> 7
+        substituted_left_arg.set_contents(((contents << 1) & 0xFF) | c_flag)
         substituted_left_arg.set_potential_flags()
         substituted_left_arg.potential_flags[CARRY_FLAG] = c_value
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
@@ -682,34 +1046,29 @@ class Z80():
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
     def rot_left_c_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        bl = substituted_left_arg.convert_contents_to_bit_list()
-        c_value = bl[0]
-        rot_bl = bl[1:] + [bl[0]]
-        substituted_left_arg.convert_bit_list_to_contents(rot_bl)
+        contents = substituted_left_arg.get_contents()
+        c_value = contents >> 7
+        substituted_left_arg.set_contents(((contents << 1) & 0xFF) | c_value)
         substituted_left_arg.set_potential_flags()
         substituted_left_arg.potential_flags[CARRY_FLAG] = c_value
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         if substituted_right_arg:
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
-    def rot_left_dec_execute(self, instruction):
+    def rot_left_dec_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         mem_loc = self.memory.get_contents(self.HL.get_contents())
-        mem_bl = mem_loc.convert_contents_to_bit_list()
-        a_bl = self.A.convert_contents_to_bit_list()
-        mem_bl_hi = list(mem_bl[:4])
-        mem_bl = mem_bl[4:] + a_bl[4:]
-        a_bl = a_bl[:4] + mem_bl_hi
-        mem_loc.convert_bit_list_to_contents(mem_bl)
-        self.A.convert_bit_list_to_contents(a_bl)
+        mem_value = mem_loc.get_contents()
+        a_value = self.A.get_contents()
+        mem_loc.set_contents(((mem_value & 0x0F) << 4) | (a_value & 0x0F))
+        self.A.set_contents((a_value & 0xF0) | (mem_value >> 4))
         self.A.set_potential_flags()
         self.set_flags_if_required(instruction, self.A.potential_flags)
 
     def rot_right_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        bl = substituted_left_arg.convert_contents_to_bit_list()
+        contents = substituted_left_arg.get_contents()
         c_flag = self.flag_register.get_flag(CARRY_FLAG)
-        c_value = bl[7]
-        rot_bl = [c_flag] + bl[:7]
-        substituted_left_arg.convert_bit_list_to_contents(rot_bl)
+        c_value = contents & 1
+        substituted_left_arg.set_contents((c_flag << 7) | (contents >> 1))
         substituted_left_arg.set_potential_flags()
         substituted_left_arg.potential_flags[CARRY_FLAG] = c_value
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
@@ -717,110 +1076,88 @@ class Z80():
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
     def rot_right_c_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        bl = substituted_left_arg.convert_contents_to_bit_list()
-        c_value = bl[7]
-        rot_bl = [c_value] + bl[:7]
-        substituted_left_arg.convert_bit_list_to_contents(rot_bl)
+        contents = substituted_left_arg.get_contents()
+        c_value = contents & 1
+        substituted_left_arg.set_contents((c_value << 7) | (contents >> 1))
         substituted_left_arg.set_potential_flags()
         substituted_left_arg.potential_flags[CARRY_FLAG] = c_value
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         if substituted_right_arg:
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
-    def rot_right_dec_execute(self, instruction):
+    def rot_right_dec_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         mem_loc = self.memory.get_contents(self.HL.get_contents())
-        mem_bl = mem_loc.convert_contents_to_bit_list()
-        a_bl = self.A.convert_contents_to_bit_list()
-        mem_bl_low = list(mem_bl[4:])
-        mem_bl = a_bl[4:] + mem_bl[:4]
-        a_bl = a_bl[:4] + mem_bl_low
-        mem_loc.convert_bit_list_to_contents(mem_bl)
-        self.A.convert_bit_list_to_contents(a_bl)
+        mem_value = mem_loc.get_contents()
+        a_value = self.A.get_contents()
+        mem_loc.set_contents(((a_value & 0x0F) << 4) | (mem_value >> 4))
+        self.A.set_contents((a_value & 0xF0) | (mem_value & 0x0F))
         self.A.set_potential_flags()
         self.set_flags_if_required(instruction, self.A.potential_flags)
 
     def shift_left_a_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        new_c, bl  = substituted_left_arg.split_bit_list_at_bit_pos(6)
-        substituted_left_arg.convert_bit_list_to_contents(bl + [0])
+        contents = substituted_left_arg.get_contents()
+        substituted_left_arg.set_contents((contents << 1) & 0xFF)
         substituted_left_arg.set_potential_flags()
-        substituted_left_arg.potential_flags[CARRY_FLAG] = new_c[0]
-        if substituted_left_arg.parity():
-            substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = True
-        else:
-             substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = False
+        substituted_left_arg.potential_flags[CARRY_FLAG] = contents >> 7
+        substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = substituted_left_arg.parity()
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         if substituted_right_arg:
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
     def shift_left_l_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        new_c, bl  = substituted_left_arg.split_bit_list_at_bit_pos(6)
-        substituted_left_arg.convert_bit_list_to_contents(bl + [1])
+        contents = substituted_left_arg.get_contents()
+        substituted_left_arg.set_contents(((contents << 1) & 0xFF) | 1)
         substituted_left_arg.set_potential_flags()
-        substituted_left_arg.potential_flags[CARRY_FLAG] = new_c[0]
-        if substituted_left_arg.parity():
-            substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = True
-        else:
-             substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = False
+        substituted_left_arg.potential_flags[CARRY_FLAG] = contents >> 7
+        substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = substituted_left_arg.parity()
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         if substituted_right_arg:
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
     def shift_right_a_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        bl, new_c  = substituted_left_arg.split_bit_list_at_bit_pos(0)
-        substituted_left_arg.convert_bit_list_to_contents([bl[0]] + bl)
+        contents = substituted_left_arg.get_contents()
+        substituted_left_arg.set_contents((contents & 0x80) | (contents >> 1))
         substituted_left_arg.set_potential_flags()
-        substituted_left_arg.potential_flags[CARRY_FLAG] = new_c[0]
-        if substituted_left_arg.parity():
-            substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = True
-        else:
-             substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = False
+        substituted_left_arg.potential_flags[CARRY_FLAG] = contents & 1
+        substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = substituted_left_arg.parity()
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         if substituted_right_arg:
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
     def shift_right_l_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
-        bl, new_c  = substituted_left_arg.split_bit_list_at_bit_pos(0)
-        substituted_left_arg.convert_bit_list_to_contents([0] + bl)
+        contents = substituted_left_arg.get_contents()
+        substituted_left_arg.set_contents(contents >> 1)
         substituted_left_arg.set_potential_flags()
-        substituted_left_arg.potential_flags[CARRY_FLAG] = new_c[0]
-        if substituted_left_arg.parity():
-            substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = True
-        else:
-             substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = False
+        substituted_left_arg.potential_flags[CARRY_FLAG] = contents & 1
+        substituted_left_arg.potential_flags[PARITY_OVERFLOW_FLAG] = substituted_left_arg.parity()
         self.set_flags_if_required(instruction, substituted_left_arg.potential_flags)
         if substituted_right_arg:
             substituted_right_arg.set_contents(substituted_left_arg.get_contents())
 
-    def convert_carry_flag_execute(self, instruction):
+    def convert_carry_flag_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         if self.flag_register.get_flag(CARRY_FLAG):
             potential_flags = {CARRY_FLAG: False}
         else:
             potential_flags = {CARRY_FLAG: True}
         self.set_flags_if_required(instruction, potential_flags)
 
-    def set_carry_flag_execute(self, instruction):
+    def set_carry_flag_execute(self, instruction, substituted_left_arg=None, substituted_right_arg=None):
         self.set_flags_if_required(instruction, None)
 
-    def restart_execute(self, instruction, substituted_left_arg):
+    def restart_execute(self, instruction, substituted_left_arg, substituted_right_arg=None):
         self.push_execute(instruction, self.program_counter)
         self.program_counter.set_contents_value(substituted_left_arg)
 
     def reset_execute(self, instruction, substituted_left_arg, substituted_right_arg):
-        bit_list = substituted_right_arg.convert_contents_to_bit_list()
-        bit_list[7 - substituted_left_arg] = 0
-        substituted_right_arg.convert_bit_list_to_contents(bit_list)
-        args = instruction.text.split(",")
-        if len(args) == 3:
-            third_arg = self.registers_by_name[args[2].capitalize()]
+        substituted_right_arg.set_contents(substituted_right_arg.get_contents() & ~(1 << substituted_left_arg))
+        if instruction.copy_to_register:
+            third_arg = self.registers_by_name[instruction.copy_to_register]
             third_arg.set_contents(substituted_right_arg.get_contents())
 
     def set_execute(self, instruction, substituted_left_arg, substituted_right_arg):
-        bit_list = substituted_right_arg.convert_contents_to_bit_list()
-        bit_list[7 - substituted_left_arg] = 1
-        substituted_right_arg.convert_bit_list_to_contents(bit_list)
-        args = instruction.text.split(",")
-        if len(args) == 3:
-            third_arg = self.registers_by_name[args[2].capitalize()]
+        substituted_right_arg.set_contents(substituted_right_arg.get_contents() | (1 << substituted_left_arg))
+        if instruction.copy_to_register:
+            third_arg = self.registers_by_name[instruction.copy_to_register]
             third_arg.set_contents(substituted_right_arg.get_contents())
 
     def substitute_arg(self, arg, opposite_arg, special=False):
@@ -835,10 +1172,10 @@ class Z80():
             return self.registers_by_name[arg.upper()]
         if "(" in arg:
             arg = arg[1:-1]
-            if arg == "c":   # in/out (c) specifies port
-                return self.registers_by_name["C"].get_contents()
-            if arg == "*":   # in/out (*) specifies port
-                return self.read_memory_and_increment_pc()[0]
+            if arg == "c":   # in/out (c) specifies port, with B on the high byte
+                return self.registers_by_name["BC"].get_contents()
+            if arg == "*":   # in/out (*) specifies port, with A on the high byte
+                return (self.A.get_contents() << 8) | self.read_memory_and_increment_pc()[0]
             if arg.upper() in self.registers_by_name:
                 address = self.registers_by_name[arg.upper()].get_contents()
                 # bit n, (hl) check
@@ -979,60 +1316,212 @@ class Z80():
             return value
         return value - 256
 
-    def undocumented_behaviour(self, instruction, substituted_left_arg, substituted_right_arg):
-        if instruction.instruction_base in [LOAD_DEC]:
-            transfered_byte = self.memory.get_contents_value(self.HL.get_contents() + 1)
-            temp_comp = Component("temp")
-            temp_comp.set_contents(transfered_byte)
-            self.F.set_bit_position(3, temp_comp.get_bit_position(1))
-            self.F.set_bit_position(5, temp_comp.get_bit_position(3))
-            return
+    def copy_undocumented_bits(self, component):
+        self.F.set_undocumented_bits(component.get_contents())
+
+    def load_dec_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        transfered_byte = self.memory.get_contents_value(self.HL.get_contents() + 1)
+        # bit 1 goes to flag bit 5 and bit 3 to flag bit 3
+        self.F.set_undocumented_bits((transfered_byte << 2) & 0xFF)
+
+    def compare_dec_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
         # he value of HF flag, which is set or reset by the hypothetical CP (HL). So, n = A - (HL) - HF.
-        if instruction.instruction_base in [COMPARE_DEC]:
-            memory_value = self.memory.get_contents_value(self.HL.get_contents() + 1)
-            n = self.A.get_contents() - memory_value - self.F.get_flag(HALF_CARRY_FLAG)
-            if n < 0:
-                n = 256 + n
-            temp_comp = Component("temp")
-            temp_comp.set_contents(n)
-            self.F.set_bit_position(3, temp_comp.get_bit_position(1))
-            self.F.set_bit_position(5, temp_comp.get_bit_position(3))
-        if instruction.instruction_base in [IN_INC, IN_DEC, INC, DEC, ADD, ADC, SUB, SBC, ROT_RIGHT_C_ACC, DAA, COMPLEMENT, SET_CARRY_FLAG, CONVERT_CARRY_FLAG, AND, OR, XOR, COMPARE, ROT_LEFT_C, ROT_RIGHT_C, ROT_LEFT, ROT_RIGHT_C, ROT_RIGHT, SHIFT_LEFT_A, SHIFT_RIGHT_A, SHIFT_LEFT_L, SHIFT_RIGHT_L, BIT, NEGATION, IN, LOAD, ADC, ROT_LEFT_DEC, LOAD_INC]:
-            sixteen_bit_flag = False
-            if instruction.flags == "------":
-                return
-            if instruction.instruction_base in [DAA, COMPLEMENT, SET_CARRY_FLAG, CONVERT_CARRY_FLAG, SUB, AND, OR, XOR, NEGATION, ROT_LEFT_DEC]:
-                substituted_left_arg = self.A
-            if instruction.instruction_base in [BIT]:
-                if substituted_left_arg == 7 and substituted_right_arg.get_contents() >= 128:
-                    self.F.set_flag(SIGN_FLAG)
-                else:
-                    self.F.reset_flag(SIGN_FLAG)
-                if self.F.get_flag(ZERO_FLAG):
-                    self.F.set_flag(PARITY_OVERFLOW_FLAG)
-                else:
-                    self.F.reset_flag(PARITY_OVERFLOW_FLAG)
-                if instruction.right_arg in ["(ix+*)", "(iy+*)"]:
-                    temp_comp = Component("temp")
-                    temp_comp.set_contents(substituted_right_arg.name // 256)
-                    substituted_left_arg = temp_comp
-                else:
-                    substituted_left_arg = substituted_right_arg
-            elif instruction.text in ["in (c)", "cp *"]:
-                    temp_comp = Component("temp")
-                    temp_comp.set_contents(self.ports.get_contents_value(substituted_left_arg))
-                    substituted_left_arg = temp_comp
-            elif instruction.instruction_base in [LOAD_INC]:
-                memory_value = self.memory.get_contents_value(self.HL.get_contents() - 1)
-                temp_comp = Component("temp")
-                temp_comp.set_contents(memory_value)
-                substituted_left_arg = temp_comp
-            elif instruction.instruction_base in [IN_INC, IN_DEC]:
-                substituted_left_arg = self.B
-            if substituted_left_arg.SIZE == 2:
-                sixteen_bit_flag = True
-                substituted_left_arg = substituted_left_arg.high
-            self.F.set_bit_position(5, substituted_left_arg.get_bit_position(5))
-            self.F.set_bit_position(3, substituted_left_arg.get_bit_position(3))
-#            if instruction.instruction_base in [ADD, ADC] and sixteen_bit_flag:
-#                self.F.set_bit_position(4, substituted_left_arg.get_bit_position(4))
+        memory_value = self.memory.get_contents_value(self.HL.get_contents() + 1)
+        n = self.A.get_contents() - memory_value - self.F.get_flag(HALF_CARRY_FLAG)
+        if n < 0:
+            n = 256 + n
+        self.F.set_undocumented_bits((n << 2) & 0xFF)
+
+    def left_arg_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        if substituted_left_arg.SIZE == 2:
+            substituted_left_arg = substituted_left_arg.high
+        self.copy_undocumented_bits(substituted_left_arg)
+
+    def accumulator_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.copy_undocumented_bits(self.A)
+
+    def b_register_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.copy_undocumented_bits(self.B)
+
+    def operand_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.F.set_undocumented_bits(substituted_left_arg)
+
+    def in_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.F.set_undocumented_bits(self.io.data)
+
+    def load_inc_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        memory_value = self.memory.get_contents_value(self.HL.get_contents() - 1)
+        self.F.set_undocumented_bits(memory_value)
+
+    def bit_flags_undocumented(self, substituted_left_arg, substituted_right_arg):
+        if substituted_left_arg == 7 and substituted_right_arg.get_contents() >= 128:
+            self.F.set_flag(SIGN_FLAG)
+        else:
+            self.F.reset_flag(SIGN_FLAG)
+        if self.F.get_flag(ZERO_FLAG):
+            self.F.set_flag(PARITY_OVERFLOW_FLAG)
+        else:
+            self.F.reset_flag(PARITY_OVERFLOW_FLAG)
+
+    def bit_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.bit_flags_undocumented(substituted_left_arg, substituted_right_arg)
+        self.copy_undocumented_bits(substituted_right_arg)
+
+    def indexed_bit_undocumented(self, instruction, substituted_left_arg, substituted_right_arg):
+        self.bit_flags_undocumented(substituted_left_arg, substituted_right_arg)
+        self.F.set_undocumented_bits(substituted_right_arg.name // 256)
+
+
+EXECUTE_METHOD_NAMES = {
+    NO_OPERATION: "nop_execute",
+    LOAD: "load_execute",
+    EXCHANGE_MULTI: "exchange_multi_execute",
+    EXCHANGE: "exchange_args_execute",
+    ADD: "add_execute",
+    SUB: "sub_execute",
+    ADC: "adc_execute",
+    SBC: "sbc_execute",
+    INC: "inc_execute",
+    DEC: "dec_execute",
+    PUSH: "push_execute",
+    POP: "pop_execute",
+    JUMP: "jump_execute",
+    JUMP_RELATIVE: "jump_relative_execute",
+    DEC_JUMP_RELATIVE: "dec_jump_relative_execute",
+    CALL: "call_execute",
+    RETURN: "return_execute",
+    RETURN_NMI: "return_nmi_execute",
+    RETURN_INTERRUPT: "return_interrupt_execute",
+    HALT: "halt_execute",
+    DISABLE_INTERRUPTS: "disable_interrupts_execute",
+    ENABLE_INTERRUPTS: "enable_interrupts_execute",
+    INTERRUPT_MODE: "interrupt_mode_execute",
+    COMPARE: "compare_execute",
+    COMPARE_INC: "compare_inc_execute",
+    COMPARE_INC_REPEAT: "compare_inc_repeat_execute",
+    COMPARE_DEC: "compare_dec_execute",
+    COMPARE_DEC_REPEAT: "compare_dec_repeat_execute",
+    COMPLEMENT: "complement_execute",
+    NEGATION: "negation_execute",
+    LOAD_INC: "load_inc_execute",
+    LOAD_DEC: "load_dec_execute",
+    LOAD_INC_REPEAT: "load_inc_repeat_execute",
+    LOAD_DEC_REPEAT: "load_dec_repeat_execute",
+    AND: "and_execute",
+    OR: "or_execute",
+    XOR: "xor_execute",
+    DAA: "daa_execute",
+    BIT: "bit_execute",
+    IN: "in_execute",
+    IN_INC: "in_inc_execute",
+    IN_INC_REPEAT: "in_inc_repeat_execute",
+    IN_DEC: "in_dec_execute",
+    IN_DEC_REPEAT: "in_dec_repeat_execute",
+    OUT: "out_execute",
+    OUT_INC: "out_inc_execute",
+    OUT_INC_REPEAT: "out_inc_repeat_execute",
+    OUT_DEC: "out_dec_execute",
+    OUT_DEC_REPEAT: "out_dec_repeat_execute",
+    ROT_LEFT: "rot_left_execute",
+    ROT_LEFT_ACC: "rot_left_execute",
+    ROT_LEFT_C: "rot_left_c_execute",
+    ROT_LEFT_C_ACC: "rot_left_c_execute",
+    ROT_LEFT_DEC: "rot_left_dec_execute",
+    ROT_RIGHT: "rot_right_execute",
+    ROT_RIGHT_ACC: "rot_right_execute",
+    ROT_RIGHT_C: "rot_right_c_execute",
+    ROT_RIGHT_C_ACC: "rot_right_c_execute",
+    ROT_RIGHT_DEC: "rot_right_dec_execute",
+    SHIFT_LEFT_A: "shift_left_a_execute",
+    SHIFT_LEFT_L: "shift_left_l_execute",
+    SHIFT_RIGHT_A: "shift_right_a_execute",
+    SHIFT_RIGHT_L: "shift_right_l_execute",
+    CONVERT_CARRY_FLAG: "convert_carry_flag_execute",
+    SET_CARRY_FLAG: "set_carry_flag_execute",
+    RESTART: "restart_execute",
+    RESET: "reset_execute",
+    SET: "set_execute",
+}
+
+# Instructions that copy bits 5 and 3 of a result into F
+UNDOCUMENTED_FLAG_INSTRUCTIONS = [
+    IN_INC, IN_DEC, INC, DEC, ADD, ADC, SUB, SBC, ROT_RIGHT_C_ACC, DAA, COMPLEMENT, SET_CARRY_FLAG,
+    CONVERT_CARRY_FLAG, AND, OR, XOR, COMPARE, ROT_LEFT_C, ROT_RIGHT_C, ROT_LEFT, ROT_RIGHT,
+    SHIFT_LEFT_A, SHIFT_RIGHT_A, SHIFT_LEFT_L, SHIFT_RIGHT_L, BIT, NEGATION, IN, LOAD, ROT_LEFT_DEC,
+    LOAD_INC,
+]
+
+# Of those, the ones whose result is in A whatever the left arg is
+ACCUMULATOR_RESULT_INSTRUCTIONS = [
+    DAA, COMPLEMENT, SET_CARRY_FLAG, CONVERT_CARRY_FLAG, SUB, AND, OR, XOR, NEGATION, ROT_LEFT_DEC,
+]
+
+
+def undocumented_strategy(instruction):
+    '''
+    Picks the name of the Z80 method that applies the undocumented flag behaviour of an
+    instruction, or None if it has none.
+    '''
+    if instruction.instruction_base == LOAD_DEC:
+        return "load_dec_undocumented"
+    if instruction.instruction_base == COMPARE_DEC:
+        return "compare_dec_undocumented"
+    if instruction.instruction_base not in UNDOCUMENTED_FLAG_INSTRUCTIONS or instruction.flags == "------":
+        return None
+    if instruction.instruction_base == BIT:
+        if instruction.right_arg in ["(ix+*)", "(iy+*)"]:
+            return "indexed_bit_undocumented"
+        return "bit_undocumented"
+    if instruction.text == "in (c)":
+        return "in_undocumented"
+    if instruction.text == "cp *":
+        # cp copies bits 5 and 3 of its operand rather than of the result
+        return "operand_undocumented"
+    if instruction.instruction_base == LOAD_INC:
+        return "load_inc_undocumented"
+    if instruction.instruction_base in [IN_INC, IN_DEC]:
+        return "b_register_undocumented"
+    if instruction.instruction_base in ACCUMULATOR_RESULT_INSTRUCTIONS:
+        return "accumulator_undocumented"
+    return "left_arg_undocumented"
+
+
+def copy_to_register(instruction):
+    '''
+    The register that undocumented res/set (ix+*),r also write the result to
+    '''
+    args = instruction.text.split(",")
+    if len(args) == 3:
+        return args[2].capitalize()
+    return None
+
+
+# Names of the Z80 methods in Z80.handlers
+HANDLER_NAMES = []
+HANDLER_INDEXES = {}
+
+
+def handler_index(name):
+    '''
+    The index of a Z80 method in HANDLER_NAMES, adding it if needed
+    '''
+    if name not in HANDLER_INDEXES:
+        HANDLER_INDEXES[name] = len(HANDLER_NAMES)
+        HANDLER_NAMES.append(name)
+    return HANDLER_INDEXES[name]
+
+
+def bind_instructions(instructions):
+    '''
+    Stores the index of the method that runs each instruction and of its undocumented
+    flag method, if any, in each Z80's handlers table
+    '''
+    for instruction in instructions:
+        instruction.execute_index = handler_index(EXECUTE_METHOD_NAMES.get(instruction.instruction_base, "nop_execute"))
+        undocumented_name = undocumented_strategy(instruction)
+        instruction.undocumented_index = None if undocumented_name is None else handler_index(undocumented_name)
+        instruction.copy_to_register = copy_to_register(instruction)
+        instruction.flag_masks = compile_flag_template(instruction.flags)
+
+
+bind_instructions(instructions)